@@ -43,19 +43,22 @@ __version__ = "2.4.0"
 
 __all__ = [
  'AboutDialog', 
- 'AnnotateEngine', 'Annotator', 
+ 'AnnotateEngine', 'Annotator', 'AnnotatePool', 'runAnnotateDB', 
  'ChessMainWindow', 'runMzChess', 
  'BuildFenClass', 'runFenBuilder', 
  'AnalysePositionClass', 'runAnalysePosition', 
  'installLeipFont'
- 'ChessEngine', 
+ 'ChessEngine', 'UCIProtocol', 'AsyncChessEngine', 'analysePositions', 'AnalysisCache', 
  'ConfigureEngine', 'loadEngineSettings', 'saveEngineSettings', 
  'ConfigureEngineOptions',  
  'ECODatabase', 'TSVType', 
  'GameHeaderView', 'KeyType', 
- 'GameListTableModel', 'GameListTableView', 
+ 'GameListTableModel', 'GameListProxyModel', 'GameListTableView', 
  'HelpBrowser', 
- 'checkFEN','read_game', 'read_board', 'read_headers', 'skip_game', 'PGNLexer', 
+ 'checkFEN','read_game', 'read_board', 'read_headers', 'skip_game', 'PGNLexer', 'PGNTokenizer', 'SANCache', 'PGNReader', 'PGNIndex', 'HeaderIndex', 'read_game_at', 'IndexedGameList', 'read_games_parallel', 
+ 'HeaderFilter', 'PositionFilter', 'write_games_parallel', 'runPGNExport', 
+ 'GameStore', 'RecoveryJournal', 
+ 'PositionIndex', 'OpeningTree', 
  'QBoardViewClass', 'Piece', 'Game', 
  'ScorePlot', 
  'ButtonLine', 'ItemSelector', 'treeWidgetItemPos', 
@@ -80,16 +83,22 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from postInstall import postInstall
 from .AboutDialog import AboutDialog
-from .annotateEngine import AnnotateEngine,  Annotator
+from .annotateEngine import AnnotateEngine,  Annotator, AnnotatePool, runAnnotateDB
 from .installLeipFont import installLeipFont
 from .chessengine import ChessEngine
+from .uciProtocol import UCIProtocol
+from .asyncEngine import AsyncChessEngine, analysePositions
+from .analysisCache import AnalysisCache
 from .configureEngine import ConfigureEngine, loadEngineSettings, saveEngineSettings
 from .configureEngineOptions import ConfigureEngineOptions
 from .eco import ECODatabase, TSVType
 from .gameheaderview import GameHeaderView, KeyType
-from .gamelisttableview import GameListTableModel, GameListTableView
+from .gamelisttableview import GameListTableModel, GameListProxyModel, GameListTableView
 from .helpDialog import HelpBrowser
-from .pgnParse import checkFEN, read_game, read_board, read_headers, skip_game, PGNLexer
+from .gameStore import GameStore, RecoveryJournal
+from .pgnParse import checkFEN, read_game, read_board, read_headers, skip_game, PGNLexer, PGNTokenizer, SANCache, PGNReader, PGNIndex, HeaderIndex, read_game_at, IndexedGameList, read_games_parallel, \
+ HeaderFilter, PositionFilter, write_games_parallel, runPGNExport
+from .positionIndex import PositionIndex, OpeningTree
 from .qboardviewclass import QBoardViewClass, Piece, Game
 from .scoreplotgraphicsview import ScorePlot
 from .specialDialogs import ButtonLine, ItemSelector, treeWidgetItemPos
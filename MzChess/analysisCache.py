@@ -0,0 +1,122 @@
+'''A persistent cache of engine results (*.sqlite* files)
+
+.. _sqlite3: https://docs.python.org/3/library/sqlite3.html
+'''
+
+from typing import Dict, Optional, Tuple, Union
+import pickle
+import sqlite3
+
+import chess, chess.engine, chess.polyglot
+
+class AnalysisCache(object):
+ '''A persistent least recently used cache of engine results stored with `sqlite3`_
+
+A result is the *chess.engine.PlayResult* of a search, i.e. best move, ponder move and the *info*
+(score and pv) of every multipv line. It is keyed by the *chess.polyglot.zobrist_hash* of the position,
+the name of the engine, the values of the engine options and the limit of the search (see *key*).
+Engines using the cache (see *UCIProtocol.setAnalysisCache*) look up a position before sending *go*
+and store the result of every search, i.e. hints, scores and annotations share their results.
+
+When the cache holds more than ``maxEntries`` results, the least recently used ones are evicted.
+
+:param cacheFile: path of the database, ``None`` keeps the cache in memory
+:param maxEntries: maximum number of cached results
+ '''
+ version = 1
+
+ def __init__(self, cacheFile : Optional[str] = None, maxEntries : int = 100000) -> None:
+  self.cacheFile = cacheFile
+  self.maxEntries = max(1, int(maxEntries))
+  self.hits = 0
+  self.misses = 0
+  if cacheFile is None:
+   cacheFile = ':memory:'
+  self.connection = sqlite3.connect(cacheFile, isolation_level = None)
+  self.connection.execute('PRAGMA journal_mode = WAL')
+  self.connection.execute('PRAGMA synchronous = NORMAL')
+  if self.connection.execute('PRAGMA user_version').fetchone()[0] != self.version:
+   self.connection.execute('DROP TABLE IF EXISTS analysis')
+   self.connection.execute('PRAGMA user_version = {}'.format(self.version))
+  self.connection.execute('''CREATE TABLE IF NOT EXISTS analysis (
+    hash INTEGER, engine TEXT, setting TEXT, result BLOB, used INTEGER,
+    PRIMARY KEY (hash, engine, setting))''')
+  self.connection.execute('CREATE INDEX IF NOT EXISTS analysisUsed ON analysis (used)')
+  self.used = self.connection.execute('SELECT COALESCE(MAX(used), 0) FROM analysis').fetchone()[0]
+  self.size = self.connection.execute('SELECT COUNT(*) FROM analysis').fetchone()[0]
+
+ def __len__(self) -> int:
+  return self.size
+
+ @staticmethod
+ def key(board : chess.Board,
+              engineName : str,
+              optionValues : Dict[str, Union[str, int, bool, None]],
+              limit : chess.engine.Limit) -> Tuple[int, str, str]:
+  '''Builds the key of a search
+
+:param board: position to be searched
+:param engineName: name of the engine (see *idDict*)
+:param optionValues: values of the engine options set by *uciSetOption*
+:param limit: limit of the search
+:returns: key for *get* and *put*
+  '''
+  positionHash = chess.polyglot.zobrist_hash(board)
+  if positionHash >= 1 << 63:
+   positionHash -= 1 << 64
+  setting = repr((sorted((name, str(value)) for name, value in optionValues.items()), repr(limit)))
+  return positionHash, engineName, setting
+
+ def get(self, key : Tuple[int, str, str]) -> Optional[chess.engine.PlayResult]:
+  '''Looks up a search and marks it as recently used
+
+:param key: key of the search (see *key*)
+:returns: the result or ``None``
+  '''
+  row = self.connection.execute('SELECT result FROM analysis WHERE hash = ? AND engine = ? AND setting = ?', key).fetchone()
+  if row is None:
+   self.misses += 1
+   return None
+  self.hits += 1
+  self.used += 1
+  self.connection.execute('UPDATE analysis SET used = ? WHERE hash = ? AND engine = ? AND setting = ?', (self.used, ) + tuple(key))
+  move, ponder, infoList = pickle.loads(row[0])
+  playResult = chess.engine.PlayResult(move, ponder, draw_offered = None, resigned = None)
+  playResult.info = infoList
+  return playResult
+
+ def put(self, key : Tuple[int, str, str], playResult : chess.engine.PlayResult) -> None:
+  '''Stores the result of a search, the least recently used results are evicted if required
+
+:param key: key of the search (see *key*)
+:param playResult: result of the search
+  '''
+  infoList = playResult.info
+  if not isinstance(infoList, list):
+   infoList = [infoList]
+  result = pickle.dumps((playResult.move, playResult.ponder, infoList))
+  isNew = self.connection.execute('SELECT 1 FROM analysis WHERE hash = ? AND engine = ? AND setting = ?', key).fetchone() is None
+  self.used += 1
+  self.connection.execute('INSERT OR REPLACE INTO analysis (hash, engine, setting, result, used) VALUES (?, ?, ?, ?, ?)',
+    tuple(key) + (result, self.used))
+  if isNew:
+   self.size += 1
+  if self.size > self.maxEntries:
+   self._evict(self.size - self.maxEntries + self.maxEntries//10)
+
+ def _evict(self, count : int) -> None:
+  cursor = self.connection.execute('DELETE FROM analysis WHERE used IN (SELECT used FROM analysis ORDER BY used LIMIT ?)', (count, ))
+  self.size -= cursor.rowcount
+
+ def clear(self) -> None:
+  '''Removes all results
+  '''
+  self.connection.execute('DELETE FROM analysis')
+  self.size = 0
+
+ def close(self) -> None:
+  '''Closes the database, the cache cannot be used anymore
+  '''
+  if self.connection is not None:
+   self.connection.close()
+   self.connection = None
@@ -3,9 +3,12 @@
 .. _fiekas.eco: https://github.com/niklasf/eco
 '''
 
-from typing import Callable, List, Union, Optional, Tuple
+from typing import Callable, Dict, Iterable, List, Union, Optional, Tuple
 import sys
 import os.path
+import time
+import functools
+import collections
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import MzChess
@@ -15,8 +18,9 @@ if MzChess.useQt5():
 else:
  from PyQt6 import QtCore
 
-import chess, chess.pgn
+import chess, chess.pgn, chess.engine
 from chessengine import ChessEngine, PGNEval_REGEX
+from analysisCache import AnalysisCache
 
 class Annotator():
  '''A Annotator class applying 
@@ -213,16 +217,35 @@ class Annotator():
    gameNode = gameNode.next()
   return anyHintsAdded
 
+def _collectResult(engine : ChessEngine, hintPLYs : int) -> Tuple[List[Optional[str]], List[List[chess.Move]]]:
+ scoreList = list()
+ pvList = list()
+ for hintID, info in enumerate(engine.getInfoList()):
+  if hintPLYs > 0:
+   if 'pv' in info:
+    pvList.append(info['pv'][:hintPLYs])
+   else:
+    pvList.append([])
+  scoreList.append(engine.getScore(hintID = hintID))
+ return scoreList, pvList
+
 class AnnotateEngine(QtCore.QObject):
  '''A wrapper class collecting score and variant (pv) data from an engine 
 
 :param notifyFunction: print-like function used for notification
+:param AnnotateEngine.finishedSignal: ``pyqtSignal`` emitted with the success when the analysis started by ``start`` ends
  '''
+ finishedSignal : QtCore.pyqtSignal = QtCore.pyqtSignal(bool)
+
  def __init__(self, 
                     notifyFunction : Optional[Callable[[str], None]] = None, 
                     parent : Optional[QtCore.QObject] = None) -> None:
   super(AnnotateEngine, self).__init__(parent)
   self.notifyFunction = notifyFunction
+  self.running = False
+  self.watchdog = QtCore.QTimer(self)
+  self.watchdog.setSingleShot(True)
+  self.watchdog.timeout.connect(self._timeout)
 
  def setup(self, 
                 engine : ChessEngine, 
@@ -244,6 +267,8 @@ class AnnotateEngine(QtCore.QObject):
 
  @QtCore.pyqtSlot(chess.Move, str)
  def _bestMoveScoreAvailable(self, move : chess.Move, score : str):
+  if not self.running:
+   return
   if len(score) == 0:
    score = None
   if self.notifyFunction is not None:
@@ -257,53 +282,493 @@ class AnnotateEngine(QtCore.QObject):
     moveText = '... {}'.format(san)
    self.notifyFunction('{}: score = {}'.format(moveText, score))
   self.halfMoveID += 1
-  scoreList = list()
-  pvList = list()
-  if not isinstance(self.engine.playResult.info, list):
-   self.engine.playResult.info = [self.engine.playResult.info]
-  for hintID, info in enumerate(self.engine.playResult.info):
-   if self.hintPLYs > 0:
-    if 'pv' in info:
-     pvList.append(info['pv'][:self.hintPLYs])
-    else:
-     pvList.append([])
-   scoreList.append(self.engine.getScore(hintID = hintID))
+  scoreList, pvList = _collectResult(self.engine, self.hintPLYs)
   self.scoreListList.append(scoreList)
   if self.hintPLYs > 0:
    self.pvListList.append(pvList)
-  if (self.numberOfPlys is not None and len(self.scoreListList) >= self.numberOfPlys) or not self._startNext():
-   return
+  if self.numberOfPlys is not None and len(self.scoreListList) >= self.numberOfPlys:
+   self._finish(True)
+  elif not self._startNext():
+   self._finish(self.gameNode is None)
  
  def _startNext(self, isNew : bool = False) -> bool:
   if not isNew:
    self.gameNode = self.gameNode.next()
   if self.gameNode is None:
    return False
-  self.engine.uciNewGame(fen = self.gameNode.board().fen())
+  if not self.engine.uciNewGame(fen = self.gameNode.board().fen()):
+   return False
+  if self.timeout_msec is not None:
+   self.watchdog.start(self.timeout_msec)
   return self.engine.startAnalysis(multiPV = self.multiPV)
-  
- def run(self, game : Union[chess.pgn.Game, chess.pgn.GameNode], numberOfPlys : Optional[int] = None) -> bool:
-  '''Runs the engine for a whole game or a gameNode
+
+ @QtCore.pyqtSlot()
+ def _timeout(self):
+  if self.running:
+   if self.notifyFunction is not None:
+    self.notifyFunction('AnnotateEngine: no response within {} msec'.format(self.timeout_msec))
+   self._finish(False)
+
+ def _finish(self, success : bool) -> None:
+  self.watchdog.stop()
+  self.running = False
+  self.success = success
+  self.finishedSignal.emit(success)
+
+ def isRunning(self) -> bool:
+  '''Checks for a running analysis
+
+:returns: True, if an analysis started by ``start`` is not finished
+  '''
+  return self.running
+
+ def start(self, 
+               game : Union[chess.pgn.Game, chess.pgn.GameNode], 
+               numberOfPlys : Optional[int] = None, 
+               timeout_msec : Optional[int] = None) -> bool:
+  '''Starts the engine for a whole game or a gameNode without waiting for the result, see ``finishedSignal``
 
 :param game: game or gameNode
 :param numberOfPlys: number of half moves to analyse, ``None`` means analysis of the rest of the game
-:returns: True, if successful
+:param timeout_msec: maximal time for the analysis of a single position, ``None`` waits without limit
+:returns: True, if the analysis is started
   '''
+  if self.running:
+   return False
   if isinstance(game, chess.pgn.Game):
    self.gameNode = game.next()
   else:
    self.gameNode = game
   self.numberOfPlys = numberOfPlys
+  self.timeout_msec = timeout_msec
+  self.success = False
   self.scoreListList = list()
   if self.hintPLYs > 0:
    self.pvListList = list()
   else:
    self.pvListList = None
+  self.running = True
   if not self._startNext(isNew = True):
+   self.watchdog.stop()
+   self.running = False
    return False
-  while (self.numberOfPlys is None or len(self.scoreListList) < self.numberOfPlys) and self.gameNode is not None:
-   QtCore.QCoreApplication.processEvents()
   return True
+  
+ def run(self, 
+            game : Union[chess.pgn.Game, chess.pgn.GameNode], 
+            numberOfPlys : Optional[int] = None, 
+            timeout_msec : Optional[int] = None) -> bool:
+  '''Runs the engine for a whole game or a gameNode and waits for the result
+
+The wait runs a local event loop without user input events, i.e. it consumes no CPU while the engine thinks.
+
+:param game: game or gameNode
+:param numberOfPlys: number of half moves to analyse, ``None`` means analysis of the rest of the game
+:param timeout_msec: maximal time for the analysis of a single position, ``None`` waits without limit
+:returns: True, if successful
+  '''
+  if not self.start(game, numberOfPlys = numberOfPlys, timeout_msec = timeout_msec):
+   return False
+  if self.running:
+   eventLoop = QtCore.QEventLoop()
+   self.finishedSignal.connect(eventLoop.quit)
+   eventLoop.exec(QtCore.QEventLoop.ProcessEventsFlag.ExcludeUserInputEvents)
+   self.finishedSignal.disconnect(eventLoop.quit)
+  return self.success
+
+class AnnotatePool(QtCore.QObject):
+ '''A pool of engines annotating the mainlines of many games in parallel
+
+Every position of a mainline is an independent job. The jobs are distributed over the idle engines 
+and the results of a game are passed to ``Annotator.apply`` as soon as all its positions are analysed.
+
+:param engine2Option: a pair of a path to the executable and *dict* of the changed options, see ``ChessEngine``
+:param numberOfEngines: number of engine processes, ``None`` uses the number of CPUs divided by the threads per engine
+:param threads: value of the engine option *Threads* for each engine, ``None`` keeps the engine's setting
+:param hashSize: value of the engine option *Hash* (MB) for each engine, ``None`` keeps the engine's setting
+:param limit: a limit definition for each analysis (see ``chess.engine.Limit``)
+:param log: log for the engines' commands 
+:param notifyFunction: print-like function used for notification
+:param analysisCache: cache of the results shared by the engines (see *AnalysisCache*)
+:param timeout_msec: maximal time for the analysis of a single position, ``None`` waits without limit. 
+ An engine exceeding it or terminating is removed from the pool and its position is analysed by another engine.
+:param AnnotatePool.gameAnnotatedSignal: ``pyqtSignal`` emitted with the sequence number and the game when a game is annotated
+:param AnnotatePool.finishedSignal: ``pyqtSignal`` emitted when all games are annotated or the pool is stopped
+ '''
+ gameAnnotatedSignal : QtCore.pyqtSignal = QtCore.pyqtSignal(int, chess.pgn.Game)
+ finishedSignal : QtCore.pyqtSignal = QtCore.pyqtSignal()
+
+ def __init__(self, 
+                    engine2Option : Tuple[os.PathLike, Dict[str, Union[str, int, bool, None]]], 
+                    numberOfEngines : Optional[int] = None, 
+                    threads : Optional[int] = None, 
+                    hashSize : Optional[int] = None, 
+                    limit : chess.engine.Limit = chess.engine.Limit(depth = 15), 
+                    log : Optional[Callable[[str], None]] = None, 
+                    notifyFunction : Optional[Callable[[str], None]] = None, 
+                    analysisCache : Optional[AnalysisCache] = None, 
+                    timeout_msec : Optional[int] = None, 
+                    parent : Optional[QtCore.QObject] = None) -> None:
+  super(AnnotatePool, self).__init__(parent)
+  if numberOfEngines is None:
+   engineThreads = threads if threads is not None else engine2Option[1].get('Threads')
+   try:
+    engineThreads = max(1, int(engineThreads))
+   except (TypeError, ValueError):
+    engineThreads = 1
+   numberOfEngines = max(1, (os.cpu_count() or 1) // engineThreads)
+  assert numberOfEngines > 0
+  self.notifyFunction = notifyFunction
+  self.timeout_msec = timeout_msec
+  self.engineList = list()
+  self.watchdogDict = dict()
+  for n in range(numberOfEngines):
+   engine = ChessEngine(engine2Option, limit = limit, log = log)
+   optionsDict = vars(engine).get('optionsDict', dict())
+   if threads is not None and 'Threads' in optionsDict:
+    engine.uciSetOption('Threads', max(1, int(threads)))
+   if hashSize is not None and 'Hash' in optionsDict:
+    engine.uciSetOption('Hash', int(hashSize))
+   engine.setAnalysisCache(analysisCache)
+   engine.bestMoveScoreSignal.connect(functools.partial(self._bestMoveScoreAvailable, engine))
+   engine.p.finished.connect(functools.partial(self._engineFinished, engine))
+   watchdog = QtCore.QTimer(self)
+   watchdog.setSingleShot(True)
+   watchdog.timeout.connect(functools.partial(self._timeout, engine))
+   self.watchdogDict[engine] = watchdog
+   self.engineList.append(engine)
+  self.annotator = None
+  self.hintPLYs = 0
+  self.multiPV = 1
+  self.gameIterator = None
+  self.jobQueue = collections.deque()
+  self.gameStateDict = dict()
+  self.engineJobDict = dict()
+  self.gamesStarted = 0
+  self.gamesAnnotated = 0
+  self.gamesLost = 0
+  self.lostGames = list()
+  self.positionsAnalysed = 0
+  self.startTime = None
+  self.elapsed = 0.
+
+ def setup(self, 
+                annotator : Annotator, 
+                hintPLYs : int = 0, 
+                multiPV : int = 1) -> None:
+  '''Setup for operation
+
+:param annotator: annotator applied to each game, when its analysis is complete
+:param hintPLYs: number of half moves (plys) in variants. Suppress hints by setting hintPLYs == 0 
+:param multiPV: number of variants
+  '''
+  assert hintPLYs >= 0
+  assert multiPV > 0
+  self.annotator = annotator
+  self.hintPLYs = hintPLYs
+  self.multiPV = multiPV
+
+ def __len__(self) -> int:
+  return len(self.engineList)
+
+ def _notify(self, txt : str) -> None:
+  if self.notifyFunction is not None:
+   self.notifyFunction(txt)
+
+ def isRunning(self) -> bool:
+  '''Checks for a running annotation
+
+:returns: True, if games are being annotated
+  '''
+  return self.startTime is not None
+
+ def throughput(self) -> Tuple[float, float]:
+  '''Delivers the throughput of the current or the last run
+
+:returns: pair of positions per second and games per second
+  '''
+  if self.startTime is not None:
+   elapsed = time.perf_counter() - self.startTime
+  else:
+   elapsed = self.elapsed
+  if elapsed <= 0:
+   return 0., 0.
+  return self.positionsAnalysed/elapsed, self.gamesAnnotated/elapsed
+
+ def _nextJob(self) -> Optional[Tuple[int, int, chess.pgn.ChildNode]]:
+  while len(self.jobQueue) == 0:
+   if self.gameIterator is None:
+    return None
+   try:
+    game = next(self.gameIterator)
+   except StopIteration:
+    self.gameIterator = None
+    return None
+   gameID = self.gamesStarted
+   self.gamesStarted += 1
+   nodeList = list(game.mainline())
+   if len(nodeList) == 0:
+    self._completeGame(gameID, game, None, None)
+    continue
+   self.gameStateDict[gameID] = {
+     'game' : game, 
+     'scoreListList' : [None] * len(nodeList), 
+     'pvListList' : [None] * len(nodeList), 
+     'pending' : len(nodeList)}
+   for plyID, gameNode in enumerate(nodeList):
+    self.jobQueue.append((gameID, plyID, gameNode))
+  return self.jobQueue.popleft()
+
+ def _dispatch(self, engine : ChessEngine) -> None:
+  while True:
+   job = self._nextJob()
+   if job is None:
+    break
+   self.engineJobDict[engine] = job
+   gameNode = job[2]
+   if self.timeout_msec is not None:
+    self.watchdogDict[engine].start(self.timeout_msec)
+   if engine.uciNewGame(fen = gameNode.board().fen()) and engine.startAnalysis(multiPV = self.multiPV):
+    return
+   self._removeEngine(engine, 'failed')
+   return
+  self.engineJobDict.pop(engine, None)
+
+ def _removeEngine(self, engine : ChessEngine, reason : str) -> None:
+  if engine not in self.engineList:
+   return
+  self._notify('AnnotatePool: engine #{} {}, removed from pool'.format(self.engineList.index(engine), reason))
+  self.engineList.remove(engine)
+  self.watchdogDict.pop(engine).stop()
+  job = self.engineJobDict.pop(engine, None)
+  try:
+   engine.kill(beSilent = True)
+  except IOError:
+   pass
+  if job is not None:
+   self.jobQueue.appendleft(job)
+  if len(self.engineList) == 0:
+   self.stop()
+  else:
+   for idleEngine in list(self.engineList):
+    if idleEngine not in self.engineJobDict:
+     self._dispatch(idleEngine)
+  self._checkFinished()
+
+ def _timeout(self, engine : ChessEngine) -> None:
+  if engine in self.engineJobDict:
+   self._removeEngine(engine, 'gave no response within {} msec'.format(self.timeout_msec))
+
+ def _engineFinished(self, engine : ChessEngine, *args) -> None:
+  self._removeEngine(engine, 'terminated')
+
+ def _checkFinished(self) -> None:
+  if len(self.engineJobDict) == 0 and self.isRunning():
+   self._finish()
+
+ def _bestMoveScoreAvailable(self, engine : ChessEngine, move : chess.Move, score : str) -> None:
+  job = self.engineJobDict.get(engine)
+  if job is None:
+   return
+  self.watchdogDict[engine].stop()
+  gameID, plyID, _ = job
+  scoreList, pvList = _collectResult(engine, self.hintPLYs)
+  self.positionsAnalysed += 1
+  gameState = self.gameStateDict[gameID]
+  gameState['scoreListList'][plyID] = scoreList
+  gameState['pvListList'][plyID] = pvList
+  gameState['pending'] -= 1
+  if gameState['pending'] == 0:
+   del self.gameStateDict[gameID]
+   self._completeGame(gameID, gameState['game'], gameState['scoreListList'], gameState['pvListList'])
+  self._dispatch(engine)
+  self._checkFinished()
+
+ def _completeGame(self, 
+                                gameID : int, 
+                                game : chess.pgn.Game, 
+                                scoreListList : Optional[List[List[Optional[str]]]], 
+                                pvListList : Optional[List[List[List[chess.Move]]]]) -> None:
+  if scoreListList is not None:
+   if self.hintPLYs == 0:
+    pvListList = None
+   self.annotator.apply(game = game, scoreListList = scoreListList, pvListList = pvListList)
+  self.gamesAnnotated += 1
+  positionsPerSecond, _ = self.throughput()
+  self._notify('Game #{} annotated: {} games, {:.1f} positions/s'.format(gameID, self.gamesAnnotated, positionsPerSecond))
+  self.gameAnnotatedSignal.emit(gameID, game)
+
+ def _finish(self) -> None:
+  self.elapsed = time.perf_counter() - self.startTime
+  self.startTime = None
+  self.lostGames = [(gameID, gameState['game']) for gameID, gameState in sorted(self.gameStateDict.items())]
+  self.gamesLost = self.gamesStarted - self.gamesAnnotated
+  self.gameStateDict = dict()
+  positionsPerSecond, gamesPerSecond = self.throughput()
+  self._notify('AnnotatePool: {} games, {} positions in {:.1f} s ({:.1f} positions/s, {:.2f} games/s)'.format(
+    self.gamesAnnotated, self.positionsAnalysed, self.elapsed, positionsPerSecond, gamesPerSecond))
+  if self.gamesLost > 0:
+   self._notify('AnnotatePool: {} games not annotated'.format(self.gamesLost))
+  self.finishedSignal.emit()
+
+ def start(self, games : Iterable[chess.pgn.Game]) -> bool:
+  '''Starts the annotation of games without waiting for the result
+
+The games are read lazily from ``games`` and annotated in place, 
+``gameAnnotatedSignal`` reports each completed game.
+
+:param games: games to be annotated
+:returns: True, if the annotation is started
+  '''
+  assert self.annotator is not None, 'AnnotatePool.setup required'
+  if self.isRunning() or len(self.engineList) == 0:
+   return False
+  self.gameIterator = iter(games)
+  self.jobQueue.clear()
+  self.gameStateDict = dict()
+  self.engineJobDict = dict()
+  self.gamesStarted = 0
+  self.gamesAnnotated = 0
+  self.gamesLost = 0
+  self.lostGames = list()
+  self.positionsAnalysed = 0
+  self.startTime = time.perf_counter()
+  for engine in list(self.engineList):
+   if engine in self.engineList and engine not in self.engineJobDict:
+    self._dispatch(engine)
+  self._checkFinished()
+  return True
+
+ def run(self, games : Iterable[chess.pgn.Game]) -> bool:
+  '''Annotates games and waits for the completion, see ``start``
+
+:param games: games to be annotated
+:returns: True, if all games are annotated, see *gamesLost* and *lostGames* otherwise
+  '''
+  if not self.start(games):
+   return False
+  if self.isRunning():
+   eventLoop = QtCore.QEventLoop()
+   self.finishedSignal.connect(eventLoop.quit)
+   eventLoop.exec(QtCore.QEventLoop.ProcessEventsFlag.ExcludeUserInputEvents)
+   self.finishedSignal.disconnect(eventLoop.quit)
+  return len(self.engineList) > 0 and self.gamesLost == 0
+
+ def stop(self) -> None:
+  '''Stops reading further games, the analyses of the engines are completed but partially annotated games are dropped
+  '''
+  self.gameIterator = None
+  self.jobQueue.clear()
+
+ def quit(self) -> None:
+  '''Terminates all engines, the pool cannot be used anymore
+  '''
+  self.stop()
+  engineList, self.engineList = self.engineList, list()
+  for engine in engineList:
+   self.watchdogDict.pop(engine).stop()
+   engine.uciQuit()
+
+def runAnnotateDB() -> None:
+ '''Console entry point annotating all games of a PGN file with a pool of engines
+ '''
+ import argparse
+ import configparser
+ import platform
+ import configureEngine
+ from pgnParse import read_game
+
+ parser = argparse.ArgumentParser(description = 'Annotate all games of a PGN file with a pool of engines')
+ parser.add_argument("pgnFile", help = "PGN-File")
+ parser.add_argument("--target", metavar = 'target', help = "annotated PGN-File, default: <pgnFile>_annotated.pgn")
+ parser.add_argument("--encoding",  metavar = 'encoding',  default = 'u', 
+   choices=['u', 'utf-8-sig', 'i', 'iso-8859-1', 'a', 'ascii'], 
+   help="encoding of the PGN-File (u - utf-8-sig, i - iso-8859-1, a - ascii)")
+ parser.add_argument("--settings", metavar = 'settings', help = "settings file with the engine definitions, default: the settings of MzChess")
+ parser.add_argument("--engine", metavar = 'engine', help = "name of the engine, default: the selected engine of MzChess")
+ parser.add_argument("--engines", metavar = 'engines', type = int, help = "number of engine processes, default: number of CPUs divided by threads")
+ parser.add_argument("--threads", metavar = 'threads', type = int, help = "engine option Threads per engine, default: the setting of the engine")
+ parser.add_argument("--hash", metavar = 'hash', type = int, help = "engine option Hash (MB) per engine")
+ parser.add_argument("--depth", metavar = 'depth', type = int, default = 15, help = "search depth per position")
+ parser.add_argument("--multiPV", metavar = 'multiPV', type = int, default = 1, help = "number of variants")
+ parser.add_argument("--hintPLYs", metavar = 'hintPLYs', type = int, default = 0, help = "number of half moves in variants, 0 suppresses variants")
+ parser.add_argument("--blunder", metavar = 'blunder', type = float, default = 1.0, help = "score limit of a blunder")
+ parser.add_argument("--timeout", metavar = 'timeout', type = int, default = 60000, help = "maximal time (msec) for the analysis of a position, an engine exceeding it is removed")
+ parser.add_argument("--cache", metavar = 'cache', help = "SQLite file caching the results, default: analysis.sqlite next to the settings")
+ parser.add_argument("-noCache", action = 'store_true', default = False, help = "Analyse without cache")
+ parser.add_argument("-verbose", action = 'store_true', default = False, help = "Report each annotated game")
+ parser.add_argument("-debug", action = 'store_true', default = False, help = "Enable Debugging")
+ args = parser.parse_args()
+
+ encoding = {'u' : 'utf-8-sig', 'i' : 'iso-8859-1', 'a' : 'ascii'}.get(args.encoding, args.encoding)
+ if args.target is None:
+  base, _ = os.path.splitext(args.pgnFile)
+  args.target = '{}_annotated.pgn'.format(base)
+ if args.settings is None:
+  if platform.system() == 'Windows':
+   args.settings = os.path.join(os.path.expanduser('~'), 'AppData', 'Roaming', 'MzChess', 'settings.ini')
+  else:
+   args.settings = os.path.join(os.path.expanduser('~'), '.config', 'MzChess', 'settings.ini')
+ settings = configparser.ConfigParser(delimiters=['='], allow_no_value=True)
+ settings.optionxform = str
+ settings.read(args.settings, encoding = 'utf-8')
+ engineDict = configureEngine.loadEngineSettings(settings)
+ selectedEngine = args.engine
+ if selectedEngine is None and settings.has_section('Menu/Engine'):
+  selectedEngine = settings['Menu/Engine'].get('selectedEngine')
+ if selectedEngine not in engineDict:
+  parser.error('unknown engine {} (must be out of {})'.format(selectedEngine, list(engineDict)))
+
+ analysisCache = None
+ if not args.noCache:
+  if args.cache is None:
+   args.cache = os.path.join(os.path.dirname(os.path.abspath(args.settings)), 'analysis.sqlite')
+  analysisCache = AnalysisCache(args.cache)
+
+ app = QtCore.QCoreApplication(sys.argv[:1])
+ pool = AnnotatePool(engineDict[selectedEngine], 
+                                numberOfEngines = args.engines, 
+                                threads = args.threads, 
+                                hashSize = args.hash, 
+                                limit = chess.engine.Limit(depth = args.depth), 
+                                log = print if args.debug else None, 
+                                notifyFunction = print if args.verbose else None, 
+                                analysisCache = analysisCache, 
+                                timeout_msec = args.timeout if args.timeout > 0 else None)
+ annotator = Annotator(selectedEngine)
+ annotator.setBlunder(args.blunder, addVariant = args.hintPLYs > 0)
+ pool.setup(annotator, hintPLYs = args.hintPLYs, multiPV = args.multiPV)
+
+ completedDict = dict()
+ nextGameID = 0
+ with open(args.pgnFile, mode = 'r', encoding = encoding) as pgn, open(args.target, mode = 'w', encoding = encoding, errors = 'replace') as target:
+  def writeGame(gameID : int, game : chess.pgn.Game) -> None:
+   nonlocal nextGameID
+   completedDict[gameID] = game
+   while nextGameID in completedDict:
+    exporter = chess.pgn.StringExporter(headers = True, variations = True, comments = True)
+    target.write(completedDict.pop(nextGameID).accept(exporter))
+    target.write('\n\n')
+    nextGameID += 1
+  pool.gameAnnotatedSignal.connect(writeGame)
+  threads = args.threads if args.threads is not None else engineDict[selectedEngine][1].get('Threads', 'default')
+  print('Annotating {} with {} x {} (Threads = {}) ...'.format(args.pgnFile, len(pool), selectedEngine, threads))
+  rc = pool.run(iter(lambda: read_game(pgn), None))
+  for gameID, game in pool.lostGames:
+   writeGame(gameID, game)
+  while len(completedDict) > 0:
+   nextGameID = min(completedDict)
+   writeGame(nextGameID, completedDict.pop(nextGameID))
+ pool.quit()
+ positionsPerSecond, gamesPerSecond = pool.throughput()
+ print('{} games, {} positions in {:.1f} s: {:.1f} positions/s, {:.2f} games/s -> {}'.format(
+   pool.gamesAnnotated, pool.positionsAnalysed, pool.elapsed, positionsPerSecond, gamesPerSecond, args.target))
+ if pool.gamesLost > 0:
+  print('{} games not annotated, {} of them copied unchanged'.format(pool.gamesLost, len(pool.lostGames)))
+ if analysisCache is not None:
+  print('{} cache hits, {} misses -> {}'.format(analysisCache.hits, analysisCache.misses, args.cache))
+  analysisCache.close()
+ sys.exit(0 if rc else 1)
 
 if __name__ == "__main__":
  import os, sys
@@ -358,9 +823,12 @@ if __name__ == "__main__":
  assert ext in ['.ppgn', '.pgn'], 'Unexpected file type {} of {}'.format(ext, args.pgnFile)
  
  if ext == '.ppgn':
-  with open(args.pgnFile, mode = 'rb') as f:
-   gameList = pickle.load(f)
-   game = gameList[args.gameID]
+  if MzChess.GameStore.isStore(args.pgnFile):
+   game = MzChess.GameStore(args.pgnFile).readGame(args.gameID)
+  else:
+   with open(args.pgnFile, mode = 'rb') as f:
+    gameList = pickle.load(f)
+    game = gameList[args.gameID]
  else:
   pgn = open(args.pgnFile, mode = 'r',  encoding = encoding)
   for n in range(args.gameID + 1):
@@ -0,0 +1,372 @@
+'''An asyncio based Universal Chess Interface (`UCI`_) engine
+
+*AsyncChessEngine* offers the interface of *ChessEngine* without Qt, i.e. neither a *QCoreApplication*
+nor a Qt event loop is required. Many engines run concurrently in one process (see *analysePositions*),
+which suits headless batch pipelines.
+
+.. _UCI: http://wbec-ridderkerk.nl/html/UCIProtocol.html
+'''
+
+import os, os.path
+import sys
+import asyncio
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+import chess
+import chess.engine
+
+if __package__:
+ from .uciProtocol import UCIProtocol
+ from .analysisCache import AnalysisCache
+else:
+ from uciProtocol import UCIProtocol
+ from analysisCache import AnalysisCache
+
+class Callbacks(object):
+ '''A list of callbacks with the interface of a ``pyqtSignal``, i.e. *connect*, *disconnect* and *emit*
+ '''
+ def __init__(self) -> None:
+  self.callbackList = list()
+
+ def connect(self, callback : Callable[..., Any]) -> None:
+  '''Adds a callback
+
+:param callback: function called by *emit*
+  '''
+  self.callbackList.append(callback)
+
+ def disconnect(self, callback : Callable[..., Any]) -> None:
+  '''Removes a callback
+
+:param callback: function added by *connect*
+  '''
+  self.callbackList.remove(callback)
+
+ def emit(self, *args : Any) -> None:
+  '''Calls all callbacks
+
+:param args: arguments passed to the callbacks
+  '''
+  for callback in list(self.callbackList):
+   callback(*args)
+
+class AsyncChessEngine(UCIProtocol):
+ '''A Universal Chess Interface (`UCI`_) engine using an `asyncio subprocess`_
+
+The UCI commands (e.g. *uciNewGame*, *uciGo*, *startAnalysis* and *getScore*) are the ones of *ChessEngine*.
+The process is started by ``await engine.start()`` or by ``await AsyncChessEngine.create(...)``,
+results are awaited by *waitForReady* or by the coroutines *analyse* and *play*.
+
+:param engine2Option: a pair of a path to the executable and *dict* of the changed options
+:param limit: a limit definition for the engine (see `chess.engine.Limit`_)
+:param timeout_msec: timeout for the engine to respond (should be at least 1000)
+:param log: log for the engine's commands
+:param AsyncChessEngine.bestMoveScoreSignal: *Callbacks* emitted with move and score when a best move is available
+:param AsyncChessEngine.readySignal: *Callbacks* emitted when the engine is able to receive commands again
+:param AsyncChessEngine.infoSignal: *Callbacks* emitted with each *info* of a running search
+
+.. _UCI: http://wbec-ridderkerk.nl/html/UCIProtocol.html
+.. _asyncio subprocess: https://docs.python.org/3/library/asyncio-subprocess.html
+.. _chess.engine.Limit: https://python-chess.readthedocs.io/en/latest/engine.html
+ '''
+
+ def __init__(self, engine2Option : Tuple[os.PathLike, Dict[str, Union[str, int, bool, None]]],
+   limit : chess.engine.Limit = chess.engine.Limit(depth = 10),
+   timeout_msec : int = 1000,
+   log : Optional[Callable[[str], None]] = None) -> None:
+  executable, changedOptions = engine2Option
+  if not (os.path.isfile(executable) and os.access(executable, os.X_OK )):
+   raise IOError('AsyncChessEngine: {} is not an executable'.format(executable))
+  self.executable = executable
+  self.changedOptions = dict(changedOptions)
+  self.limit = limit
+  self.setLog(log)
+  self.timeout_msec = max(int(timeout_msec), 10)
+  self.bestMoveScoreSignal = Callbacks()
+  self.readySignal = Callbacks()
+  self.infoSignal = Callbacks()
+  self.process = None
+  self.readerTasks = list()
+  self.readyEvent = None
+  self.readyok = False
+  self.isrunning = False
+  self.playResult = None
+  self.bestMoveScore = None
+  self.board = chess.Board()
+  self.stdoutLines = list()
+  self.infoDict = dict()
+  self.optionValues = dict()
+
+ @classmethod
+ async def create(cls, engine2Option : Tuple[os.PathLike, Dict[str, Union[str, int, bool, None]]],
+   limit : chess.engine.Limit = chess.engine.Limit(depth = 10),
+   timeout_msec : int = 1000,
+   log : Optional[Callable[[str], None]] = None) -> 'AsyncChessEngine':
+  '''Creates and starts an engine, see *AsyncChessEngine* for the parameters
+
+:returns: the started engine
+  '''
+  engine = cls(engine2Option, limit = limit, timeout_msec = timeout_msec, log = log)
+  await engine.start()
+  return engine
+
+ @property
+ def readyok(self) -> bool:
+  return self._readyok
+
+ @readyok.setter
+ def readyok(self, value : bool) -> None:
+  self._readyok = value
+  if self.readyEvent is not None:
+   if value:
+    self.readyEvent.set()
+   else:
+    self.readyEvent.clear()
+
+ async def start(self) -> bool:
+  '''Starts the engine process, sends *uci* and applies the changed options
+
+:returns: boolean indicating whether the engine is ready
+  '''
+  self.readyEvent = asyncio.Event()
+  self.process = await asyncio.create_subprocess_exec(self.executable,
+    stdin = asyncio.subprocess.PIPE, stdout = asyncio.subprocess.PIPE, stderr = asyncio.subprocess.PIPE)
+  self.readerTasks = [asyncio.ensure_future(self._fromStdout()), asyncio.ensure_future(self._fromStderr())]
+  self.readyok = True
+  self._toStdin('uci')
+  if not await self.waitForReady(3*self.timeout_msec):
+   self._log('AsyncChessEngine: no uci response, {} msec elapsed'.format(3*self.timeout_msec))
+  if self.isReady():
+   for name, value in self.changedOptions.items():
+    self.uciSetOption(name, value)
+  return self.isReady()
+
+ async def _fromStdout(self) -> None:
+  while True:
+   line = await self.process.stdout.readline()
+   if len(line) == 0:
+    break
+   line = line.decode('utf-8', errors = 'replace').rstrip('\r\n')
+   self._log('AsyncChessEngine/_fromStdout: stdout< {}'.format(line))
+   if self._processLine(line):
+    self.readySignal.emit()
+    if self.bestMoveScore is not None:
+     self.bestMoveScoreSignal.emit(*self.bestMoveScore)
+  self.readyok = False
+  self.readyEvent.set()
+
+ def _infoAvailable(self, info : Dict[str, Any]) -> None:
+  self.infoSignal.emit(info)
+
+ def _scheduleCachedResult(self) -> None:
+  asyncio.get_event_loop().call_soon(self._fromCache)
+
+ def _fromCache(self) -> None:
+  if self._processCachedResult():
+   self.readySignal.emit()
+   if self.bestMoveScore is not None:
+    self.bestMoveScoreSignal.emit(*self.bestMoveScore)
+
+ async def _fromStderr(self) -> None:
+  while True:
+   line = await self.process.stderr.readline()
+   if len(line) == 0:
+    break
+   self._log('AsyncChessEngine/_fromStderr: stderr< {}'.format(line.decode('utf-8', errors = 'replace').rstrip('\r\n')))
+
+ def _isAlive(self) -> bool:
+  return self.process is not None and self.process.returncode is None and not self.readerTasks[0].done()
+
+ def _toStdin(self, txt : str) -> bool:
+  if not self._isAlive():
+   return False
+  self._log('AsyncChessEngine/_toStdin: stdin> {}, readyok = {}'.format(txt, self.readyok))
+  if not self.readyok:
+   return False
+  self.readyok = False
+  self.stdoutLines = list()
+  self.process.stdin.write("{}\n".format(txt).encode('utf-8'))
+  return True
+
+ def isReady(self) -> bool:
+  '''Checks whether the engine is able to receive commands
+
+:returns: boolean indicating the response
+  '''
+  return self._isAlive() and self.readyok
+
+ async def waitForReady(self, timeout_msec : Optional[int] = None) -> bool:
+  '''Waits until the engine is able to receive commands, e.g. after *uci* or *go*
+
+:param timeout_msec: maximal waiting time, ``None`` waits without limit
+:returns: boolean indicating whether the engine is ready
+  '''
+  loop = asyncio.get_running_loop()
+  if timeout_msec is not None:
+   deadline = loop.time() + timeout_msec/1000
+  while not self.isReady():
+   if not self._isAlive():
+    return False
+   timeout = None
+   if timeout_msec is not None:
+    timeout = deadline - loop.time()
+    if timeout <= 0:
+     return False
+   try:
+    await asyncio.wait_for(self.readyEvent.wait(), timeout)
+   except asyncio.TimeoutError:
+    return False
+  return True
+
+ async def analyse(self,
+                              fen : Optional[str] = None,
+                              moves : List[chess.Move] = [],
+                              multiPV : int = 1,
+                              timeout_msec : Optional[int] = None) -> Optional[chess.engine.PlayResult]:
+  '''Analyses a position in *analyse* mode (see *startAnalysis*) and waits for the result
+
+:param fen: starting position in Forsyth-Edwards-Notation (FEN), ``None`` for the standard starting position
+:param moves: list of moves to be applied
+:param multiPV: number of alternative move suggestions
+:param timeout_msec: maximal waiting time, ``None`` waits without limit
+:returns: the result (see *playResult*) or ``None``
+  '''
+  if not (self.uciNewGame(fen = fen, moves = moves) and self.startAnalysis(multiPV = multiPV)):
+   return None
+  if not await self.waitForReady(timeout_msec):
+   return None
+  return self.playResult
+
+ async def play(self,
+                        fen : Optional[str] = None,
+                        moves : List[chess.Move] = [],
+                        timeout_msec : Optional[int] = None) -> Optional[chess.engine.PlayResult]:
+  '''Searches the best move of a position in *play* mode (see *startPlay*) and waits for the result
+
+:param fen: starting position in Forsyth-Edwards-Notation (FEN), ``None`` for the standard starting position
+:param moves: list of moves to be applied
+:param timeout_msec: maximal waiting time, ``None`` waits without limit
+:returns: the result (see *playResult*) or ``None``
+  '''
+  if not (self.uciNewGame(fen = fen, moves = moves) and self.startPlay()):
+   return None
+  if not await self.waitForReady(timeout_msec):
+   return None
+  return self.playResult
+
+ async def quit(self, timeout_msec : Optional[int] = None) -> None:
+  '''Sends *quit* and waits for the termination, the process is killed after the timeout
+
+:param timeout_msec: maximal waiting time, ``None`` uses *timeout_msec* of the engine
+  '''
+  if self.process is None:
+   return
+  if timeout_msec is None:
+   timeout_msec = self.timeout_msec
+  if self._isAlive():
+   self.process.stdin.write(b"quit\n")
+  try:
+   await asyncio.wait_for(self.process.wait(), timeout_msec/1000)
+  except asyncio.TimeoutError:
+   self.process.kill()
+   await self.process.wait()
+  await asyncio.gather(*self.readerTasks)
+  self.process = None
+
+ def kill(self) -> None:
+  '''Kills the process, engine cannot be used anymore
+  '''
+  if self.process is not None and self.process.returncode is None:
+   self.process.kill()
+
+async def analysePositions(engine2Option : Tuple[os.PathLike, Dict[str, Union[str, int, bool, None]]],
+                                          fenList : Iterable[str],
+                                          numberOfEngines : Optional[int] = None,
+                                          limit : chess.engine.Limit = chess.engine.Limit(depth = 15),
+                                          multiPV : int = 1,
+                                          log : Optional[Callable[[str], None]] = None,
+                                          notifyFunction : Optional[Callable[[str], None]] = None,
+                                          analysisCache : Optional[AnalysisCache] = None) -> List[Optional[chess.engine.PlayResult]]:
+ '''Analyses positions concurrently with several engines
+
+:param engine2Option: a pair of a path to the executable and *dict* of the changed options
+:param fenList: positions in Forsyth-Edwards-Notation (FEN)
+:param numberOfEngines: number of engine processes, ``None`` uses the number of CPUs
+:param limit: a limit definition for each analysis (see ``chess.engine.Limit``)
+:param multiPV: number of alternative move suggestions
+:param log: log for the engines' commands
+:param notifyFunction: print-like function used for notification
+:param analysisCache: cache of the results shared by the engines (see *AnalysisCache*)
+:returns: list of the results in the order of ``fenList``, ``None`` for failed analyses
+ '''
+ fenList = list(fenList)
+ resultList = [None] * len(fenList)
+ if numberOfEngines is None:
+  numberOfEngines = os.cpu_count() or 1
+ numberOfEngines = min(numberOfEngines, len(fenList))
+ if numberOfEngines <= 0:
+  return resultList
+ engineList = await asyncio.gather(*[AsyncChessEngine.create(engine2Option, limit = limit, log = log) for n in range(numberOfEngines)])
+ for engine in engineList:
+  engine.setAnalysisCache(analysisCache)
+ queue = asyncio.Queue()
+ for item in enumerate(fenList):
+  queue.put_nowait(item)
+
+ async def analyseQueue(engine : AsyncChessEngine) -> None:
+  while not queue.empty():
+   positionID, fen = queue.get_nowait()
+   resultList[positionID] = await engine.analyse(fen = fen, multiPV = multiPV)
+   if notifyFunction is not None:
+    notifyFunction('{}: score = {}'.format(fen, engine.getScore(hintID = 0)))
+
+ try:
+  await asyncio.gather(*[analyseQueue(engine) for engine in engineList])
+ finally:
+  await asyncio.gather(*[engine.quit() for engine in engineList])
+ return resultList
+
+if __name__ == "__main__":
+ import argparse
+ import time
+
+ parser = argparse.ArgumentParser(description = 'Analyse positions concurrently with asyncio UCI engines')
+ parser.add_argument("executable", help = "UCI engine")
+ parser.add_argument("fen", nargs = '*', help = "positions in FEN, default: standard starting position")
+ parser.add_argument("--fenFile", metavar = 'fenFile', help = "file with one position in FEN per line")
+ parser.add_argument("--engines", metavar = 'engines', type = int, help = "number of engine processes, default: number of CPUs")
+ parser.add_argument("--depth", metavar = 'depth', type = int, default = 15, help = "search depth per position")
+ parser.add_argument("--multiPV", metavar = 'multiPV', type = int, default = 1, help = "number of variants")
+ parser.add_argument("--cache", metavar = 'cache', help = "SQLite file caching the results, default: no cache")
+ parser.add_argument("-debug", action = 'store_true', default = False, help = "Enable Debugging")
+ args = parser.parse_args()
+
+ fenList = list(args.fen)
+ if args.fenFile is not None:
+  with open(args.fenFile, mode = 'r', encoding = 'utf-8') as f:
+   fenList += [line.strip() for line in f if len(line.strip()) > 0]
+ if len(fenList) == 0:
+  fenList = [chess.STARTING_FEN]
+
+ analysisCache = None if args.cache is None else AnalysisCache(args.cache)
+ start = time.perf_counter()
+ resultList = asyncio.run(analysePositions((args.executable, dict()), fenList,
+   numberOfEngines = args.engines,
+   limit = chess.engine.Limit(depth = args.depth),
+   multiPV = args.multiPV,
+   log = print if args.debug else None,
+   analysisCache = analysisCache))
+ elapsed = time.perf_counter() - start
+ for fen, playResult in zip(fenList, resultList):
+  if playResult is None:
+   print('{}\tfailed'.format(fen))
+   continue
+  info = playResult.info
+  if isinstance(info, list):
+   info = info[0] if len(info) > 0 else dict()
+  score = info['score'].white() if 'score' in info else None
+  print('{}\t{}\t{}'.format(fen, playResult.move, score))
+ print('{} positions in {:.1f} s'.format(len(fenList), elapsed))
+ if analysisCache is not None:
+  print('{} cache hits, {} misses'.format(analysisCache.hits, analysisCache.misses))
+  analysisCache.close()
@@ -11,6 +11,8 @@ The main Window consists of 4 parts:
     * *Game* tree widget displaying the body of the actual game
     * *Headers* list widget displaying the header of the actual game
     * *Database* list widget displaying all loaded games
+    * *Explorer* table displaying the moves played in the actual position with number of games, 
+      score and average Elo of the side to move (see *OpeningTree*)
     * *Score* plot displaying engine and material scores
     * *Log* edit displaying communication with the engine in use
     
@@ -26,10 +28,11 @@ Main Window Menu
 ================================
 On the top, the menu with
 
- * *File* menu handling files in the Portable Game Notation (`PGN`_) and pickled PGN (*PPNG*) formats
+ * *File* menu handling files in the Portable Game Notation (`PGN`_) and packed binary PGN (*PPGN*, see *GameStore*) formats
 
     * *Encoding* sub-menu to set encoding for opening/saveing PNG-format
-    * *Open DB ...* action to open a PPGN- or PGN-file and replace the current database
+    * *Open DB ...* action to open a PPGN- or PGN-file and replace the current database, 
+      PGN-files are indexed in the background showing progress and a *Cancel* button in the status bar
     * *Recent* sub-menu with the recent PPGN- or PGN-files
     * *Append to DB ...* action to open a PPGN- or PGN-file and append to the current database
     * *Save DB ...* action to save the whole database as a PPGN- or PGN-file 
@@ -51,6 +54,8 @@ On the top, the menu with
     * *Move Games>Up/Down*  moves a selected game up and down in the *Database*
     * *Paste Game*, i.e. the actual game PGN from the clipboard and added to the *Database*
     * *Paste FEN*, i.e. the actual position is pasted from the clipboard and added to the *Database*
+    * *Find Games with this Position* shows the games of the *Database*, which reached the position of the board, 
+      using the position index built in the background after loading (see *PositionIndex*)
 
  * *Game* menu with obvious functionality with the exception of
  
@@ -115,7 +120,7 @@ In addition, several *standard* key strokes are supported:
 .. _UCI: http://wbec-ridderkerk.nl/html/UCIProtocol.html
 '''
 
-from typing import Optional, Callable, Dict, List, Tuple, Union, Any
+from typing import Optional, Callable, Dict, Iterable, Iterator, List, Tuple, Union, Any
 import configparser
 import os, os.path
 import copy
@@ -144,16 +149,95 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import chess, chess.pgn
 import MzChess
-from MzChess import read_game
+from MzChess import read_game, PGNIndex, IndexedGameList, GameStore, RecoveryJournal, PositionIndex, OpeningTree
 
 import AboutDialog
 
+class PGNLoader(QtCore.QThread):
+ '''Indexes a PGN-file in a background thread
+
+The index is read from its sidecar file or built (see *PGNIndex.build*). While building, 
+*progressSignal* is emitted with the number of games indexed so far, which may be accessed 
+from the GUI thread. Games with improper tag pairs are collected in *PGNIndex.errorList*.
+
+:param pgnFile: path of the PGN-file
+:param encoding: encoding of the PGN-file
+:param parent: parent object
+ '''
+ progressSignal = QtCore.pyqtSignal(int)
+
+ def __init__(self, pgnFile : str, encoding : str = 'utf-8-sig', parent : Optional[QtCore.QObject] = None) -> None:
+  super(PGNLoader, self).__init__(parent)
+  self.pgnIndex = PGNIndex(pgnFile, encoding = encoding if encoding is not None else 'utf-8-sig')
+  self.gameList = None
+  self.loadedCount = 0
+  self.cancelled = False
+  self.error = None
+
+ def cancel(self) -> None:
+  '''Stops building the index'''
+  self.cancelled = True
+
+ def progress(self) -> int:
+  '''Returns the percentage of the file indexed'''
+  if self.pgnIndex.fileSize == 0 or len(self.pgnIndex) == 0:
+   return 0
+  return int(100 * self.pgnIndex.offsetArray[-1] / self.pgnIndex.fileSize)
+
+ def _notify(self, count : int) -> bool:
+  self.progressSignal.emit(count)
+  return self.cancelled
+
+ def run(self) -> None:
+  try:
+   if self.pgnIndex.load():
+    return
+   if self.pgnIndex.build(notify = self._notify):
+    try:
+     self.pgnIndex.save()
+    except OSError:
+     pass
+  except Exception as error:
+   self.error = error
+
+class PositionIndexer(QtCore.QThread):
+ '''Loads or builds the position index and the opening tree of a database in a background thread (see *PositionIndex.open* and *OpeningTree.open*)
+
+:param gameList: the game list of the PGN-file or the *GameStore*
+:param parent: parent object
+ '''
+
+ def __init__(self, gameList : IndexedGameList, parent : Optional[QtCore.QObject] = None) -> None:
+  super(PositionIndexer, self).__init__(parent)
+  self.gameList = gameList
+  self.positionIndex = None
+  self.openingTree = None
+  self.cancelled = False
+  self.error = None
+
+ def cancel(self) -> None:
+  '''Stops building the index'''
+  self.cancelled = True
+
+ def _notify(self, count : int) -> bool:
+  return self.cancelled
+
+ def run(self) -> None:
+  try:
+   self.positionIndex = PositionIndex.open(self.gameList.pgnIndex, notify = self._notify)
+   if self.positionIndex is not None:
+    self.openingTree = OpeningTree.open(self.positionIndex, self.gameList.headerIndex(), notify = self._notify)
+  except Exception as error:
+   self.error = error
+
 class ChessMainWindow(QtWidgets.QMainWindow):
  logSignal = QtCore.pyqtSignal(str)
  notifySignal = QtCore.pyqtSignal(str)
  notifyGameSelectedSignal = QtCore.pyqtSignal(int)
  notifyGameListHeaderChangedSignal = QtCore.pyqtSignal(list)
  notifyGameListChangedSignal = QtCore.pyqtSignal()
+ notifyGameRowsMovedSignal = QtCore.pyqtSignal(int, int, int)
+ notifyGameRowsRemovedSignal = QtCore.pyqtSignal(list)
  notifyGameHeadersChangedSignal = QtCore.pyqtSignal(chess.pgn.Headers)
 
  notifyGameNodeSelectedSignal = QtCore.pyqtSignal(chess.pgn.GameNode)
@@ -165,6 +249,7 @@ class ChessMainWindow(QtWidgets.QMainWindow):
  fileDirectory = os.path.dirname(os.path.abspath(__file__))
  intRe = re.compile(r"^[+-]?[1-9][0-9]*$")
  boolRe = re.compile(r"^(True|False)$")
+ annotationTimeout_msec = 60000
 
  def __init__(self, parent = None) -> None:
   super(ChessMainWindow, self).__init__(parent)
@@ -239,7 +324,10 @@ class ChessMainWindow(QtWidgets.QMainWindow):
   if not os.path.isdir(self.settingsDir):
    os.mkdir(self.settingsDir, 0o755)
   self.settingsFile = os.path.join(self.settingsDir, 'settings.ini')
-  self.recoverFile = os.path.join(self.settingsDir, 'recover.ppgn')
+  self.recoverFile = os.path.join(self.settingsDir, 'recover.journal')
+  self.journal = RecoveryJournal(self.recoverFile)
+  self.journalStates = dict()
+  self.analysisCache = MzChess.AnalysisCache(os.path.join(self.settingsDir, 'analysis.sqlite'))
   self.settings = configparser.ConfigParser(delimiters=['='], allow_no_value=True)
   self.settings.optionxform = str
   self.recentPGN = dict()
@@ -320,6 +408,24 @@ class ChessMainWindow(QtWidgets.QMainWindow):
   self.squareLabel.setAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
   self.squareLabel.setToolTip("Position")
   self.statusBar().addWidget(self.squareLabel, 10)
+  self.loadProgressBar = QtWidgets.QProgressBar()
+  self.loadProgressBar.setRange(0, 100)
+  self.loadProgressBar.setToolTip("Loading database")
+  self.loadProgressBar.hide()
+  self.statusBar().addPermanentWidget(self.loadProgressBar)
+  self.cancelLoadButton = QtWidgets.QPushButton('Cancel')
+  self.cancelLoadButton.setToolTip("Cancel loading the database")
+  self.cancelLoadButton.clicked.connect(self.on_cancelLoadButton_clicked)
+  self.cancelLoadButton.hide()
+  self.statusBar().addPermanentWidget(self.cancelLoadButton)
+  self.pgnLoader = None
+  self.positionIndex = None
+  self.openingTree = None
+  self.positionIndexer = None
+  self.annotateEngine = None
+  self.annotateApplyFunction = None
+  self.annotatePool = None
+  self.annotateOriginalDict = dict()
 
   self.itemSelector = MzChess.ItemSelector('Header Elements (without 7-tag roster)...', pointSize = 10)
   
@@ -337,15 +443,21 @@ class ChessMainWindow(QtWidgets.QMainWindow):
     actAction.setChecked(True)
   self.gameListTableView.setup(notifyDoubleClickSignal = self.notifyGameSelectedSignal, 
                                           notifyHeaderChangedSignal = self.notifyGameListHeaderChangedSignal, 
-                                          notifyListChangedSignal = self.notifyGameListChangedSignal)
+                                          notifyListChangedSignal = self.notifyGameListChangedSignal, 
+                                          notifyRowsMovedSignal = self.notifyGameRowsMovedSignal, 
+                                          notifyRowsRemovedSignal = self.notifyGameRowsRemovedSignal)
   self.gameListTableView.gameHeaderKeys = self.gameListHeaders
   self.notifyGameSelectedSignal.connect(self.gameSelected)
   self.notifyGameListHeaderChangedSignal.connect(self.gameListHeaderChanged)
   self.notifyGameListChangedSignal.connect(self.gameListChanged)
+  self.notifyGameRowsMovedSignal.connect(self.gameRowsMoved)
+  self.notifyGameRowsRemovedSignal.connect(self.gameRowsRemoved)
   self.pgnFile = None
+  self.pgnIndex = None
   self.gameListFile = ''
   self.gameList = list()
   self.gameListChanged = False
+  self.gameListRecovered = False
   self.gameFile = ''
   self.game = chess.pgn.Game()
   self.gameNode = self.game
@@ -482,9 +594,9 @@ class ChessMainWindow(QtWidgets.QMainWindow):
   msgBox.exec()
 
  def setInfoLabel(self):
-  if self.game in self.gameList:
+  try:
    self.gameID = self.gameList.index(self.game)
-  else:
+  except ValueError:
    if self.gameID > 0:
     self.gameID = 0
    self.game = self.gameList[self.gameID]
@@ -502,6 +614,7 @@ class ChessMainWindow(QtWidgets.QMainWindow):
  def setMoveLabel(self, board):
   self.moveLabel.setText('{}/{}'.format(board.fullmove_number, board.halfmove_clock))
   self.moveLabel.update()
+  self.showOpeningTree(board)
   QtWidgets.QApplication.processEvents()
 
  def notify(self, str):
@@ -547,12 +660,19 @@ class ChessMainWindow(QtWidgets.QMainWindow):
      QtWidgets.QMessageBox.StandardButton.No)
    if rc == QtWidgets.QMessageBox.StandardButton.No:
     return False
+  self._cancelLoading()
+  self._cancelPositionIndexing()
+  self._cancelAnnotation()
+  self._cancelDatabaseAnnotation()
   self.gameListChanged = False
+  self.gameListRecovered = False
+  self.journal = RecoveryJournal(self.recoverFile)
   self.gameID = None
   self.undoListList = list()
   self.redoListList = list()
   self.gameList = list()
   self.pgnFile = None
+  self.pgnIndex = None
 
   self._addGame(game = None, isNew = True)
   return True
@@ -566,6 +686,7 @@ class ChessMainWindow(QtWidgets.QMainWindow):
   self.gameNode = self.game
   self.gameID = len(self.gameList)
   self.gameList.append(self.game)
+  self._recordAppend()
   self.undoListList.append(list())
   self.undoListList[self.gameID] = list()
   self.redoListList.append(list())
@@ -597,40 +718,40 @@ class ChessMainWindow(QtWidgets.QMainWindow):
   _,  ext = os.path.splitext(pgnFile)
   if ext == '.ppgn':
    try:
-    with open(pgnFile, mode = 'rb') as f:
-     self.gameList = pickle.load(f)
-     encoding = None
+    if GameStore.isStore(pgnFile):
+     self.gameList = IndexedGameList(GameStore(pgnFile))
+    else:
+     with open(pgnFile, mode = 'rb') as f:
+      self.gameList = pickle.load(f)
+    encoding = None
    except:
     self.notifyError('Cannot open PPGN file {}'.format(pgnFile))
     return
+   if isinstance(self.gameList, IndexedGameList):
+    self.pgnIndex = self.gameList.pgnIndex
+   else:
+    self.pgnIndex = None
   elif ext == '.pgn':
-   try:
-    pgn = open(pgnFile, mode = 'r', encoding = encoding)
-   except:
-    self.notifyError('Cannot open PGN file {}'.format(pgnFile))
-    return
-   n = 1
-   self.gameList = list()
-   while True:
-    actGame = read_game(pgn)
-    if actGame is None:
-     break
-    if len(actGame.errors) == 0:
-     self.gameList.append(actGame)
-    else:
-     self.notifyError('Failed to load game #{}'.format(n))
-     return
-    n += 1
+   self.pgnLoader = PGNLoader(pgnFile, encoding, parent = self)
+   self.pgnLoader.progressSignal.connect(self.pgnLoaderProgress)
+   self.pgnLoader.finished.connect(self.pgnLoaderFinished)
+   self.loadProgressBar.setValue(0)
+   self.loadProgressBar.show()
+   self.cancelLoadButton.show()
+   self.pgnLoader.start()
+   return
   else:
    self.notifyError('Cannot handle file with extension "{}"'.format(ext))
    return
   if len(self.gameList) < 1:   
    self.notifyError('No game loaded')
    return
-  with open(self.recoverFile, mode = 'wb') as f:
-   pickle.dump(self.gameList, f)
   self.gameListTableView.setGameList(self.gameList)
   self.gameSelected(0)
+  self._openedPGN(pgnFile, encoding)
+
+ def _openedPGN(self, pgnFile : str, encoding : Optional[str]) -> None:
+  self._startJournal(pgnFile, encoding)
   self.settings['Recent'] = {pgnFile : encoding}
   newRecentPGN = {pgnFile : encoding}
   for file, enc in self.recentPGN.items():
@@ -643,10 +764,142 @@ class ChessMainWindow(QtWidgets.QMainWindow):
   for rItem in self.recentPGN:
    if rItem is not None and os.path.isfile(rItem):
     self.menuRecentDB.addAction(rItem)
-  if pgnFile != self.recoverFile:
-   os.chdir(os.path.dirname(pgnFile))
-   self.pgnFile = pgnFile
+  os.chdir(os.path.dirname(pgnFile))
+  self.pgnFile = pgnFile
   self.setChessWindowTitle()
+  self._startPositionIndexing()
+
+ def _showLoadedGames(self, loader : 'PGNLoader', count : int) -> None:
+  if loader.gameList is None:
+   if count == 0:
+    return
+   loader.gameList = IndexedGameList(loader.pgnIndex)
+   del loader.gameList.entries[count:]
+   loader.loadedCount = count
+   self.gameList = loader.gameList
+   self.pgnIndex = loader.pgnIndex
+   self.gameListTableView.setGameList(self.gameList)
+   self.gameSelected(0)
+  elif count > loader.loadedCount:
+   self.gameListTableView.model().appendEntries(range(loader.loadedCount, count))
+   for _ in range(count - loader.loadedCount):
+    self.undoListList.append(list())
+    self.redoListList.append(list())
+   loader.loadedCount = count
+   self.setInfoLabel()
+
+ @QtCore.pyqtSlot(int)
+ def pgnLoaderProgress(self, count):
+  loader = self.sender()
+  if loader is not self.pgnLoader:
+   return
+  self._showLoadedGames(loader, count)
+  self.loadProgressBar.setValue(loader.progress())
+  self.notify('Loading {}: {} games ...'.format(os.path.basename(loader.pgnIndex.pgnFile), count))
+
+ @QtCore.pyqtSlot()
+ def pgnLoaderFinished(self):
+  loader = self.sender()
+  if loader is not self.pgnLoader:
+   return
+  self.pgnLoader = None
+  self.loadProgressBar.hide()
+  self.cancelLoadButton.hide()
+  pgnFile = loader.pgnIndex.pgnFile
+  if loader.error is not None or loader.cancelled or len(loader.pgnIndex) == 0:
+   if loader.error is not None:
+    self.notifyError('Cannot open PGN file {}: {}'.format(pgnFile, loader.error))
+   elif loader.cancelled:
+    self.notify('Loading {} cancelled'.format(os.path.basename(pgnFile)))
+   else:
+    self.notifyError('No game loaded')
+   self.gameListChanged = False
+   self._allowNewGameList()
+   return
+  self._showLoadedGames(loader, len(loader.pgnIndex))
+  self._openedPGN(pgnFile, loader.pgnIndex.encoding)
+  if len(loader.pgnIndex.errorList) > 0:
+   errorLines = ['game #{}: {}'.format(gameID, error) for gameID, error in loader.pgnIndex.errorList[:20]]
+   if len(loader.pgnIndex.errorList) > 20:
+    errorLines.append('... and {} more'.format(len(loader.pgnIndex.errorList) - 20))
+   self.notifyError('{} games of {} with errors:\n{}'.format(len(loader.pgnIndex.errorList), pgnFile, '\n'.join(errorLines)))
+
+ @QtCore.pyqtSlot()
+ def on_cancelLoadButton_clicked(self):
+  if self.pgnLoader is not None:
+   self.pgnLoader.cancel()
+
+ def _cancelLoading(self) -> None:
+  if self.pgnLoader is not None:
+   loader, self.pgnLoader = self.pgnLoader, None
+   loader.cancel()
+   loader.wait()
+   self.loadProgressBar.hide()
+   self.cancelLoadButton.hide()
+
+ def _startPositionIndexing(self) -> None:
+  self._cancelPositionIndexing()
+  if isinstance(self.gameList, IndexedGameList):
+   self.positionIndexer = PositionIndexer(self.gameList, parent = self)
+   self.positionIndexer.finished.connect(self.positionIndexerFinished)
+   self.positionIndexer.start()
+
+ def _cancelPositionIndexing(self) -> None:
+  self.positionIndex = None
+  self.openingTree = None
+  if self.positionIndexer is not None:
+   indexer, self.positionIndexer = self.positionIndexer, None
+   indexer.cancel()
+   indexer.wait()
+
+ @QtCore.pyqtSlot()
+ def positionIndexerFinished(self):
+  indexer = self.sender()
+  if indexer is not self.positionIndexer:
+   return
+  self.positionIndexer = None
+  if indexer.error is not None:
+   self.notifyError('Cannot build position index: {}'.format(indexer.error))
+  elif indexer.positionIndex is not None:
+   self.positionIndex = indexer.positionIndex
+   self.openingTree = indexer.openingTree
+   if self.openingTree is not None:
+    self.openingTree.synchronize(self.gameList)
+   self.notify('Position index: {} positions'.format(len(self.positionIndex)))
+   self.showOpeningTree()
+
+ def showOpeningTree(self, board : Optional[chess.Board] = None) -> None:
+  if self.tabWidget.currentWidget() is not self.tabExplorer:
+   return
+  if board is None:
+   board = self.boardGraphicsView.board()
+  if self.openingTree is None and self.positionIndexer is None and not isinstance(self.gameList, IndexedGameList):
+   self.openingTree = OpeningTree()
+   self.openingTree.synchronize(self.gameList)
+  statList = self.openingTree.statistics(board) if self.openingTree is not None else list()
+  self.openingTreeTableWidget.setRowCount(len(statList))
+  for row, (move, count, score, elo) in enumerate(statList):
+   textList = [board.san(move) if board.is_legal(move) else move.uci(), str(count), 
+                    '---' if score is None else '{:.1f}%'.format(100*score), '---' if elo is None else str(elo)]
+   for column, text in enumerate(textList):
+    item = QtWidgets.QTableWidgetItem(text)
+    if column > 0:
+     item.setTextAlignment(QtCore.Qt.AlignmentFlag.AlignRight | QtCore.Qt.AlignmentFlag.AlignVCenter)
+    self.openingTreeTableWidget.setItem(row, column, item)
+
+ @QtCore.pyqtSlot(int)
+ def on_tabWidget_currentChanged(self, index):
+  self.showOpeningTree()
+
+ @QtCore.pyqtSlot()
+ def on_actionFindPosition_triggered(self):
+  if self.positionIndexer is not None:
+   self.notifyError('Position index still building')
+   return
+  positionIndex = self.positionIndex if self.positionIndex is not None else PositionIndex()
+  rowPlyList = positionIndex.findRows(self.gameList, self.boardGraphicsView.board())
+  self.gameListTableView.setRowFilter([row for row, _ in rowPlyList])
+  self.notify('{} games with this position found'.format(len(rowPlyList)))
  
  @QtCore.pyqtSlot(QAction)
  def on_menuEncoding_triggered(self, action):
@@ -659,7 +912,7 @@ class ChessMainWindow(QtWidgets.QMainWindow):
  @QtCore.pyqtSlot()
  def on_actionOpenDB_triggered(self):
   pgnFile, _ = QtWidgets.QFileDialog.getOpenFileName(self,"Load Game Database ...", "",
-        "Pickle Portable Game Notation Files (*.ppgn);;Portable Game Notation Files (*.pgn);;All Files (*)", options = self.fileDialogOptions)
+        "Packed Portable Game Notation Files (*.ppgn);;Portable Game Notation Files (*.pgn);;All Files (*)", options = self.fileDialogOptions)
   if pgnFile is not None and len(pgnFile) > 0:
    self.openPGN(pgnFile, self.encodingDict[self.settings['Menu/Game']['encoding']])
    
@@ -668,7 +921,27 @@ class ChessMainWindow(QtWidgets.QMainWindow):
   if not os.path.exists(self.recoverFile):
    self.notifyError('Recovery database not existing')
    return
-  self.openPGN(self.recoverFile)
+  if not self._allowNewGameList():
+   return
+  self.notify('Recovering database ...')
+  try:
+   self.gameList = self.journal.replay()
+  except Exception as error:
+   self.notifyError('Cannot recover database: {}'.format(error))
+   return
+  if isinstance(self.gameList, IndexedGameList):
+   self.pgnIndex = self.gameList.pgnIndex
+  self.pgnFile = self.journal.baseFile
+  self.gameListFile = os.path.basename(self.pgnFile) if self.pgnFile is not None else ''
+  self.gameListRecovered = True
+  self.undoListList = [list() for _ in range(len(self.gameList))]
+  self.redoListList = [list() for _ in range(len(self.gameList))]
+  self.journalStates = dict()
+  self.gameID = None
+  self.gameListTableView.setGameList(self.gameList)
+  self.gameSelected(0)
+  self.setChessWindowTitle()
+  self._startPositionIndexing()
    
  @QtCore.pyqtSlot()
  def on_actionGameUp_triggered(self):
@@ -681,6 +954,7 @@ class ChessMainWindow(QtWidgets.QMainWindow):
   if not self._allowNewGameList():
    return
   self.notify('Closing database ...')
+  self._startJournal()
   self.setChessWindowTitle()
 
  @QtCore.pyqtSlot(QtGui.QCloseEvent)
@@ -690,6 +964,7 @@ class ChessMainWindow(QtWidgets.QMainWindow):
   else:
    if self.hintEngine is not None:
     self.hintEngine.kill(True)
+   self.analysisCache.close()
    ev.accept()
 
  @QtCore.pyqtSlot()
@@ -701,6 +976,9 @@ class ChessMainWindow(QtWidgets.QMainWindow):
   if len(self.gameList) == 0:
     self.notifyError('No Game Database available')
     return
+  if self.pgnLoader is not None:
+    self.notifyError('Game Database still loading')
+    return
 
   if forceAppend:
    mode = 'a'
@@ -721,40 +999,54 @@ class ChessMainWindow(QtWidgets.QMainWindow):
   else:
    self.notify('Saving database to file {} ...'.format(pgnFile))
   if ext == '.ppgn':
-   if mode == 'a':
-    self.notifyError('Cannot append to PPGN file {}'.format(pgnFile))
-    return
    try:
-    with open(pgnFile, mode = 'wb') as f:
-     pickle.dump(self.gameList, f)
+    if mode == 'a' and GameStore.isStore(pgnFile):
+     GameStore(pgnFile).append(self.gameList)
+    else:
+     GameStore.create(pgnFile, self.gameList)
    except:
-    self.notifyError('Cannot open PPGN file {}'.format(pgnFile))
+    self.notifyError('Cannot save PPGN file {}'.format(pgnFile))
     return
    encoding = None
   elif ext == '.pgn':
    try:
     encoding = self.settings['Menu/Game']['encoding']
-    pgnString = str()
-    for game in self.gameList:
-     exporter = chess.pgn.StringExporter(headers=True, variations=True, comments=True)
-     pgnString += game.accept(exporter)
-     if game != self.gameList[-1]:
-      pgnString += '\n\n'
-    with open(pgnFile, mode = mode,  encoding = self.encodingDict[encoding]) as f:
-     f.write(pgnString)
+    if isinstance(self.gameList, IndexedGameList) and mode == 'w':
+     pgnIndex = self.gameList.savePGN(pgnFile, encoding = self.encodingDict[encoding])
+    else:
+     pgnString = str()
+     for game in self.gameList:
+      exporter = chess.pgn.StringExporter(headers=True, variations=True, comments=True)
+      pgnString += game.accept(exporter)
+      if game != self.gameList[-1]:
+       pgnString += '\n\n'
+     with open(pgnFile, mode = mode,  encoding = self.encodingDict[encoding]) as f:
+      f.write(pgnString)
    except:
     self.notifyError('Cannot save PGN file {}'.format(pgnFile))
     return
   else:
     self.notifyError('PGN file {} has improper extension (.pgn or .pgn expected)'.format(pgnFile))
     return
+  if isinstance(self.gameList, IndexedGameList) and mode == 'w':
+   gameID = self.gameList.index(self.game) if self.game in self.gameList else 0
+   if ext == '.pgn':
+    self.pgnIndex = pgnIndex
+   else:
+    self.pgnIndex = GameStore(pgnFile)
+   self.gameList = IndexedGameList(self.pgnIndex)
+   self.gameListTableView.setGameList(self.gameList)
+   self.gameID = None
+   self.gameSelected(gameID)
+   self._startPositionIndexing()
   self.updateSettingsList('Recent', self.recentPGN.items(), firstValue = (pgnFile, encoding))
   self.saveSettings()
-  with open(self.recoverFile, mode = 'wb') as f:
-   pickle.dump(self.gameList, f)
+  if mode == 'w':
+   self._startJournal(pgnFile, self.encodingDict[encoding] if encoding is not None else None)
   self.gameListFile = os.path.split(pgnFile)[1]
   os.chdir(os.path.dirname(pgnFile))
   self.pgnFile = pgnFile
+  self.gameListRecovered = False
   self.undoListList = list()
   self.redoListList = list()
   self.setChessWindowTitle()
@@ -1049,7 +1341,12 @@ class ChessMainWindow(QtWidgets.QMainWindow):
        self.gameSelected(self.gameID)
     elif attr == 'game':
      self.redoListList[self.gameID].append((attr, [(self.gameNode, pickle.dumps(self.game))]))
-     self.game = pickle.dumps(gameNodeValueList[0][1])
+     originalGame = gameNodeValueList[0][1]
+     if isinstance(originalGame, int):
+      self.game = self.gameList.pgnIndex.readGame(originalGame)
+     else:
+      self.game = pickle.loads(originalGame)
+     self.gameList[self.gameID] = self.game
     else:
      for node, oldAttrValue in gameNodeValueList:
       redoGameNodeValueList.append((node, getattr(node, attr)))
@@ -1110,7 +1407,7 @@ class ChessMainWindow(QtWidgets.QMainWindow):
   self.setChessWindowTitle()
 
  def setChessWindowTitle(self):
-  self.gameListChanged = False 
+  self.gameListChanged = self.gameListRecovered
   for undoList in self.undoListList:
    self.gameListChanged = self.gameListChanged or len(undoList) > 0
    if self.gameListChanged:
@@ -1123,6 +1420,48 @@ class ChessMainWindow(QtWidgets.QMainWindow):
   if self.gameListChanged:
    title += ' *'
   self.setWindowTitle(title)
+  self._recordChanges()
+
+ def _startJournal(self, baseFile : Optional[str] = None, encoding : Optional[str] = None) -> None:
+  self.journalStates = dict()
+  try:
+   self.journal.start(self.gameList, baseFile, encoding)
+  except OSError as error:
+   self.notify('Recovery journal not written: {}'.format(error))
+
+ def _journal(self, recordFunction : Callable[[], None]) -> None:
+  try:
+   recordFunction()
+  except OSError as error:
+   self.notify('Recovery journal not written: {}'.format(error))
+
+ def _recordAppend(self) -> None:
+  self._journal(lambda: self.journal.recordAppend(self.gameList))
+
+ @QtCore.pyqtSlot(int, int, int)
+ def gameRowsMoved(self, start, stop, tgtRow):
+  self._journal(lambda: self.journal.recordMove(self.gameList, range(start, stop), tgtRow))
+
+ @QtCore.pyqtSlot(list)
+ def gameRowsRemoved(self, rows):
+  self._journal(lambda: self.journal.recordRemove(self.gameList, rows))
+
+ def _recordChanges(self, annotatedRows : Optional[Iterable[int]] = None) -> None:
+  changedRows = list(annotatedRows) if annotatedRows is not None else list()
+  if self.gameID is not None and self.gameID < min(len(self.undoListList), len(self.redoListList)):
+   state = (len(self.undoListList[self.gameID]), len(self.redoListList[self.gameID]))
+   if self.journalStates.get(self.gameID, (0, 0)) != state:
+    self.journalStates[self.gameID] = state
+    if self.gameID not in changedRows:
+     changedRows.append(self.gameID)
+  if isinstance(self.gameList, IndexedGameList):
+   for row in changedRows:
+    self.gameList.setDirty(row)
+  if changedRows:
+   self._journal(lambda: self.journal.record(self.gameList, changedRows))
+  if self.openingTree is not None:
+   self.openingTree.synchronize(self.gameList, changedRows)
+   self.showOpeningTree()
 
  # ---------------------------------------------------------------------------
 
@@ -1182,11 +1521,12 @@ class ChessMainWindow(QtWidgets.QMainWindow):
    self.settings['Menu/Engine']['annotateVariants'] = str(int(avValue))
   self.saveSettings()
 
- @QtCore.pyqtSlot()
- def on_actionAnnotateCurrentMove_triggered(self):
-  if self.settings['Menu/Engine']['selectedEngine'] is None:
-   self.notifyError('No engine selected')
-   return
+ def _startAnnotation(self, 
+                                  gameNode : chess.pgn.GameNode, 
+                                  numberOfPlys : Optional[int], 
+                                  annotateVariants : int, 
+                                  applyFunction : Callable[[MzChess.AnnotateEngine], None]) -> None:
+  self._cancelAnnotation()
   if self.debugEngine:
    logFunction = self.logSignal.emit
   else:
@@ -1195,47 +1535,89 @@ class ChessMainWindow(QtWidgets.QMainWindow):
       self.engineDict[self.settings['Menu/Engine']['selectedEngine']], 
       limit = chess.engine.Limit(depth = self.settings['Menu/Engine']['searchDepth']), 
       log = logFunction)
-
+  engine.setAnalysisCache(self.analysisCache)
   aEngine = MzChess.AnnotateEngine(notifyFunction = self.notifySignal.emit)
-  annotateVariants = self.settings['Menu/Engine']['annotateVariants']
-  if annotateVariants is not None and annotateVariants.isdigit():
-   annotateVariants = int(annotateVariants)
-  else:
-   annotateVariants = 0
-  self.notify('Scoring move {} of game #{} ...'.format(self.gameNode.move.uci(), self.gameID))
   aEngine.setup(engine, hintPLYs = annotateVariants, multiPV = int(self.settings['Menu/Engine']['numberOfAnnotations']))
-  if aEngine.run(self.gameNode, numberOfPlys = 1):
-   annotator = MzChess.Annotator(self.settings['Menu/Engine']['selectedEngine'], notifyFunction = self.notifySignal.emit)
-   annotator.setBlunder(-float('inf'), addVariant = False)
-   oldAttrValue = self.gameNode.comment
-   annotator.apply(game = self.gameNode, scoreListList = aEngine.scoreListList, pvListList = None)
-   self.undoListList[self.gameID].append(('comment', [(self.gameNode, oldAttrValue)]))
+  aEngine.finishedSignal.connect(self.annotateEngineFinished)
+  self.annotateEngine = aEngine
+  self.annotateApplyFunction = applyFunction
+  if not aEngine.start(gameNode, numberOfPlys = numberOfPlys, timeout_msec = self.annotationTimeout_msec):
+   self._cancelAnnotation()
+   self.notifyError('Annotation failed')
+
+ def _cancelAnnotation(self) -> None:
+  if self.annotateEngine is not None:
+   aEngine, self.annotateEngine = self.annotateEngine, None
+   aEngine.engine.uciQuit()
+  self.annotateApplyFunction = None
+
+ @QtCore.pyqtSlot(bool)
+ def annotateEngineFinished(self, success):
+  aEngine = self.sender()
+  if aEngine is not self.annotateEngine:
+   return
+  applyFunction = self.annotateApplyFunction
+  self._cancelAnnotation()
+  if success:
+   applyFunction(aEngine)
+  else:
+   self.notifyError('Annotation failed')
+
+ def _stopRunningAnnotation(self) -> bool:
+  if self.annotateEngine is None:
+   return False
+  self._cancelAnnotation()
+  self.notify('Annotation cancelled')
+  return True
+
+ def _annotatedGameID(self, game : chess.pgn.Game) -> Optional[int]:
+  try:
+   return self.gameList.index(game)
+  except ValueError:
+   return None
+
+ def _showAnnotation(self, gameID : int) -> None:
+  if gameID == self.gameID:
    if self.gameNode == self.game:
     self.scorePlotGraphicsView.setGame(self.game)
    self.gameTreeViewWidget.setGame(self.game)
    # self.gameHeaderTableView.setGame(self.game)
    self.gameNodeSelected(self.gameNode)
-   self.setChessWindowTitle()
-  else:
-   self.notifyError('Annotation failed')
-   return
+  self.setChessWindowTitle()
 
  @QtCore.pyqtSlot()
- def on_actionAnnotateAll_triggered(self):
+ def on_actionAnnotateCurrentMove_triggered(self):
+  if self._stopRunningAnnotation():
+   return
   if self.settings['Menu/Engine']['selectedEngine'] is None:
    self.notifyError('No engine selected')
    return
-  
-  if self.debugEngine:
-   logFunction = self.logSignal.emit
+  annotateVariants = self.settings['Menu/Engine']['annotateVariants']
+  if annotateVariants is not None and annotateVariants.isdigit():
+   annotateVariants = int(annotateVariants)
   else:
-   logFunction = None
-  engine = MzChess.ChessEngine(
-      self.engineDict[self.settings['Menu/Engine']['selectedEngine']], 
-      limit = chess.engine.Limit(depth = self.settings['Menu/Engine']['searchDepth']), 
-      log = logFunction)
+   annotateVariants = 0
+  gameID, game, gameNode = self.gameID, self.game, self.gameNode
+  def applyScore(aEngine):
+   annotator = MzChess.Annotator(self.settings['Menu/Engine']['selectedEngine'], notifyFunction = self.notifySignal.emit)
+   annotator.setBlunder(-float('inf'), addVariant = False)
+   oldAttrValue = gameNode.comment
+   annotator.apply(game = gameNode, scoreListList = aEngine.scoreListList, pvListList = None)
+   actGameID = self._annotatedGameID(game)
+   if actGameID is None:
+    return
+   self.undoListList[actGameID].append(('comment', [(gameNode, oldAttrValue)]))
+   self._showAnnotation(actGameID)
+  self.notify('Scoring move {} of game #{} ...'.format(gameNode.move.uci(), gameID))
+  self._startAnnotation(gameNode, 1, annotateVariants, applyScore)
 
-  aEngine = MzChess.AnnotateEngine(notifyFunction = self.notifySignal.emit)
+ @QtCore.pyqtSlot()
+ def on_actionAnnotateAll_triggered(self):
+  if self._stopRunningAnnotation():
+   return
+  if self.settings['Menu/Engine']['selectedEngine'] is None:
+   self.notifyError('No engine selected')
+   return
   annotateVariants = self.settings['Menu/Engine']['annotateVariants']
   if annotateVariants is not None and annotateVariants.isdigit():
    annotateVariants = int(annotateVariants.split(' ')[0])
@@ -1246,12 +1628,12 @@ class ChessMainWindow(QtWidgets.QMainWindow):
    if gameNode.parent.variations[0] != gameNode:
     break
    gameNode = gameNode.parent
-  if gameNode == self.game:
-   self.notify('Annotating game #{} ...'.format(self.gameID))
+  gameID, game = self.gameID, self.game
+  if gameNode == game:
+   self.notify('Annotating game #{} ...'.format(gameID))
   else:
-   self.notify('Annotating variant {} of #{} ...'.format(gameNode, self.gameID))
-  aEngine.setup(engine, hintPLYs = annotateVariants, multiPV = int(self.settings['Menu/Engine']['numberOfAnnotations']))
-  if aEngine.run(gameNode, numberOfPlys = None):
+   self.notify('Annotating variant {} of #{} ...'.format(gameNode, gameID))
+  def applyAnnotation(aEngine):
    annotator = MzChess.Annotator(self.settings['Menu/Engine']['selectedEngine'])
    addVariant = self.settings['Menu/Engine']['blunderLimit'] != '-inf'
    annotator.setBlunder(float(self.settings['Menu/Engine']['blunderLimit']), addVariant = addVariant)
@@ -1260,19 +1642,136 @@ class ChessMainWindow(QtWidgets.QMainWindow):
     if actGameNode.comment != '':
      undoGameNodeValueList.append((actGameNode, gameNode.comment))
    hintsAdded = annotator.apply(game = gameNode, scoreListList = aEngine.scoreListList, pvListList = aEngine.pvListList)
+   actGameID = self._annotatedGameID(game)
+   if actGameID is None:
+    return
    if hintsAdded:
-    self.undoListList[self.gameID].append(('game', [(self.gameNode, pickle.dumps(self.game))]))
+    self.undoListList[actGameID].append(('game', [(gameNode, pickle.dumps(game))]))
    else:
-    self.undoListList[self.gameID].append(('comment', [(self.gameNode, undoGameNodeValueList)]))
-   if gameNode == self.game:
-    self.scorePlotGraphicsView.setGame(self.game)
-   self.gameTreeViewWidget.setGame(self.game)
-   # self.gameHeaderTableView.setGame(self.game)
-   self.gameNodeSelected(self.gameNode)
-   self.setChessWindowTitle()
+    self.undoListList[actGameID].append(('comment', [(gameNode, undoGameNodeValueList)]))
+   self._showAnnotation(actGameID)
+  self._startAnnotation(gameNode, None, annotateVariants, applyAnnotation)
+
+ def _annotationGames(self) -> Iterator[chess.pgn.Game]:
+  isIndexed = isinstance(self.gameList, IndexedGameList)
+  entries = self.gameList.entries if isIndexed else self.gameList
+  row = 0
+  while row < len(entries):
+   entry = entries[row]
+   if isIndexed and not self.gameList.isDirty(row):
+    game = self.gameList.pin(row)
+    original = entry
+   else:
+    game = self.gameList[row]
+    original = pickle.dumps(game)
+   self.annotateOriginalDict[row] = (entry, original)
+   yield game
+   row += 1
+
+ def _annotatedRow(self, entry : Union[int, chess.pgn.Game]) -> Optional[int]:
+  entries = self.gameList.entries if isinstance(self.gameList, IndexedGameList) else self.gameList
+  for row, actEntry in enumerate(entries):
+   if self._isEntry(actEntry, entry):
+    return row
+  return None
+
+ @staticmethod
+ def _isEntry(actEntry : Union[int, chess.pgn.Game], entry : Union[int, chess.pgn.Game]) -> bool:
+  return actEntry is entry or (isinstance(entry, int) and isinstance(actEntry, int) and actEntry == entry)
+
+ def _cancelDatabaseAnnotation(self) -> None:
+  if self.annotatePool is not None:
+   pool, self.annotatePool = self.annotatePool, None
+   pool.quit()
+  if isinstance(self.gameList, IndexedGameList):
+   for entry, _ in self.annotateOriginalDict.values():
+    row = self._annotatedRow(entry)
+    if row is not None and row != self.gameID:
+     self.gameList.release(row)
+  self.annotateOriginalDict = dict()
+
+ @QtCore.pyqtSlot()
+ def on_actionAnnotateDatabase_triggered(self):
+  if self.annotatePool is not None:
+   self.notify('Stopping the annotation of the database ...')
+   self.annotatePool.stop()
+   return
+  if self.settings['Menu/Engine']['selectedEngine'] is None:
+   self.notifyError('No engine selected')
+   return
+  if len(self.gameList) == 0:
+   self.notifyError('No Game Database available')
+   return
+  if self.pgnLoader is not None:
+   self.notifyError('Game Database still loading')
+   return
+  numberOfEngines, ok = QtWidgets.QInputDialog.getInt(self, 'Annotate Database', 
+    'Number of engines:', max(1, os.cpu_count() or 1), 1, 256)
+  if not ok:
+   return
+  if self.debugEngine:
+   logFunction = self.logSignal.emit
+  else:
+   logFunction = None
+  selectedEngine = self.settings['Menu/Engine']['selectedEngine']
+  annotateVariants = self.settings['Menu/Engine']['annotateVariants']
+  if annotateVariants is not None and annotateVariants.isdigit():
+   annotateVariants = int(annotateVariants.split(' ')[0])
   else:
+   annotateVariants = 0
+  pool = MzChess.AnnotatePool(
+      self.engineDict[selectedEngine], 
+      numberOfEngines = numberOfEngines, 
+      limit = chess.engine.Limit(depth = self.settings['Menu/Engine']['searchDepth']), 
+      log = logFunction, 
+      notifyFunction = self.notifySignal.emit, 
+      analysisCache = self.analysisCache, 
+      timeout_msec = self.annotationTimeout_msec)
+  annotator = MzChess.Annotator(selectedEngine)
+  addVariant = self.settings['Menu/Engine']['blunderLimit'] != '-inf'
+  annotator.setBlunder(float(self.settings['Menu/Engine']['blunderLimit']), addVariant = addVariant)
+  pool.setup(annotator, hintPLYs = annotateVariants, multiPV = int(self.settings['Menu/Engine']['numberOfAnnotations']))
+  pool.gameAnnotatedSignal.connect(self.databaseGameAnnotated)
+  pool.finishedSignal.connect(self.annotatePoolFinished)
+  self.notify('Annotating {} games with {} engines ...'.format(len(self.gameList), len(pool)))
+  self.annotatePool = pool
+  self.annotateOriginalDict = dict()
+  if not pool.start(self._annotationGames()):
+   self._cancelDatabaseAnnotation()
    self.notifyError('Annotation failed')
+
+ @QtCore.pyqtSlot(int, chess.pgn.Game)
+ def databaseGameAnnotated(self, sequenceID, game):
+  if self.sender() is not self.annotatePool:
    return
+  entry, originalGame = self.annotateOriginalDict.pop(sequenceID, (game, None))
+  entries = self.gameList.entries if isinstance(self.gameList, IndexedGameList) else self.gameList
+  if sequenceID < len(entries) and self._isEntry(entries[sequenceID], entry):
+   row = sequenceID
+  else:
+   row = self._annotatedRow(entry)
+   if row is None:
+    return
+  if row < len(self.undoListList) and originalGame is not None:
+   self.undoListList[row].append(('game', [(game, originalGame)]))
+  self._recordChanges([row])
+  if row == self.gameID:
+   self.scorePlotGraphicsView.setGame(self.game)
+   self.gameTreeViewWidget.setGame(self.game)
+   self.gameNodeSelected(self.gameNode)
+
+ @QtCore.pyqtSlot()
+ def annotatePoolFinished(self):
+  pool = self.sender()
+  if pool is not self.annotatePool:
+   return
+  positionsPerSecond, gamesPerSecond = pool.throughput()
+  self.notify('{} games annotated in {:.1f} s: {:.1f} positions/s, {:.2f} games/s'.format(
+    pool.gamesAnnotated, pool.elapsed, positionsPerSecond, gamesPerSecond))
+  if pool.gamesLost > 0 and len(pool) == 0:
+   self.notifyError('Annotation failed: {} games not annotated, no engine left'.format(pool.gamesLost))
+  self._cancelDatabaseAnnotation()
+  self.setChessWindowTitle()
 
  @QtCore.pyqtSlot(bool)
  def on_actionShowOptions_toggled(self, checked):
@@ -1322,6 +1821,7 @@ class ChessMainWindow(QtWidgets.QMainWindow):
       self.engineDict[self.settings['Menu/Engine']['selectedEngine']], 
       limit = chess.engine.Limit(depth = self.settings['Menu/Engine']['searchDepth']), 
       log = logFunction)
+   self.hintEngine.setAnalysisCache(self.analysisCache)
    self.boardGraphicsView.setHint(enableHint = hintsChecked, enableScore = scoresChecked, engine = self.hintEngine)
    self.engineLabel.setText(self.settings['Menu/Engine']['selectedEngine'])
   else:
@@ -1428,10 +1928,21 @@ class ChessMainWindow(QtWidgets.QMainWindow):
  @QtCore.pyqtSlot(int)
  def gameSelected(self, gameID):
   if gameID != self.gameID or True:
+   if isinstance(self.gameList, IndexedGameList):
+    if self.gameID is not None and self.gameID != gameID and self.gameID < len(self.gameList) \
+     and (self.gameID >= len(self.undoListList) or len(self.undoListList[self.gameID]) == 0):
+     self.gameList.release(self.gameID)
+    try:
+     self.gameList.pin(gameID)
+    except Exception as error:
+     self.notifyError('Failed to load game #{}: {}'.format(gameID, error))
+     return
    self.gameID = gameID
    self.game = self.gameList[gameID]
    self.gameNode = self.game
    self.notify('Loading game #{} ...'.format(self.gameID))
+   if len(self.game.errors) > 0:
+    self.notifyError('Game #{} loaded with errors: {}'.format(self.gameID, self.game.errors[0]))
   try:
    self._showEcoCode(self.game, fromBeginning = True)
    self.boardGraphicsView.setGameNode(self.game)
@@ -0,0 +1,650 @@
+'''A compact binary store for `chess.pgn`_ games (*.ppgn* files)
+
+.. _chess.pgn: https://pypi.org/project/chess
+'''
+
+from typing import Callable, Union, Optional, Iterable, Iterator, List, Tuple
+import os, os.path
+import sys
+import struct
+import array
+import tempfile
+import pickle
+
+import chess, chess.pgn
+
+if __package__:
+ from .pgnParse import IndexedGameList, PGNIndex
+else:
+ from pgnParse import IndexedGameList, PGNIndex
+
+class GameStore(object):
+ '''A compact binary store of *chess.pgn.Game* objects
+
+The file consists of a fixed header, one record per game and an offset table at the end of the file.
+The header holds magic, version, position and length of the offset table. The offset table holds,
+for every game, offset, size and capacity of its record. A record holds
+
+ * the tag pairs (lengths coded as unsigned 16 bit integers, strings coded as utf-8),
+ * the comment of the game (length coded as unsigned 32 bit integer),
+ * the move tree in the order of the PGN export, every move coded as unsigned 16 bit integer
+   (bits 0..5: from square, bits 6..11: to square, bits 12..14: promotion piece type).
+   If bit 15 is set, a byte with flags follows, announcing the comment (1), the starting comment (2)
+   and the NAGs (4) of the node. Variations are enclosed in the codes *variationStart* and *variationEnd*,
+   which are moves with equal, non-zero from and to squares.
+
+Games are read randomly via the offset table without decoding other games, the moves are
+decoded without replaying them on a board. New games are appended and a single game is rewritten in place,
+if its record fits into the capacity of the old one, otherwise it is moved to the end of the file.
+Moved and new records as well as the new offset table are written behind the old table and the header 
+is updated last, i.e. an interrupted write leaves the previous state of the store readable. 
+The space of old tables and moved records is reclaimed by *create*.
+
+:param storeFile: path of the store
+ '''
+ magic = b'MZGS'
+ version = 1
+ headerStruct = struct.Struct('<4sHHQQ')
+ lengthStruct = struct.Struct('<H')
+ tagStruct = struct.Struct('<HH')
+ maxTagLength = (1 << 16) - 1
+ commentStruct = struct.Struct('<I')
+ variationStart = 1 | 1 << 6
+ variationEnd = 2 | 2 << 6
+ annotated = 1 << 15
+
+ def __init__(self, storeFile : str) -> None:
+  self.storeFile = os.path.abspath(storeFile)
+  self._readTable()
+
+ def _readTable(self) -> None:
+  with open(self.storeFile, mode = 'rb') as f:
+   magic, version, _, self.tableOffset, count = self.headerStruct.unpack(f.read(self.headerStruct.size))
+   if magic != self.magic:
+    raise ValueError('GameStore: {} is not a game store'.format(self.storeFile))
+   if version != self.version:
+    raise ValueError('GameStore: version {} of {} not supported'.format(version, self.storeFile))
+   f.seek(self.tableOffset)
+   self.offsetArray = self._readArray(f, 'q', count)
+   self.sizeArray = self._readArray(f, 'I', count)
+   self.capacityArray = self._readArray(f, 'I', count)
+
+ @classmethod
+ def isStore(cls, storeFile : str) -> bool:
+  '''Returns True, if the file starts with the magic of a game store'''
+  try:
+   with open(storeFile, mode = 'rb') as f:
+    return f.read(len(cls.magic)) == cls.magic
+  except OSError:
+   return False
+
+ @classmethod
+ def create(cls, storeFile : str, games : Iterable[Union[chess.pgn.Game, bytes]]) -> 'GameStore':
+  '''Writes the games to a new store, replacing an existing file
+
+The store is written to a temporary file, which replaces *storeFile* at the end.
+If *games* is an *IndexedGameList* of a store, the records of games not parsed are copied
+without decoding. If that store is *storeFile*, the list has to be reopened afterwards.
+
+:param storeFile: path of the store
+:param games: the games (or records)
+:returns: the new store
+  '''
+  storeFile = os.path.abspath(storeFile)
+  offsetArray = array.array('q')
+  sizeArray = array.array('I')
+  fd, tmpFile = tempfile.mkstemp(suffix = '.tmp', dir = os.path.dirname(storeFile))
+  try:
+   with os.fdopen(fd, mode = 'wb') as f:
+    offset = cls.headerStruct.size
+    f.write(cls.headerStruct.pack(cls.magic, cls.version, 0, 0, 0))
+    for record in cls._records(games):
+     f.write(record)
+     offsetArray.append(offset)
+     sizeArray.append(len(record))
+     offset += len(record)
+    cls._writeArrays(f, offsetArray, sizeArray, sizeArray)
+    f.seek(0)
+    f.write(cls.headerStruct.pack(cls.magic, cls.version, 0, offset, len(offsetArray)))
+   os.replace(tmpFile, storeFile)
+  except BaseException:
+   os.remove(tmpFile)
+   raise
+  return cls(storeFile)
+
+ @classmethod
+ def _records(cls, games : Iterable[Union[chess.pgn.Game, bytes]]) -> Iterator[bytes]:
+  source = getattr(games, 'pgnIndex', None)
+  if isinstance(source, GameStore):
+   for row in range(len(games)):
+    if games.isParsed(row):
+     yield cls.encodeGame(games[row])
+    else:
+     yield source.readRecord(games.entries[row])
+   return
+  for game in games:
+   if isinstance(game, (bytes, bytearray)):
+    yield bytes(game)
+   else:
+    yield cls.encodeGame(game)
+
+ @staticmethod
+ def _readArray(f, typecode : str, count : int) -> array.array:
+  result = array.array(typecode)
+  result.frombytes(f.read(count * result.itemsize))
+  if sys.byteorder != 'little':
+   result.byteswap()
+  return result
+
+ @staticmethod
+ def _writeArrays(f, *arrays : array.array) -> None:
+  for actArray in arrays:
+   if sys.byteorder != 'little':
+    actArray = array.array(actArray.typecode, actArray)
+    actArray.byteswap()
+   f.write(actArray.tobytes())
+
+ def __len__(self) -> int:
+  return len(self.offsetArray)
+
+ def readRecord(self, gameID : int) -> bytes:
+  '''Returns the record of a game
+
+:param gameID: number of the game (starting with 0)
+:returns: the bytes of the record
+  '''
+  with open(self.storeFile, mode = 'rb') as f:
+   f.seek(self.offsetArray[gameID])
+   return f.read(self.sizeArray[gameID])
+
+ def readGame(self, gameID : int) -> chess.pgn.Game:
+  '''Returns a game of the store
+
+:param gameID: number of the game (starting with 0)
+:returns: the game
+  '''
+  return self.decodeGame(self.readRecord(gameID))
+
+ def readHeaders(self, gameID : int) -> chess.pgn.Headers:
+  '''Returns the tag pairs of a game without decoding its moves
+
+:param gameID: number of the game (starting with 0)
+:returns: a *chess.pgn.Headers* object
+  '''
+  tagPairs, _ = self._decodeHeaders(memoryview(self.readRecord(gameID)))
+  return chess.pgn.Headers(tagPairs)
+
+ def _writeRecord(self, f, gameID : int, record : bytes) -> None:
+  if gameID < len(self) and len(record) <= self.capacityArray[gameID]:
+   f.seek(self.offsetArray[gameID])
+   f.write(record)
+   self.sizeArray[gameID] = len(record)
+   return
+  offset = f.seek(0, os.SEEK_END)
+  f.write(record)
+  if gameID < len(self):
+   self.offsetArray[gameID] = offset
+   self.sizeArray[gameID] = len(record)
+   self.capacityArray[gameID] = len(record)
+  else:
+   self.offsetArray.append(offset)
+   self.sizeArray.append(len(record))
+   self.capacityArray.append(len(record))
+
+ def _writeTable(self, f) -> None:
+  tableOffset = f.seek(0, os.SEEK_END)
+  self._writeArrays(f, self.offsetArray, self.sizeArray, self.capacityArray)
+  f.flush()
+  os.fsync(f.fileno())
+  f.seek(0)
+  f.write(self.headerStruct.pack(self.magic, self.version, 0, tableOffset, len(self)))
+  self.tableOffset = tableOffset
+
+ def _update(self, recordList : Iterable[Tuple[int, bytes]]) -> None:
+  try:
+   with open(self.storeFile, mode = 'r+b') as f:
+    for gameID, record in recordList:
+     self._writeRecord(f, gameID, record)
+    self._writeTable(f)
+  except BaseException:
+   self._readTable()
+   raise
+
+ def append(self, games : Union[chess.pgn.Game, Iterable[chess.pgn.Game]]) -> int:
+  '''Appends games to the store
+
+:param games: a game or the games to be appended
+:returns: the number of the first appended game
+  '''
+  if isinstance(games, chess.pgn.Game):
+   games = [games]
+  gameID = len(self)
+  self._update((gameID + n, record) for n, record in enumerate(self._records(games)))
+  return gameID
+
+ def rewrite(self, gameID : int, game : chess.pgn.Game) -> None:
+  '''Replaces a game of the store, in place if its record fits into the old one
+
+:param gameID: number of the game (starting with 0)
+:param game: the new game
+  '''
+  if not 0 <= gameID < len(self):
+   raise IndexError('GameStore: game #{} not in store'.format(gameID + 1))
+  self._update([(gameID, self.encodeGame(game))])
+
+ @classmethod
+ def encodeMove(cls, move : chess.Move) -> int:
+  '''Returns the 16 bit code of a move'''
+  if move.drop is not None:
+   raise ValueError('GameStore: drop {} not supported'.format(move.uci()))
+  code = move.from_square | move.to_square << 6
+  if move.promotion is not None:
+   code |= move.promotion << 12
+  return code
+
+ @classmethod
+ def decodeMove(cls, code : int) -> chess.Move:
+  '''Returns the move of a 16 bit code (see *encodeMove*), bit 15 is ignored'''
+  promotion = (code >> 12) & 7
+  return chess.Move(code & 63, (code >> 6) & 63, promotion if promotion else None)
+
+ @classmethod
+ def encodeGame(cls, game : chess.pgn.Game) -> bytes:
+  '''Returns the record of a game
+
+:param game: the game
+:returns: the bytes of the record
+  '''
+  record = bytearray(cls.lengthStruct.pack(len(game.headers)))
+  for name, value in game.headers.items():
+   name = name.encode('utf-8')
+   value = value.encode('utf-8')
+   if len(name) > cls.maxTagLength or len(value) > cls.maxTagLength:
+    raise ValueError('GameStore: tag pair {} exceeds {} bytes'.format(name[:32].decode('utf-8', errors = 'replace'), cls.maxTagLength))
+   record += cls.tagStruct.pack(len(name), len(value))
+   record += name
+   record += value
+  cls._encodeString(record, game.comment)
+  cls._encodeLine(record, game)
+  return bytes(record)
+
+ @classmethod
+ def _encodeString(cls, record : bytearray, text : str) -> None:
+  text = text.encode('utf-8')
+  record += cls.commentStruct.pack(len(text))
+  record += text
+
+ @classmethod
+ def _encodeNode(cls, record : bytearray, node : chess.pgn.ChildNode) -> None:
+  code = cls.encodeMove(node.move)
+  flags = 0
+  if node.comment:
+   flags |= 1
+  if node.starting_comment:
+   flags |= 2
+  if node.nags:
+   flags |= 4
+  if flags == 0:
+   record += cls.lengthStruct.pack(code)
+   return
+  record += cls.lengthStruct.pack(code | cls.annotated)
+  record.append(flags)
+  if node.comment:
+   cls._encodeString(record, node.comment)
+  if node.starting_comment:
+   cls._encodeString(record, node.starting_comment)
+  if node.nags:
+   record.append(len(node.nags))
+   record += bytes(sorted(node.nags))
+
+ @classmethod
+ def _encodeLine(cls, record : bytearray, node : chess.pgn.GameNode) -> None:
+  while node.variations:
+   mainNode = node.variations[0]
+   cls._encodeNode(record, mainNode)
+   for sideNode in node.variations[1:]:
+    record += cls.lengthStruct.pack(cls.variationStart)
+    cls._encodeNode(record, sideNode)
+    cls._encodeLine(record, sideNode)
+    record += cls.lengthStruct.pack(cls.variationEnd)
+   node = mainNode
+
+ @classmethod
+ def _decodeHeaders(cls, record : memoryview) -> Tuple[List[Tuple[str, str]], int]:
+  count, = cls.lengthStruct.unpack_from(record, 0)
+  pos = cls.lengthStruct.size
+  tagPairs = list()
+  for _ in range(count):
+   nameLength, valueLength = cls.tagStruct.unpack_from(record, pos)
+   pos += cls.tagStruct.size
+   name = str(record[pos:pos + nameLength], 'utf-8')
+   pos += nameLength
+   tagPairs.append((name, str(record[pos:pos + valueLength], 'utf-8')))
+   pos += valueLength
+  return tagPairs, pos
+
+ @classmethod
+ def _decodeString(cls, record : memoryview, pos : int) -> Tuple[str, int]:
+  length, = cls.commentStruct.unpack_from(record, pos)
+  pos += cls.commentStruct.size
+  return str(record[pos:pos + length], 'utf-8'), pos + length
+
+ @classmethod
+ def decodeGame(cls, record : bytes) -> chess.pgn.Game:
+  '''Returns the game of a record
+
+:param record: the bytes of the record
+:returns: the game
+  '''
+  record = memoryview(record)
+  tagPairs, pos = cls._decodeHeaders(record)
+  game = chess.pgn.Game(tagPairs)
+  game.comment, pos = cls._decodeString(record, pos)
+  unpackCode = cls.lengthStruct.unpack_from
+  node = game
+  nodeStack = list()
+  while pos < len(record):
+   code, = unpackCode(record, pos)
+   pos += 2
+   if code == cls.variationStart:
+    nodeStack.append(node)
+    node = node.parent
+    continue
+   if code == cls.variationEnd:
+    node = nodeStack.pop()
+    continue
+   node = node.add_variation(cls.decodeMove(code))
+   if code & cls.annotated:
+    flags = record[pos]
+    pos += 1
+    if flags & 1:
+     node.comment, pos = cls._decodeString(record, pos)
+    if flags & 2:
+     node.starting_comment, pos = cls._decodeString(record, pos)
+    if flags & 4:
+     count = record[pos]
+     node.nags = set(record[pos + 1:pos + 1 + count])
+     pos += 1 + count
+  return game
+
+class RecoveryJournal(object):
+ '''An append-only journal of the changes of a game list
+
+The journal refers to the file the game list was opened from or saved to (the base) and records only
+the changes reported by the editor: a *game* record holds the row and the record (see *GameStore*) 
+of a changed or appended game, a *move* record a range of rows moved to a target row and a *remove* record
+the removed rows. An *order* record holds, for every row, the previous row of its game (or -1 for a new game),
+it is written only by compaction. Records are appended, so after a crash the game list is restored 
+by replaying the journal on its base. If the journal exceeds *compactSize* and twice its size after 
+the last compaction, it is rewritten holding only the rows taken from the base and the changed games.
+
+:param journalFile: path of the journal
+:param compactSize: minimum size of the journal in bytes before compaction
+ '''
+ magic = b'MZRJ'
+ version = 2
+ recordStruct = struct.Struct('<BI')
+ stampStruct = struct.Struct('<qd')
+ rowStruct = struct.Struct('<I')
+ moveStruct = struct.Struct('<III')
+ baseRecord = 0
+ orderRecord = 1
+ gameRecord = 2
+ moveRecord = 3
+ removeRecord = 4
+
+ def __init__(self, journalFile : str, compactSize : int = 1 << 20) -> None:
+  self.journalFile = os.path.abspath(journalFile)
+  self.compactSize = compactSize
+  self.compactedSize = 0
+  self.baseFile = None
+  self.encoding = None
+  self.started = False
+  self.sourceRows = list()
+  self.changedGames = dict()
+
+ @staticmethod
+ def _entries(gameList : Union[list, IndexedGameList]) -> list:
+  return getattr(gameList, 'entries', gameList)
+
+ @staticmethod
+ def _moveRows(rowList : list, srcRowRange : range, tgtRow : int) -> None:
+  if srcRowRange.start <= tgtRow <= srcRowRange.stop:
+   return
+  movedRows = rowList[srcRowRange.start:srcRowRange.stop]
+  if tgtRow < srcRowRange.start:
+   rowList[tgtRow:srcRowRange.stop] = movedRows + rowList[tgtRow:srcRowRange.start]
+  else:
+   rowList[srcRowRange.start:tgtRow] = rowList[srcRowRange.stop:tgtRow] + movedRows
+
+ @staticmethod
+ def _removeRows(rowList : list, rows : Iterable[int]) -> None:
+  for row in sorted(set(rows), reverse = True):
+   del rowList[row]
+
+ @staticmethod
+ def _parsedGame(gameList : Union[list, IndexedGameList], row : int) -> Optional[chess.pgn.Game]:
+  if hasattr(gameList, 'isParsed') and not gameList.isParsed(row):
+   return None
+  return gameList[row]
+
+ def isStarted(self) -> bool:
+  '''Returns True, if changes are recorded'''
+  return self.started
+
+ def start(self, gameList : Union[list, IndexedGameList], baseFile : Optional[str] = None, encoding : Optional[str] = None) -> None:
+  '''Starts a new journal of a game list holding the games of its base
+
+:param gameList: the game list, the numbers of an *IndexedGameList* refer to the games of the base
+:param baseFile: path of the PGN- or PPGN-file holding the games of *gameList*, None for a new database
+:param encoding: encoding of a PGN-file
+  '''
+  self.baseFile = os.path.abspath(baseFile) if baseFile is not None else None
+  self.encoding = encoding
+  entries = self._entries(gameList)
+  self.started = True
+  self.changedGames = dict()
+  if self.baseFile is None:
+   self.sourceRows = [-1] * len(entries)
+  elif entries is not gameList:
+   self.sourceRows = [entry if isinstance(entry, int) else -1 for entry in entries]
+  else:
+   self.sourceRows = list(range(len(entries)))
+  self._rewrite(gameList)
+
+ def _writeRecord(self, f, recordType : int, payload : bytes) -> None:
+  f.write(self.recordStruct.pack(recordType, len(payload)))
+  f.write(payload)
+
+ def _writeOrder(self, f, rowArray : array.array) -> None:
+  if sys.byteorder != 'little':
+   rowArray = array.array(rowArray.typecode, rowArray)
+   rowArray.byteswap()
+  self._writeRecord(f, self.orderRecord, rowArray.tobytes())
+
+ def _writeGame(self, f, row : int, game : chess.pgn.Game) -> None:
+  self._writeRecord(f, self.gameRecord, self.rowStruct.pack(row) + GameStore.encodeGame(game))
+
+ def _rewrite(self, gameList : Union[list, IndexedGameList]) -> None:
+  if self.baseFile is None:
+   base = b''
+   stamp = self.stampStruct.pack(0, 0.)
+  else:
+   base = self.baseFile.encode('utf-8')
+   stat = os.stat(self.baseFile)
+   stamp = self.stampStruct.pack(stat.st_size, stat.st_mtime)
+  encoding = (self.encoding or '').encode('utf-8')
+  fd, tmpFile = tempfile.mkstemp(suffix = '.tmp', dir = os.path.dirname(self.journalFile))
+  try:
+   with os.fdopen(fd, mode = 'wb') as f:
+    f.write(self.magic + struct.pack('<H', self.version))
+    self._writeRecord(f, self.baseRecord, struct.pack('<HH', len(base), len(encoding)) + base + encoding + stamp)
+    if self.sourceRows != list(range(len(self.sourceRows))):
+     self._writeOrder(f, array.array('q', self.sourceRows))
+    for row, sourceRow in enumerate(self.sourceRows):
+     game = self._parsedGame(gameList, row)
+     if sourceRow < 0 or (game is not None and id(game) in self.changedGames):
+      self._writeGame(f, row, game)
+    self.compactedSize = f.tell()
+   os.replace(tmpFile, self.journalFile)
+  except BaseException:
+   os.remove(tmpFile)
+   raise
+
+ def _append(self, gameList : Union[list, IndexedGameList], writeFunction : Callable[[object], None]) -> None:
+  if not self.started:
+   return
+  with open(self.journalFile, mode = 'ab') as f:
+   writeFunction(f)
+   size = f.tell()
+  if size > max(self.compactSize, 2 * self.compactedSize):
+   self._rewrite(gameList)
+
+ def record(self, gameList : Union[list, IndexedGameList], changedRows : Iterable[int] = ()) -> None:
+  '''Appends the changed games of a game list to the journal
+
+Nothing is recorded, if the journal was not started.
+
+:param gameList: the game list
+:param changedRows: rows of games changed since the last call
+  '''
+  changedRows = sorted(set(row for row in changedRows if 0 <= row < len(self.sourceRows)))
+  if len(changedRows) == 0:
+   return
+  def writeGames(f):
+   for row in changedRows:
+    game = gameList[row]
+    self.changedGames[id(game)] = game
+    self._writeGame(f, row, game)
+  self._append(gameList, writeGames)
+
+ def recordAppend(self, gameList : Union[list, IndexedGameList], count : int = 1) -> None:
+  '''Appends the games appended to a game list to the journal
+
+:param gameList: the game list
+:param count: number of games appended since the last call
+  '''
+  if not self.started or count <= 0:
+   return
+  firstRow = len(self.sourceRows)
+  self.sourceRows.extend([-1] * count)
+  def writeGames(f):
+   for row in range(firstRow, firstRow + count):
+    game = gameList[row]
+    self.changedGames[id(game)] = game
+    self._writeGame(f, row, game)
+  self._append(gameList, writeGames)
+
+ def recordMove(self, gameList : Union[list, IndexedGameList], srcRowRange : range, tgtRow : int) -> None:
+  '''Appends a move of rows to the journal, see *GameListTableModel.moveRows*
+
+:param gameList: the game list
+:param srcRowRange: range of the moved rows
+:param tgtRow: row in front of which the rows were moved (counted before the move)
+  '''
+  if not self.started:
+   return
+  self._moveRows(self.sourceRows, srcRowRange, tgtRow)
+  payload = self.moveStruct.pack(srcRowRange.start, srcRowRange.stop, tgtRow)
+  self._append(gameList, lambda f: self._writeRecord(f, self.moveRecord, payload))
+
+ def recordRemove(self, gameList : Union[list, IndexedGameList], rows : Iterable[int]) -> None:
+  '''Appends the removal of rows to the journal
+
+:param gameList: the game list
+:param rows: the removed rows (counted before the removal)
+  '''
+  if not self.started:
+   return
+  rowArray = array.array('I', sorted(set(rows)))
+  if len(rowArray) == 0:
+   return
+  self._removeRows(self.sourceRows, rowArray)
+  if sys.byteorder != 'little':
+   rowArray.byteswap()
+  self._append(gameList, lambda f: self._writeRecord(f, self.removeRecord, rowArray.tobytes()))
+
+ def _openBase(self) -> Union[list, IndexedGameList]:
+  if self.baseFile is None:
+   return list()
+  if os.path.splitext(self.baseFile)[1] == '.pgn':
+   return IndexedGameList(PGNIndex.open(self.baseFile, encoding = self.encoding))
+  if GameStore.isStore(self.baseFile):
+   return IndexedGameList(GameStore(self.baseFile))
+  with open(self.baseFile, mode = 'rb') as f:
+   return pickle.load(f)
+
+ def replay(self) -> Union[list, IndexedGameList]:
+  '''Restores the game list by replaying the journal on its base and continues recording
+
+A record truncated by a crash is ignored.
+
+:returns: the game list
+  '''
+  with open(self.journalFile, mode = 'rb') as f:
+   data = memoryview(f.read())
+  if bytes(data[:len(self.magic)]) != self.magic or not 1 <= struct.unpack_from('<H', data, len(self.magic))[0] <= self.version:
+   raise ValueError('RecoveryJournal: {} is not a recovery journal'.format(self.journalFile))
+  pos = len(self.magic) + 2
+  gameList = None
+  while pos + self.recordStruct.size <= len(data):
+   recordType, length = self.recordStruct.unpack_from(data, pos)
+   pos += self.recordStruct.size
+   if pos + length > len(data):
+    break
+   payload = data[pos:pos + length]
+   pos += length
+   if recordType == self.baseRecord:
+    baseLength, encodingLength = struct.unpack_from('<HH', payload, 0)
+    base = str(payload[4:4 + baseLength], 'utf-8')
+    encoding = str(payload[4 + baseLength:4 + baseLength + encodingLength], 'utf-8')
+    size, mtime = self.stampStruct.unpack_from(payload, 4 + baseLength + encodingLength)
+    self.baseFile = base if base else None
+    self.encoding = encoding if encoding else None
+    if self.baseFile is not None:
+     stat = os.stat(self.baseFile)
+     if stat.st_size != size or stat.st_mtime != mtime:
+      raise ValueError('RecoveryJournal: {} changed since the journal was written'.format(self.baseFile))
+    gameList = self._openBase()
+    self.sourceRows = list(range(len(gameList)))
+    self.changedGames = dict()
+   elif gameList is None:
+    raise ValueError('RecoveryJournal: {} has no base'.format(self.journalFile))
+   elif recordType == self.orderRecord:
+    rowArray = array.array('q')
+    rowArray.frombytes(payload)
+    if sys.byteorder != 'little':
+     rowArray.byteswap()
+    entries = self._entries(gameList)
+    entries[:] = [entries[prevRow] if prevRow >= 0 else None for prevRow in rowArray]
+    self.sourceRows = [self.sourceRows[prevRow] if prevRow >= 0 else -1 for prevRow in rowArray]
+   elif recordType == self.gameRecord:
+    row, = self.rowStruct.unpack_from(payload, 0)
+    game = GameStore.decodeGame(payload[self.rowStruct.size:])
+    if row == len(gameList):
+     gameList.append(game)
+     self.sourceRows.append(-1)
+    else:
+     gameList[row] = game
+    self.changedGames[id(game)] = game
+   elif recordType == self.moveRecord:
+    start, stop, tgtRow = self.moveStruct.unpack_from(payload, 0)
+    self._moveRows(self._entries(gameList), range(start, stop), tgtRow)
+    self._moveRows(self.sourceRows, range(start, stop), tgtRow)
+   elif recordType == self.removeRecord:
+    rowArray = array.array('I')
+    rowArray.frombytes(payload)
+    if sys.byteorder != 'little':
+     rowArray.byteswap()
+    self._removeRows(self._entries(gameList), rowArray)
+    self._removeRows(self.sourceRows, rowArray)
+  if gameList is None:
+   raise ValueError('RecoveryJournal: {} has no base'.format(self.journalFile))
+  entries = self._entries(gameList)
+  for row in reversed(range(len(entries))):
+   if entries[row] is None:
+    del entries[row]
+    del self.sourceRows[row]
+  self.started = True
+  self._rewrite(gameList)
+  return gameList
@@ -4,17 +4,24 @@ The *database* editor is based on Qt's QTableView.
 
 |DatabaseEditor|
 
-It allows for 3 types of actions:
+It allows for 5 types of actions:
 
  * select a game by a double-click into the corresponding row
  * add/remove the displayed header items (limited to the 7-tag roster) by a right-clicking the column header
  * changing the sequence of games in the database by drag/drop or the menu items *Move Games>Up/Down*
+ * sorting the displayed games by a click on a column header (ascending, descending, order of the database)
+ * filtering the displayed games by the items *Filter ...* and *Clear Filters* of the column header menu
+   (the action *Find Games with this Position* filters the games by the position on the board)
+
+Sorting and filtering do not change the database, they are based on the header index of the games 
+(see *GameListProxyModel* and *HeaderIndex*). Games can be moved in the order of the database only.
 
 .. |DatabaseEditor| image:: gameListTableView.png
   :width: 800
   :alt: Game Editor
 '''
 import sys,  os.path
+import bisect
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import MzChess
 
@@ -26,12 +33,30 @@ else:
  from PyQt6.QtGui import QAction
 
 class GameListTableModel(QtCore.QAbstractTableModel):
+ '''Table model of a game list
+
+The game list is either a list of *chess.pgn.Game* objects or a lazy *IndexedGameList*. 
+In the latter case, only the headers of the displayed rows are read, 
+moving and removing rows rearranges the entries without parsing any game.
+Moved rows are reported by *rowsMoved*, removed rows by *rowsRemovedSignal*.
+ '''
+ rowsRemovedSignal = QtCore.pyqtSignal(list)
  
  def __init__(self, gameList, gameHeaderKeys, parent = None):
   super(GameListTableModel, self).__init__(parent)
   self.gameHeaderKeys = gameHeaderKeys
   self.gameList = gameList
 
+ def headers(self, row):
+  if isinstance(self.gameList, MzChess.IndexedGameList):
+   return self.gameList.headers(row)
+  return self.gameList[row].headers
+
+ def _entries(self):
+  if isinstance(self.gameList, MzChess.IndexedGameList):
+   return self.gameList.entries
+  return self.gameList
+
  def rowCount(self, parent = None):
   return len(self.gameList)
 
@@ -47,9 +72,9 @@ class GameListTableModel(QtCore.QAbstractTableModel):
  def data(self, index, role = QtCore.Qt.ItemDataRole.DisplayRole):
   if index.isValid():
    if role == QtCore.Qt.ItemDataRole.DisplayRole:
-    actGameHeaders = self.gameList[index.row()].headers
+    actGameHeaders = self.headers(index.row())
     columnKey = self.gameHeaderKeys[index.column()]
-    return actGameHeaders[columnKey]
+    return actGameHeaders.get(columnKey, '?')
    elif role == QtCore.Qt.ItemDataRole.TextAlignmentRole:
     return int(QtCore.Qt.AlignmentFlag.AlignCenter | QtCore.Qt.AlignmentFlag.AlignVCenter)
   return None
@@ -68,38 +93,260 @@ class GameListTableModel(QtCore.QAbstractTableModel):
   assert isinstance(srcRowRange, range)
   parent = QtCore.QModelIndex()
   self.beginMoveRows(parent, srcRowRange.start, srcRowRange.stop - 1, parent, tgtRow)
+  entries = self._entries()
   newGameList = list()
   if tgtRow < srcRowRange.start:
-   newGameList += self.gameList[:tgtRow]
-   newGameList += self.gameList[srcRowRange.start:srcRowRange.stop]
-   newGameList += self.gameList[tgtRow:srcRowRange.start]
-   newGameList += self.gameList[srcRowRange.stop:]
+   newGameList += entries[:tgtRow]
+   newGameList += entries[srcRowRange.start:srcRowRange.stop]
+   newGameList += entries[tgtRow:srcRowRange.start]
+   newGameList += entries[srcRowRange.stop:]
   else:
-   newGameList += self.gameList[:srcRowRange.start]
-   newGameList += self.gameList[srcRowRange.stop:tgtRow]
-   newGameList += self.gameList[srcRowRange.start:srcRowRange.stop]
-   newGameList += self.gameList[tgtRow:]
-  for n, game in enumerate(newGameList):
-   self.gameList[n] = newGameList[n]
+   newGameList += entries[:srcRowRange.start]
+   newGameList += entries[srcRowRange.stop:tgtRow]
+   newGameList += entries[srcRowRange.start:srcRowRange.stop]
+   newGameList += entries[tgtRow:]
+  entries[:] = newGameList
   self.endMoveRows()
   return True
 
  def removeRows(self, srcRowList):
   if len(srcRowList) == 0:
    return False
+  srcRowSet = set(srcRowList)
+  entries = self._entries()
   newGameList = list()
-  for row, game in enumerate(self.gameList):
-   if row not in srcRowList:
-    newGameList.append(game)
+  for row, entry in enumerate(entries):
+   if row not in srcRowSet:
+    newGameList.append(entry)
   self.beginResetModel()
-  for n, game in enumerate(newGameList):
-   self.gameList[n] = newGameList[n]
-  del self.gameList[len(newGameList):]
+  entries[:] = newGameList
   self.endResetModel()
+  self.rowsRemovedSignal.emit(sorted(srcRowSet))
   return True
-  
+
+ def appendEntries(self, newEntries):
+  '''Appends rows, e.g. the games indexed while a database is loaded
+
+:param newEntries: numbers of games in the index (*IndexedGameList*) or games
+  '''
+  if len(newEntries) == 0:
+   return
+  entries = self._entries()
+  self.beginInsertRows(QtCore.QModelIndex(), len(entries), len(entries) + len(newEntries) - 1)
+  entries.extend(newEntries)
+  self.endInsertRows()
+
+class GameListProxyModel(QtCore.QAbstractProxyModel):
+ '''Sorting and filtering layer of a *GameListTableModel*
+
+The layer works like Qt's QSortFilterProxyModel, but sorts and filters the rows by the 
+*HeaderIndex* of the game list instead of comparing pairs of rows, i.e. without reading any game. 
+The rows of the layer map to rows of the game list by *rowMap*, which is ``None`` for the order of the database. 
+Besides the tags, rows may be filtered by a set of rows of the game list (*rowFilter*, e.g. the result of a position search).
+Rows appended to a sorted list (e.g. while a database is loaded) are filtered, but kept at the end.
+ '''
+
+ def __init__(self, parent = None):
+  super(GameListProxyModel, self).__init__(parent)
+  self.rowMap = None
+  self.proxyRows = None
+  self.sortKey = None
+  self.sortOrder = QtCore.Qt.SortOrder.AscendingOrder
+  self.filterDict = dict()
+  self.rowFilter = None
+
+ def setSourceModel(self, sourceModel):
+  super(GameListProxyModel, self).setSourceModel(sourceModel)
+  sourceModel.modelAboutToBeReset.connect(self.beginResetModel)
+  sourceModel.modelReset.connect(self._sourceModelReset)
+  sourceModel.rowsAboutToBeMoved.connect(self._sourceRowsAboutToBeMoved)
+  sourceModel.rowsMoved.connect(self._sourceRowsMoved)
+  sourceModel.rowsAboutToBeInserted.connect(self._sourceRowsAboutToBeInserted)
+  sourceModel.rowsInserted.connect(self._sourceRowsInserted)
+  self.beginResetModel()
+  self._apply()
+  self.endResetModel()
+
+ @property
+ def gameList(self):
+  return self.sourceModel().gameList
+
+ def _headerSource(self, rows = None):
+  gameList = self.gameList
+  if isinstance(gameList, MzChess.IndexedGameList):
+   return gameList.headerIndex(), gameList.headerEntries(rows)
+  if rows is None:
+   rows = range(len(gameList))
+  return MzChess.HeaderIndex.fromHeaders(gameList[row].headers for row in rows), list(range(len(rows)))
+
+ def _filterRows(self, headerIndex, entries, rows = None):
+  for key, text in self.filterDict.items():
+   foldedText = text.casefold()
+   rows = headerIndex.filterRows(key, lambda value: foldedText in value.casefold(), entries, rows)
+  return rows
+
+ def _apply(self):
+  self.proxyRows = None
+  rows = sorted(self.rowFilter) if self.rowFilter is not None else None
+  if self.sortKey is None and len(self.filterDict) == 0:
+   self.rowMap = rows
+   return
+  headerIndex, entries = self._headerSource()
+  rows = self._filterRows(headerIndex, entries, rows)
+  if self.sortKey is None:
+   self.rowMap = rows
+   return
+  reverse = self.sortOrder == QtCore.Qt.SortOrder.DescendingOrder
+  if rows is None:
+   self.rowMap = headerIndex.sortRows(self.sortKey, entries, reverse = reverse)
+  else:
+   sortedRows = headerIndex.sortRows(self.sortKey, [entries[row] for row in rows], reverse = reverse)
+   self.rowMap = [rows[n] for n in sortedRows]
+
+ def invalidate(self):
+  '''Sorts and filters the rows again'''
+  self.beginResetModel()
+  self._apply()
+  self.endResetModel()
+
+ def setSortFilter(self, sortKey, sortOrder = QtCore.Qt.SortOrder.AscendingOrder, filterDict = None):
+  '''Sets the sort key and the filters
+
+:param sortKey: tag to sort by (see *HeaderIndex.keys*), ``None`` for the order of the database
+:param sortOrder: order of sorting
+:param filterDict: tags and the texts their values must contain (case-insensitive)
+  '''
+  self.sortKey = sortKey
+  self.sortOrder = sortOrder
+  self.filterDict = dict(filterDict) if filterDict is not None else dict()
+  self.invalidate()
+
+ def sort(self, column, order = QtCore.Qt.SortOrder.AscendingOrder):
+  self.setSortFilter(self.sourceModel().gameHeaderKeys[column], order, self.filterDict)
+
+ def setFilter(self, key, text):
+  '''Sets the text the value of a tag must contain, an empty text removes the filter'''
+  filterDict = dict(self.filterDict)
+  if len(text) > 0:
+   filterDict[key] = text
+  else:
+   filterDict.pop(key, None)
+  self.setSortFilter(self.sortKey, self.sortOrder, filterDict)
+
+ def setRowFilter(self, rows):
+  '''Shows only the given rows of the game list, ``None`` shows all rows'''
+  self.rowFilter = set(rows) if rows is not None else None
+  self.invalidate()
+
+ def clearFilters(self):
+  '''Removes the filters of tags and rows'''
+  self.filterDict = dict()
+  self.rowFilter = None
+  self.invalidate()
+
+ def sourceRow(self, row):
+  return row if self.rowMap is None else self.rowMap[row]
+
+ def mapToSource(self, proxyIndex):
+  if not proxyIndex.isValid():
+   return QtCore.QModelIndex()
+  return self.sourceModel().index(self.sourceRow(proxyIndex.row()), proxyIndex.column())
+
+ def mapFromSource(self, sourceIndex):
+  if not sourceIndex.isValid():
+   return QtCore.QModelIndex()
+  row = sourceIndex.row()
+  if self.rowMap is not None:
+   if self.proxyRows is None:
+    self.proxyRows = {sourceRow : proxyRow for proxyRow, sourceRow in enumerate(self.rowMap)}
+   row = self.proxyRows.get(row, -1)
+   if row < 0:
+    return QtCore.QModelIndex()
+  return self.index(row, sourceIndex.column())
+
+ def index(self, row, column, parent = QtCore.QModelIndex()):
+  if parent.isValid() or not self.hasIndex(row, column, parent):
+   return QtCore.QModelIndex()
+  return self.createIndex(row, column)
+
+ def parent(self, index = None):
+  return QtCore.QModelIndex()
+
+ def rowCount(self, parent = QtCore.QModelIndex()):
+  if parent is not None and parent.isValid():
+   return 0
+  if self.rowMap is None:
+   return self.sourceModel().rowCount()
+  return len(self.rowMap)
+
+ def columnCount(self, parent = QtCore.QModelIndex()):
+  return self.sourceModel().columnCount()
+
+ def supportedDropActions(self):
+  return self.sourceModel().supportedDropActions()
+
+ def headerData(self, col, orientation, role = QtCore.Qt.ItemDataRole.DisplayRole):
+  if orientation == QtCore.Qt.Orientation.Vertical:
+   col = self.sourceRow(col)
+  return self.sourceModel().headerData(col, orientation, role)
+
+ def headers(self, row):
+  return self.sourceModel().headers(self.sourceRow(row))
+
+ def moveRows(self, srcRowRange, tgtRow):
+  if self.rowMap is not None:
+   return False
+  return self.sourceModel().moveRows(srcRowRange, tgtRow)
+
+ def removeRows(self, srcRowList):
+  removedRows = sorted(self.sourceRow(row) for row in srcRowList)
+  if self.rowFilter is not None:
+   removedRowSet = set(removedRows)
+   self.rowFilter = {row - bisect.bisect_left(removedRows, row) for row in self.rowFilter if row not in removedRowSet}
+  return self.sourceModel().removeRows(removedRows)
+
+ def appendEntries(self, newEntries):
+  self.sourceModel().appendEntries(newEntries)
+
+ def _sourceModelReset(self):
+  self._apply()
+  self.endResetModel()
+
+ def _sourceRowsAboutToBeMoved(self, sourceParent, start, end, destinationParent, row):
+  if self.rowMap is None:
+   self.beginMoveRows(QtCore.QModelIndex(), start, end, QtCore.QModelIndex(), row)
+  else:
+   self.beginResetModel()
+
+ def _sourceRowsMoved(self, sourceParent, start, end, destinationParent, row):
+  if self.rowMap is None:
+   self.endMoveRows()
+  else:
+   self._apply()
+   self.endResetModel()
+
+ def _sourceRowsAboutToBeInserted(self, parent, first, last):
+  if self.rowMap is None:
+   self.beginInsertRows(QtCore.QModelIndex(), first, last)
+
+ def _sourceRowsInserted(self, parent, first, last):
+  if self.rowMap is None:
+   self.endInsertRows()
+   return
+  newRows = [row for row in range(first, last + 1) if self.rowFilter is None or row in self.rowFilter]
+  headerIndex, entries = self._headerSource(newRows)
+  acceptedRows = self._filterRows(headerIndex, entries)
+  if acceptedRows is not None:
+   newRows = [newRows[n] for n in acceptedRows]
+  if len(newRows) > 0:
+   self.beginInsertRows(QtCore.QModelIndex(), len(self.rowMap), len(self.rowMap) + len(newRows) - 1)
+   self.rowMap.extend(newRows)
+   self.proxyRows = None
+   self.endInsertRows()
+
 class GameListTableView(QtWidgets.QTableView):
  sevenTagRoster = ["Event", "Site", "Round", "Date", "White", "Black", "Result"]
+ sizeHintRows = 200
 
  def __init__(self, parent = None):
   super(GameListTableView, self).__init__(parent)
@@ -109,6 +356,8 @@ class GameListTableView(QtWidgets.QTableView):
   self.notifyDoubleClickSignal = None
   self.notifyHeaderChangedSignal = None
   self.notifyListChangedSignal = None
+  self.notifyRowsMovedSignal = None
+  self.notifyRowsRemovedSignal = None
   self.setSelectionBehavior(QtWidgets.QTableView.SelectionBehavior.SelectRows)
   self.sizeHints = None
   self.gameHeaderKeys = ["Date", "White", "Black", "Result"]
@@ -121,6 +370,10 @@ class GameListTableView(QtWidgets.QTableView):
    self.context.addAction('Show {}'.format(tag))
   self.context.addSeparator()
   self.context.addAction('Hide')
+  self.context.addSeparator()
+  self.context.addAction('Filter ...')
+  self.context.addAction('Clear Filters')
+  headerWidget.sectionClicked.connect(self.on_horizontalHeader_clicked)
   
   self.setAcceptDrops(True)
   self.setDragEnabled(True)
@@ -129,6 +382,13 @@ class GameListTableView(QtWidgets.QTableView):
  @QtCore.pyqtSlot(QAction)
  def on_menuContext_triggered(self, action):
   actionText = action.text()
+  if actionText == 'Filter ...':
+   self._editFilter()
+   return
+  if actionText == 'Clear Filters':
+   if self.model() is not None:
+    self.model().clearFilters()
+   return
   newGameHeaderKeys = self.gameHeaderKeys.copy()
   if actionText == 'Hide':
    if len(newGameHeaderKeys) <= 1:
@@ -141,12 +401,47 @@ class GameListTableView(QtWidgets.QTableView):
   self.gameHeaderKeys = newGameHeaderKeys
   if self.notifyHeaderChangedSignal is not None:
    self.notifyHeaderChangedSignal.emit(newGameHeaderKeys)
+
+ def _editFilter(self):
+  model = self.model()
+  if model is None or self.contextColumn < 0:
+   return
+  key = self.gameHeaderKeys[self.contextColumn]
+  text, ok = QtWidgets.QInputDialog.getText(self, 'Filter', 'Show games, whose {} contains:'.format(key), text = model.filterDict.get(key, ''))
+  if ok:
+   model.setFilter(key, text.strip())
+
+ @QtCore.pyqtSlot(int)
+ def on_horizontalHeader_clicked(self, column):
+  model = self.model()
+  if model is None:
+   return
+  key = self.gameHeaderKeys[column]
+  if model.sortKey != key:
+   model.setSortFilter(key, QtCore.Qt.SortOrder.AscendingOrder, model.filterDict)
+  elif model.sortOrder == QtCore.Qt.SortOrder.AscendingOrder:
+   model.setSortFilter(key, QtCore.Qt.SortOrder.DescendingOrder, model.filterDict)
+  else:
+   model.setSortFilter(None, QtCore.Qt.SortOrder.AscendingOrder, model.filterDict)
+  self._showSortIndicator()
+
+ def _showSortIndicator(self):
+  model = self.model()
+  headerWidget = self.horizontalHeader()
+  if model is None or model.sortKey not in self.gameHeaderKeys:
+   headerWidget.setSortIndicatorShown(False)
+   return
+  headerWidget.setSortIndicator(self.gameHeaderKeys.index(model.sortKey), model.sortOrder)
+  headerWidget.setSortIndicatorShown(True)
    
  def _selection2rowRange(self):
   selection = self.selectionModel().selectedRows()   
   if len(selection) == 0:
    self.notifyError('No game selected.')
    return None
+  if self.model().rowMap is not None:
+   self.notifyError('Games can be moved in the order of the database only, i.e. neither sorted nor filtered.')
+   return None
   srcRowList = list()
   for rowSelection in selection:
    srcRowList.append(rowSelection.row())
@@ -234,31 +529,59 @@ class GameListTableView(QtWidgets.QTableView):
   self._gameHeaderKeys = newGameHeaderKeys
   model = self.model()
   if model is not None:
-   model.beginResetModel()
-   model.gameHeaderKeys = self._gameHeaderKeys 
-   model.endResetModel()
+   sourceModel = model.sourceModel()
+   sourceModel.beginResetModel()
+   sourceModel.gameHeaderKeys = self._gameHeaderKeys 
+   sourceModel.endResetModel()
+  self._showSortIndicator()
   self.contextColumn = -1
   return 
 
  def setGameList(self, gameList):
   model = GameListTableModel(gameList, self.gameHeaderKeys)
-  self.setModel(model)
+  model.rowsMoved.connect(self._rowsMoved)
+  model.rowsRemovedSignal.connect(self._rowsRemoved)
+  proxyModel = GameListProxyModel()
+  oldModel = self.model()
+  if oldModel is not None and oldModel.gameList is gameList:
+   proxyModel.sortKey, proxyModel.sortOrder, proxyModel.filterDict = oldModel.sortKey, oldModel.sortOrder, oldModel.filterDict
+   proxyModel.rowFilter = oldModel.rowFilter
+  proxyModel.setSourceModel(model)
+  self.setModel(proxyModel)
+  self._showSortIndicator()
   self.sizeHints = 4*[0]
   totSize = 0
   for column, key in enumerate(model.gameHeaderKeys):
    self.sizeHints[column] = self.fontMetrics().size(QtCore.Qt.TextFlag.TextSingleLine, key).width()
    totSize += self.columnWidth(column)
-   for n, game in enumerate(gameList):
-    if key not in game.headers:
+   for n in range(min(len(gameList), self.sizeHintRows)):
+    headers = model.headers(n)
+    if key not in headers:
      raise ValueError('GameListTableModel: key {} not in game #{}'.format(key,n))
-    actSize = self.fontMetrics().size(QtCore.Qt.TextFlag.TextSingleLine, game.headers[key]).width()
+    actSize = self.fontMetrics().size(QtCore.Qt.TextFlag.TextSingleLine, headers[key]).width()
     self.sizeHints[column] = max(self.sizeHints[column], actSize)
   self.setColumnWidths()
   
- def setup(self, notifyDoubleClickSignal = None, notifyHeaderChangedSignal = None, notifyListChangedSignal = None):
+ def setRowFilter(self, rows):
+  '''Shows only the given rows of the game list (see *GameListProxyModel.setRowFilter*)'''
+  if self.model() is not None:
+   self.model().setRowFilter(rows)
+
+ def _rowsMoved(self, sourceParent, start, end, destinationParent, row):
+  if self.notifyRowsMovedSignal is not None:
+   self.notifyRowsMovedSignal.emit(start, end + 1, row)
+
+ def _rowsRemoved(self, rows):
+  if self.notifyRowsRemovedSignal is not None:
+   self.notifyRowsRemovedSignal.emit(rows)
+
+ def setup(self, notifyDoubleClickSignal = None, notifyHeaderChangedSignal = None, notifyListChangedSignal = None, 
+                notifyRowsMovedSignal = None, notifyRowsRemovedSignal = None):
   self.notifyDoubleClickSignal = notifyDoubleClickSignal
   self.notifyHeaderChangedSignal = notifyHeaderChangedSignal
   self.notifyListChangedSignal  = notifyListChangedSignal 
+  self.notifyRowsMovedSignal = notifyRowsMovedSignal
+  self.notifyRowsRemovedSignal = notifyRowsRemovedSignal
   
  def resetDB(self):
   self.reset()
@@ -277,10 +600,11 @@ class GameListTableView(QtWidgets.QTableView):
   
  @QtCore.pyqtSlot(QtCore.QModelIndex)
  def on_doubleClicked(self, index):
+  row = self.model().sourceRow(index.row())
   if self.notifyDoubleClickSignal is not None:
-   self.notifyDoubleClickSignal.emit(index.row())
+   self.notifyDoubleClickSignal.emit(row)
   else:
-   print('game #{} selected'.format(index.row()))
+   print('game #{} selected'.format(row))
 
 if __name__ == "__main__":
  from pgnParse import read_game
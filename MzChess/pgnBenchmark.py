@@ -0,0 +1,325 @@
+'''Benchmark suite of the PGN parser *pgnParse* against *chess.pgn*
+
+The suite runs without Qt, i.e. the module is started as a script, e.g.
+
+::
+
+   python <MzChess directory>/pgnBenchmark.py --output results.json --baseline baseline.json
+
+Every combination of corpus, parser (*pgnParse* with the *ply* or the *regex* backend, *chess.pgn*) and
+target (the visitors *game*, *headers*, *board*, *skip*, the header scan *scan* and the indexing *index*)
+is timed. The corpora are the PGN-files of the *training* directories and generated files with long mainlines,
+deeply nested variations and huge comments (see *syntheticCorpora*). For every case, the number of games and errors,
+games/sec, MB/sec and the peak resident set size of the process running the case are reported.
+The results are stored as JSON and compared with a baseline, regressions are reported by the exit code 1.
+'''
+
+from typing import Optional, Iterable, List, Tuple
+import os, os.path, sys
+import glob
+import json
+import time
+import random
+import platform
+import datetime
+import tempfile
+import concurrent.futures
+import multiprocessing
+try:
+ import resource
+except ImportError:
+ resource = None
+
+import chess, chess.pgn
+if __package__:
+ from . import pgnParse
+else:
+ import pgnParse
+
+visitorDict = {'game' : chess.pgn.GameBuilder, 'headers' : chess.pgn.HeadersBuilder,
+                     'board' : chess.pgn.BoardBuilder, 'skip' : chess.pgn.SkipVisitor}
+targetList = list(visitorDict) + ['scan', 'index']
+parserList = ['pgnParse', 'regex', 'chess.pgn']
+
+class Corpus(object):
+ '''A named set of PGN-files
+
+:param name: name of the corpus, e.g. *training/matein*
+:param pgnFiles: paths of the PGN-files
+:param encoding: encoding of the PGN-files
+ '''
+ def __init__(self, name : str, pgnFiles : List[str], encoding : str = 'utf-8-sig') -> None:
+  self.name = name
+  self.pgnFiles = pgnFiles
+  self.encoding = encoding
+
+ def size(self) -> int:
+  '''Returns the total size of the PGN-files in bytes'''
+  return sum(os.path.getsize(pgnFile) for pgnFile in self.pgnFiles)
+
+def trainingCorpora() -> List[Corpus]:
+ '''Returns a corpus for every directory of the *training* PGN-files'''
+ trainingDirectory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'training')
+ corpusList = list()
+ for directory in sorted(glob.glob(os.path.join(trainingDirectory, '*'))):
+  pgnFiles = sorted(glob.glob(os.path.join(directory, '*.pgn')))
+  if len(pgnFiles) > 0:
+   corpusList.append(Corpus('training/' + os.path.basename(directory), pgnFiles))
+ return corpusList
+
+_words = ('the', 'knight', 'bishop', 'rook', 'queen', 'king', 'pawn', 'attack', 'defends', 'against',
+                'white', 'black', 'center', 'file', 'diagonal', 'endgame', 'sacrifice', 'initiative', 'weak', 'square')
+
+def _comment(rng : random.Random, size : int) -> str:
+ words = list()
+ length = 0
+ while length < size:
+  word = rng.choice(_words)
+  words.append(word)
+  length += len(word) + 1
+ return ' '.join(words)
+
+def _randomLine(node : chess.pgn.GameNode, board : chess.Board, rng : random.Random, plies : int,
+                         variationDepth : int, variationProbability : float, commentSize : int, commentProbability : float) -> None:
+ for _ in range(plies):
+  moves = list(board.legal_moves)
+  if len(moves) == 0:
+   return
+  move = rng.choice(moves)
+  child = node.add_variation(move)
+  if commentSize > 0 and rng.random() < commentProbability:
+   child.comment = _comment(rng, commentSize)
+  if variationDepth > 0 and len(moves) > 1 and rng.random() < variationProbability:
+   alternative = rng.choice([actMove for actMove in moves if actMove != move])
+   alternativeBoard = board.copy(stack = False)
+   alternativeBoard.push(alternative)
+   _randomLine(node.add_variation(alternative), alternativeBoard, rng, max(plies//2, 2),
+                        variationDepth - 1, variationProbability, commentSize, commentProbability)
+  board.push(move)
+  node = child
+
+def syntheticGame(rng : random.Random, gameID : int, plies : int = 80, variationDepth : int = 0, variationProbability : float = 0.2,
+                               commentSize : int = 0, commentProbability : float = 0.2) -> chess.pgn.Game:
+ '''Returns a game of random legal moves
+
+:param rng: the random generator
+:param gameID: number of the game, used in the headers
+:param plies: number of plies of the mainline (less, if the game ends earlier)
+:param variationDepth: maximum nesting depth of variations
+:param variationProbability: probability of a variation per move
+:param commentSize: length of comments in characters, 0 for no comments
+:param commentProbability: probability of a comment per move
+:returns: the game
+ '''
+ game = chess.pgn.Game()
+ game.headers['Event'] = 'Synthetic'
+ game.headers['Round'] = str(gameID + 1)
+ game.headers['White'] = 'Player {}'.format(rng.randrange(100))
+ game.headers['Black'] = 'Player {}'.format(rng.randrange(100))
+ game.headers['WhiteElo'] = str(rng.randrange(1200, 2800))
+ game.headers['BlackElo'] = str(rng.randrange(1200, 2800))
+ _randomLine(game, chess.Board(), rng, plies, variationDepth, variationProbability, commentSize, commentProbability)
+ outcome = game.end().board().outcome()
+ game.headers['Result'] = outcome.result() if outcome is not None else rng.choice(['1-0', '0-1', '1/2-1/2'])
+ return game
+
+def syntheticCorpora(workDirectory : str, games : int = 500, seed : int = 1) -> List[Corpus]:
+ '''Returns generated corpora, the PGN-files are written to *workDirectory*, if missing
+
+ * *synthetic/mainlines*: *games* games with mainlines of 80 plies
+ * *synthetic/variations*: *games*/5 games with variations nested up to depth 4
+ * *synthetic/comments*: *games*/5 games with comments of 10000 characters
+
+:param workDirectory: directory of the PGN-files
+:param games: number of games of the mainline corpus
+:param seed: seed of the random generator
+:returns: the corpora
+ '''
+ configurationList = [('mainlines', games, dict(plies = 80)),
+                               ('variations', max(games//5, 1), dict(plies = 60, variationDepth = 4, variationProbability = 0.3)),
+                               ('comments', max(games//5, 1), dict(plies = 40, commentSize = 10000))]
+ os.makedirs(workDirectory, exist_ok = True)
+ corpusList = list()
+ for name, count, kwargs in configurationList:
+  pgnFile = os.path.join(workDirectory, 'synthetic_{}_{}_{}.pgn'.format(name, count, seed))
+  if not os.path.exists(pgnFile):
+   rng = random.Random('{}/{}'.format(name, seed))
+   with open(pgnFile + '.tmp', mode = 'w', encoding = 'utf-8') as f:
+    for gameID in range(count):
+     print(syntheticGame(rng, gameID, **kwargs), file = f, end = '\n\n')
+   os.replace(pgnFile + '.tmp', pgnFile)
+  corpusList.append(Corpus('synthetic/' + name, [pgnFile]))
+ return corpusList
+
+def countGames(pgnFile : str, encoding : str, parser : str, target : str) -> Tuple[int, int]:
+ '''Reads all games of a PGN-file, reading stops at the first error raised by the parser
+
+:param pgnFile: path of the PGN-file
+:param encoding: encoding of the PGN-file
+:param parser: one of *parserList*
+:param target: one of *targetList*, *index* is supported by *pgnParse* only
+:returns: the number of games and errors
+ '''
+ if target == 'index':
+  if parser != 'pgnParse':
+   raise ValueError('countGames: target index not supported by {}'.format(parser))
+  index = pgnParse.PGNIndex.open(pgnFile, encoding = encoding, useSidecar = False)
+  return len(index), len(index.errorList)
+ with open(pgnFile, mode = 'r', encoding = encoding) as f:
+  if parser == 'chess.pgn':
+   if target == 'scan':
+    read = lambda: chess.pgn.read_headers(f)
+   else:
+    read = lambda: chess.pgn.read_game(f, Visitor = visitorDict[target])
+  else:
+   reader = pgnParse.PGNReader(f, backend = 'regex' if parser == 'regex' else 'ply')
+   if target == 'scan':
+    read = reader.read_headers
+   else:
+    read = lambda: reader.read_game(Visitor = visitorDict[target])
+  count, errors = 0, 0
+  while True:
+   try:
+    if read() is None:
+     break
+   except Exception:
+    errors += 1
+    break
+   count += 1
+ return count, errors
+
+def peakRSS() -> Optional[float]:
+ '''Returns the peak resident set size of the process in MB or ``None``, if unknown (e.g. under Windows)'''
+ if resource is None:
+  return None
+ maxRSS = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+ return maxRSS/2**20 if platform.system() == 'Darwin' else maxRSS/2**10
+
+def runCase(corpus : Corpus, parser : str, target : str, repeat : int = 3) -> dict:
+ '''Times reading a corpus, the best of *repeat* runs is reported
+
+:param corpus: the corpus
+:param parser: one of *parserList*
+:param target: one of *targetList*
+:param repeat: number of runs
+:returns: dictionary of games, errors, seconds, gamesPerSecond, mbPerSecond and peakRSS (MB)
+ '''
+ seconds = None
+ for _ in range(repeat):
+  start = time.perf_counter()
+  games, errors = 0, 0
+  for pgnFile in corpus.pgnFiles:
+   fileGames, fileErrors = countGames(pgnFile, corpus.encoding, parser, target)
+   games += fileGames
+   errors += fileErrors
+  elapsed = max(time.perf_counter() - start, 1e-9)
+  seconds = elapsed if seconds is None else min(seconds, elapsed)
+ return {'games' : games, 'errors' : errors, 'seconds' : seconds, 'gamesPerSecond' : games/seconds,
+             'mbPerSecond' : corpus.size()/2**20/seconds, 'peakRSS' : peakRSS()}
+
+def caseKey(corpus : Corpus, parser : str, target : str) -> str:
+ '''Returns the key of a case in the results'''
+ return '{}|{}|{}'.format(corpus.name, parser, target)
+
+def runBenchmark(corpusList : Iterable[Corpus], parsers : Iterable[str] = parserList, targets : Iterable[str] = targetList,
+                              repeat : int = 3, isolate : bool = True, notify = None) -> dict:
+ '''Runs all cases of the corpora
+
+If *isolate* is True, every case runs in a new process (started by *spawn*), so the peak resident set size
+is not distorted by previous cases.
+
+:param corpusList: the corpora
+:param parsers: the parsers out of *parserList*
+:param targets: the targets out of *targetList*
+:param repeat: number of runs per case
+:param isolate: if True, run every case in a process of its own
+:param notify: if not ``None``, called with the key and the result of every case
+:returns: the results, i.e. a dictionary of versions and the results of the cases
+ '''
+ resultDict = dict()
+ for corpus in corpusList:
+  for parser in parsers:
+   for target in targets:
+    if target == 'index' and parser != 'pgnParse':
+     continue
+    if isolate:
+     with concurrent.futures.ProcessPoolExecutor(max_workers = 1, mp_context = multiprocessing.get_context('spawn')) as executor:
+      result = executor.submit(runCase, corpus, parser, target, repeat).result()
+    else:
+     result = runCase(corpus, parser, target, repeat)
+    key = caseKey(corpus, parser, target)
+    resultDict[key] = result
+    if notify is not None:
+     notify(key, result)
+ return {'version' : 1, 'date' : datetime.datetime.now().isoformat(timespec = 'seconds'),
+             'python' : platform.python_version(), 'chess' : chess.__version__, 'platform' : platform.platform(),
+             'results' : resultDict}
+
+def compareResults(results : dict, baseline : dict, tolerance : float = 0.2) -> List[Tuple[str, str, float, float]]:
+ '''Returns the regressions of results compared with a baseline
+
+A case regresses, if its games/sec drop below (1 - *tolerance*) or its peak resident set size exceeds (1 + *tolerance*)
+times the baseline or if it reports more errors. Cases missing in one of the results are ignored.
+
+:param results: the results (see *runBenchmark*)
+:param baseline: the results of the baseline
+:param tolerance: the relative tolerance
+:returns: a list of (case key, measure, baseline value, value) tuples
+ '''
+ regressionList = list()
+ for key, result in results['results'].items():
+  baseResult = baseline['results'].get(key)
+  if baseResult is None:
+   continue
+  if result['gamesPerSecond'] < (1 - tolerance)*baseResult['gamesPerSecond']:
+   regressionList.append((key, 'gamesPerSecond', baseResult['gamesPerSecond'], result['gamesPerSecond']))
+  if result['peakRSS'] is not None and baseResult['peakRSS'] is not None and result['peakRSS'] > (1 + tolerance)*baseResult['peakRSS']:
+   regressionList.append((key, 'peakRSS', baseResult['peakRSS'], result['peakRSS']))
+  if result['errors'] > baseResult['errors']:
+   regressionList.append((key, 'errors', baseResult['errors'], result['errors']))
+ return regressionList
+
+def _printResult(key : str, result : dict) -> None:
+ corpus, parser, target = key.split('|')
+ rss = '{:8.1f}'.format(result['peakRSS']) if result['peakRSS'] is not None else '     ---'
+ print('{:24} {:10} {:8} {:8d} {:6d} {:10.1f} {:8.2f} {}'.format(corpus, parser, target, result['games'], result['errors'], result['gamesPerSecond'], result['mbPerSecond'], rss))
+ sys.stdout.flush()
+
+# ==================================================================
+
+if __name__ == "__main__":
+ import argparse
+
+ parser = argparse.ArgumentParser(description = 'PGN Parser: benchmark against chess.pgn')
+ parser.add_argument("--output", metavar = 'output', default = None, help = "JSON-file to store the results")
+ parser.add_argument("--baseline", metavar = 'baseline', default = None, help = "JSON-file of the baseline results")
+ parser.add_argument("--tolerance", metavar = 'tolerance', type = float, default = 0.2, help = "relative tolerance of regressions")
+ parser.add_argument("--repeat", metavar = 'repeat', type = int, default = 3, help = "runs per case, the best is reported")
+ parser.add_argument("--games", metavar = 'games', type = int, default = 500, help = "number of games of the synthetic mainline corpus")
+ parser.add_argument("--corpus", metavar = 'corpus', action = 'append', default = None,
+   help = "corpora to run selected by prefix of their names, e.g. training or synthetic/comments (may be repeated)")
+ parser.add_argument("--parser", metavar = 'parser', action = 'append', default = None, choices = parserList, help = "parsers to run (may be repeated)")
+ parser.add_argument("--target", metavar = 'target', action = 'append', default = None, choices = targetList, help = "targets to run (may be repeated)")
+ parser.add_argument("--workDirectory", metavar = 'workDirectory', default = os.path.join(tempfile.gettempdir(), 'mzChessBenchmark'),
+   help = "directory of the synthetic corpora")
+ parser.add_argument("-noIsolation", action = 'store_true', default = False, help = "If True, run all cases in this process")
+
+ args = parser.parse_args()
+ corpusList = trainingCorpora() + syntheticCorpora(args.workDirectory, games = args.games)
+ if args.corpus is not None:
+  corpusList = [corpus for corpus in corpusList if any(corpus.name.startswith(prefix) for prefix in args.corpus)]
+ print('{:24} {:10} {:8} {:>8} {:>6} {:>10} {:>8} {:>8}'.format('corpus', 'parser', 'target', 'games', 'errors', 'games/sec', 'MB/sec', 'RSS/MB'))
+ results = runBenchmark(corpusList, parsers = args.parser or parserList, targets = args.target or targetList,
+                                     repeat = args.repeat, isolate = not args.noIsolation, notify = _printResult)
+ if args.output is not None:
+  with open(args.output, mode = 'w', encoding = 'utf-8') as f:
+   json.dump(results, f, indent = 1)
+ if args.baseline is not None:
+  with open(args.baseline, mode = 'r', encoding = 'utf-8') as f:
+   baseline = json.load(f)
+  regressionList = compareResults(results, baseline, tolerance = args.tolerance)
+  for key, measure, baseValue, value in regressionList:
+   print('Regression {}: {} {:.1f} -> {:.1f}'.format(key, measure, baseValue, value))
+  print('{} regressions compared with {}'.format(len(regressionList), args.baseline))
+  if len(regressionList) > 0:
+   sys.exit(1)
@@ -4,11 +4,25 @@
 .. _PGN: https://github.com/fsmosca/PGN-Standard
 '''
 
-from typing import Union, Optional, Type, Callable, List, TextIO
+from typing import Union, Optional, Type, Callable, List, TextIO, Tuple, Iterator
 import os, os.path
 import re
+import io
+import array
+import bisect
+import pickle
+import collections
+import concurrent.futures
+import weakref
+import shutil
+import mmap
+import codecs
+import platform
+import hashlib
+import tempfile
+import importlib.util
 
-import chess, chess.pgn
+import chess, chess.pgn, chess.polyglot
 import ply.lex
 
 def checkFEN(boardOrFen : Union[chess.Board, str], allowIncompleteBoard : bool = False) -> None:
@@ -65,9 +79,20 @@ class PGNLexer(object):
  '''A Lexer for Portable Game Notation (PGN) files (see `ply`_)
 tracking line number, gameID, position (in game) 
 
-:param bufsize: size of the token buffer (min: 4096). The buffer is refilled at bufsize/4 
+:param bufsize: size of the chunks read in streaming mode (min: 4096). The buffer is refilled at bufsize/4. 
+  If None, streams larger than *streamThreshold* bytes are read in chunks of *streamBufsize*, smaller ones at once. 
 :param debug: run the lexer in debug mode
-:param kwargs: other keyword arguments of ply.lex.lex 
+:param encoding: encoding of memory-mapped input (default: 'utf-8-sig')
+:param optimize: if True, the ply lexer is cloned from a lexer shared by all instances (see *plyLexer*)
+:param backend: 'ply' or 'regex', i.e. the hand-written *PGNTokenizer* delivering the same tokens
+:param kwargs: other keyword arguments of ply.lex.lex (disable *optimize*)
+
+Besides files opened in text mode, the lexer accepts *mmap.mmap* objects. Mapped input is always streamed, 
+the windows are decoded as latin-1, so that positions coincide with byte offsets, and only the emitted tag values 
+and comments are decoded using *encoding*. Game bodies are skipped by searching the mapped bytes directly.
+
+In streaming mode, the buffer holds a sliding window starting at the current game, 
+i.e. the memory footprint is bounded by *bufsize* and the size of the largest game.
  
 .. _ply: https://ply.readthedocs.io/en/latest/
  '''
@@ -78,14 +103,136 @@ tracking line number, gameID, position (in game)
  nagDict = { '?' : 2,  '??' : 4, '?!' : 6, '!' : 1,  '!!' : 3, '!?' : 5, 
                   '+=' :  14, '=+' : 15, '+/-' : 16, '+-' : 18, '+--' : 20,
                   '-/+' : 17, '-+' : 19, '--+' : 21,  '=' : 10, '~' : 13, 'N' : 146, 'D' : 220}
+ blankPattern = re.compile(r'\s*')
+ lextabName = 'pgnlextab'
+ _plyLexer = None
+ streamThreshold = 67108864
+ streamBufsize = 1048576
+ skipPattern = r'\{[^}]*\}|;[^\n]*|(?P<end>1\-0|0\-1|1/2\-1/2|\*)|(?P<tag>\[)|(?P<open>\{)'
+ skipBytesRegex = re.compile(skipPattern.encode('ascii'))
+ skipRegex = re.compile(skipPattern)
+ separatorPattern = r'(?:\s|;[^\n]*(?![^\n]))*'
+ tagPairPattern = r'\[{0}([A-Za-z0-9_]+){0}"((?:\\"|[^"])*)"{0}\]'.format(separatorPattern)
+ tagPairRegex = re.compile(tagPairPattern)
+ gamePattern = (r'{0}(?P<headers>(?:\[{0}[A-Za-z0-9_]+{0}"(?:\\"|[^"])*"{0}\]{0})*)'.format(separatorPattern)
+                        + r'(?:[^{;\[10*]+|\{[^}]*\}|;[^\n]*|1(?!\-0|/2\-1/2)|0(?!\-1))*'
+                        r'(?:(?P<end>1\-0|0\-1|1/2\-1/2|\*)|(?P<tag>\[)|(?P<open>\{)|(?P<eof>\Z))')
+ gameRegex = re.compile(gamePattern)
+ gameBytesRegex = re.compile(gamePattern.encode('ascii'))
  
- def __init__(self, bufsize : int = 2147483647, debug : bool = False, **kwargs) -> None:
-  assert bufsize >= 4096
+ def __init__(self, bufsize : Optional[int] = None, debug : bool = False, encoding : Optional[str] = None, optimize : bool = True, backend : str = 'ply', **kwargs) -> None:
+  assert bufsize is None or bufsize >= 4096
+  assert backend in ('ply', 'regex'), 'Unknown backend {}'.format(backend)
   self.bufsize = bufsize
-  self.lexer = ply.lex.lex(module = self, debug = debug, **kwargs)
+  self.encoding = 'utf-8-sig' if encoding is None else encoding
+  self.mapped = False
+  self.recode = None
+  if backend == 'regex':
+   self.lexer = PGNTokenizer(self)
+  elif optimize and not debug and len(kwargs) == 0:
+   self.lexer = self.plyLexer().clone(self)
+   self.lexer.begin('INITIAL')
+  else:
+   self.lexer = ply.lex.lex(module = self, debug = debug, **kwargs)
   self.gameID = 0
   self.data = None
+  self.dataOffset = 0
+  self.gameStart = 0
+  self.headerEnd = 0
+  self.gameLine = 1
+  self.scanError = None
   self.f = None
+  self.eof = True
+  self.chunkSize = None
+  self.keepPos = 0
+
+ @classmethod
+ def lextabDir(cls) -> str:
+  '''Returns the cache directory of the lexer tables
+  
+The directory is located in the settings directory of MzChess and named by the version of ply 
+and a digest of the lexer rules, i.e. tables of other versions are never reused.
+
+:returns: path of the directory
+  '''
+  if platform.system() == 'Windows':
+   settingsDir = os.path.join(os.path.expanduser('~'), 'AppData', 'Roaming', 'MzChess')
+  else:
+   settingsDir = os.path.join(os.path.expanduser('~'), '.config', 'MzChess')
+  ruleList = [repr(cls.states), repr(cls.tokens)]
+  for name in sorted(dir(cls)):
+   if name.startswith('t_'):
+    rule = getattr(cls, name)
+    ruleList.append('{} = {}'.format(name, rule.__doc__ if callable(rule) else rule))
+  digest = hashlib.sha1('\n'.join(ruleList).encode('utf-8')).hexdigest()[:12]
+  return os.path.join(settingsDir, 'lextab', 'ply{}-{}'.format(ply.__version__, digest))
+
+ @classmethod
+ def plyLexer(cls) -> ply.lex.Lexer:
+  '''Returns the ply lexer shared by all optimized instances
+  
+The lexer is created on first use. Its tables are read from *lextabDir*, if available, 
+otherwise they are generated and written to *lextabDir* for subsequent processes.
+
+:returns: the shared lexer (use *clone* to bind it to an instance)
+  '''
+  if cls._plyLexer is not None:
+   return cls._plyLexer
+  module = cls.__new__(cls)
+  lextabDir = cls.lextabDir()
+  lextabFile = os.path.join(lextabDir, cls.lextabName + '.py')
+  lexer = None
+  if os.path.isfile(lextabFile):
+   try:
+    spec = importlib.util.spec_from_file_location(cls.lextabName, lextabFile)
+    lextab = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(lextab)
+    lexer = ply.lex.lex(module = module, optimize = True, lextab = lextab)
+   except Exception:
+    lexer = None
+  if lexer is None:
+   lexer = ply.lex.lex(module = module)
+   try:
+    os.makedirs(lextabDir, exist_ok = True)
+    with tempfile.TemporaryDirectory(dir = lextabDir) as tmpDir:
+     lexer.writetab(cls.lextabName, tmpDir)
+     os.replace(os.path.join(tmpDir, cls.lextabName + '.py'), lextabFile)
+   except OSError:
+    pass
+  cls._plyLexer = lexer
+  return lexer
+
+ def _streamSize(self, f : TextIO) -> int:
+  try:
+   return os.fstat(f.fileno()).st_size - f.tell()
+  except (OSError, AttributeError, io.UnsupportedOperation):
+   return -1
+
+ def _reset(self, f : Union[TextIO, mmap.mmap]) -> None:
+  self.lexer.lineno = 1
+  self.lexer.begin('INITIAL')
+  self.gameID = 0
+  self.f = f
+  self.mapped = isinstance(f, mmap.mmap)
+  self.recode = None
+  if self.mapped and codecs.lookup(self.encoding).name not in ('latin-1', 'iso8859-1', 'ascii'):
+   self.recode = self.encoding
+  if self.bufsize is not None:
+   self.chunkSize = self.bufsize
+  elif self.mapped or self._streamSize(f) > self.streamThreshold:
+   self.chunkSize = self.streamBufsize
+  else:
+   self.chunkSize = None
+  self.data = self._read(self.chunkSize)
+  self.eof = self.chunkSize is None or len(self.data) == 0
+  self.dataOffset = 0
+  if self.mapped:
+   if self.data.startswith('\xef\xbb\xbf'):
+    self.data = self.data[3:]
+    self.dataOffset = 3
+  else:
+   self.data = self.data.lstrip("\ufeff")
+  self.lexer.input(self.data)
 
  def newGame(self, f : TextIO) -> ply.lex.LexToken:
   '''Prepared the lexer to deliver tokens for a game 
@@ -94,29 +241,246 @@ tracking line number, gameID, position (in game)
 :returns: the first token of the game
   '''
   if f.tell() == 0 or f is not self.f:
-   lexer.lineno = 1
-   lexer.gameID = 0
-   self.f = f
-   self.data = self.f.read(self.bufsize).lstrip("\ufeff")
+   self._reset(f)
   self.gameID += 1
-  self.lexer.input(self.data)
+  self._loadBuffer()
+  self.keepPos = self.lexer.lexpos
+  self.gameStart = self.dataOffset + self.blankPattern.match(self.data, self.lexer.lexpos).end()
   return self.token()
   
  def endGame(self) -> None:
   'Ends running through a new game'
-  self.data = self.data[self.lexer.lexpos:]
-  self.lexer.input(self.data)
+  self.keepPos = self.lexer.lexpos
   self._loadBuffer()
 
+ def tell(self) -> int:
+  '''Returns the position of the lexer in the stream
+  
+:returns: number of characters read since the start of the stream (BOM excluded), for mapped input the byte offset
+  '''
+  return self.dataOffset + self.lexer.lexpos
+
+ def rewindTag(self, tok : ply.lex.LexToken) -> None:
+  '''Moves the lexer back to the opening bracket of the tag pair belonging to *tok*
+  
+:param tok: a TAGNAME token
+  '''
+  self.lexer.lexpos = self.lexer.lexdata.rfind('[', 0, tok.lexpos)
+  self.lexer.begin('INITIAL')
+
+ def checkToken(self, tok : ply.lex.LexToken, expectedType : str) -> None:
+  '''Raises a SyntaxError, if *tok* is missing or not of the expected type'''
+  if tok is None:
+   raise SyntaxError('Parser: {} marker missing'.format(expectedType))
+  elif tok.type != expectedType:
+   raise SyntaxError('Parser: Unexpected token "{}" = {} ... (expected "{}") @ Line {}, Game {}, Pos {}'.format(
+                             tok.type, str(tok.value)[:10], expectedType, tok.lineno, self.gameID, tok.lexpos))
+
+ @classmethod
+ def tagPairs(cls, headerText : str) -> chess.pgn.Headers:
+  '''Returns the tag pairs of the tag pair section of a game
+  
+:param headerText: the tag pair section
+:returns: a *chess.pgn.Headers* object containing the tag pairs only (see *chess.pgn.HeadersBuilder*)
+  '''
+  headers = chess.pgn.Headers({})
+  for tagName, tagValue in cls.tagPairRegex.findall(headerText):
+   headers[tagName] = tagValue
+  return headers
+
+ def _scanBuffer(self, data : Union[str, bytes, mmap.mmap], pos : int) -> Optional[Tuple[int, int, int, str]]:
+  if isinstance(data, str):
+   match = self.gameRegex.match(data, pos)
+  else:
+   match = self.gameBytesRegex.match(data, pos)
+  start, headerEnd = match.span('headers')
+  kind = match.lastgroup
+  if kind == 'eof' and match.start('eof') == start:
+   return None
+  if kind == 'end':
+   return start, headerEnd, match.end(), kind
+  elif kind == 'open':
+   return start, headerEnd, len(data), kind
+  return start, headerEnd, match.start(kind), kind
+
+ def scanHeaders(self, f : Union[TextIO, mmap.mmap]) -> Optional[chess.pgn.Headers]:
+  '''Reads the tag pairs of the next game and skips its movetext without using the ply lexer
+
+The tag pair section and the movetext are matched by compiled regular expressions, 
+the result equals *read_game(f, Visitor = chess.pgn.HeadersBuilder)* for valid PGN-files.
+After the call, *gameStart* and *headerEnd* hold the positions of the game and the end of its tag pairs 
+and *gameLine* its first line (see *tell*). Errors, i.e. an improper tag pair or a movetext ended 
+by EOF or inside a comment, do not stop scanning, but are stored in *scanError*.
+
+:param f: file handle opened in text mode or a *mmap.mmap* object
+:returns: a *chess.pgn.Headers* object containing the tag pairs only or ``None`` at EOF
+  '''
+  if f.tell() == 0 or f is not self.f:
+   self._reset(f)
+  self.gameID += 1
+  self.scanError = None
+  self._loadBuffer()
+  self.keepPos = self.lexer.lexpos
+  if self.mapped:
+   pos = self.dataOffset + self.lexer.lexpos
+   result = self._scanBuffer(self.f, pos)
+   data, offset = self.f, 0
+  else:
+   while True:
+    pos = self.lexer.lexpos
+    result = self._scanBuffer(self.data, pos)
+    if self.eof or (result is not None and result[3] in ('end', 'tag') and result[2] < len(self.data)):
+     break
+    self._fillBuffer()
+   data, offset = self.data, self.dataOffset
+  if result is None:
+   return None
+  start, headerEnd, endPos, kind = result
+  if kind == 'tag' and endPos == start:
+   # improper tag pair: skip the line to guarantee progress
+   endPos = data.find('\n' if isinstance(data, str) else b'\n', start)
+   if endPos < 0:
+    endPos = len(data)
+   kind = 'improper'
+  self.gameStart = offset + start
+  self.headerEnd = offset + headerEnd
+  self.gameLine = self.lexer.lineno + data[pos:start].count('\n' if isinstance(data, str) else b'\n')
+  headerText = data[start:headerEnd]
+  if not isinstance(headerText, str):
+   headerText = headerText.decode(self.encoding, errors = 'replace')
+  headers = self.tagPairs(headerText)
+  self.lexer.lineno = self.gameLine + data[start:endPos].count('\n' if isinstance(data, str) else b'\n')
+  if self.mapped:
+   self._seekBuffer(endPos)
+  else:
+   self.lexer.lexpos = endPos
+  self.endGame()
+  if kind == 'eof':
+   self.scanError = "SkipBody: Parsing ended by EOF"
+  elif kind == 'open':
+   self.scanError = "SkipBody: Parsing ended inside a comment"
+  elif kind == 'improper':
+   self.scanError = 'Parser: Improper tag pair @ Line {}, Game {}'.format(self.gameLine, self.gameID)
+  return headers
+
+ def skipGameBody(self) -> None:
+  '''Skips the movetext of a game up to and including the game termination marker
+  
+:raises SyntaxError: if the movetext ends by EOF or inside a comment
+  '''
+  if self.mapped:
+   return self._skipMapped()
+  while True:
+   lexpos, lineno = self.lexer.lexpos, self.lexer.lineno
+   try:
+    if self._skipBuffer() or self.eof:
+     return None
+   except SyntaxError:
+    if self.eof:
+     raise
+   self.lexer.lexpos, self.lexer.lineno = lexpos, lineno
+   self.keepPos = min(self.keepPos, lexpos)
+   self._fillBuffer()
+
+ def _skipMapped(self) -> None:
+  start = self.dataOffset + self.lexer.lexpos
+  match = None
+  for match in self.skipBytesRegex.finditer(self.f, start):
+   if match.lastgroup is not None:
+    break
+  if match is None or match.lastgroup is None or match.lastgroup == 'open':
+   endPos = len(self.f)
+  elif match.lastgroup == 'tag':
+   endPos = match.start()
+  else:
+   endPos = match.end()
+  self.lexer.lineno += self.f[start:endPos].count(b'\n')
+  self._seekBuffer(endPos)
+  if match is None or match.lastgroup is None:
+   raise SyntaxError("SkipBody: Parsing ended by EOF")
+  elif match.lastgroup == 'open':
+   raise SyntaxError("SkipBody: Parsing ended inside a comment")
+  return None
+
+ def _seekBuffer(self, pos : int) -> None:
+  if pos - self.dataOffset <= self.lexer.lexlen:
+   self.lexer.lexpos = pos - self.dataOffset
+   return
+  self.f.seek(pos)
+  self.data = self._read(self.chunkSize)
+  self.eof = len(self.data) == 0
+  self.dataOffset = pos
+  self.keepPos = 0
+  self.lexer.input(self.data)
+
+ def _skipBuffer(self) -> bool:
+  data = self.lexer.lexdata
+  start = self.lexer.lexpos
+  if start >= len(data):
+   return False
+  match = None
+  for match in self.skipRegex.finditer(data, start):
+   if match.lastgroup is not None:
+    break
+  if match is None or match.lastgroup is None or match.lastgroup == 'open':
+   endPos = len(data)
+  elif match.lastgroup == 'tag':
+   endPos = match.start()
+  else:
+   endPos = match.end()
+  self.lexer.lineno += data.count('\n', start, endPos)
+  self.lexer.lexpos = endPos
+  if match is None or match.lastgroup is None:
+   raise SyntaxError("SkipBody: Parsing ended by EOF")
+  elif match.lastgroup == 'open':
+   raise SyntaxError("SkipBody: Parsing ended inside a comment")
+  return True
+
+ def _read(self, size : Optional[int]) -> str:
+  if self.mapped:
+   return self.f.read(size).decode('latin-1')
+  if size is None:
+   return self.f.read()
+  return self.f.read(size)
+
+ def _recode(self, value : str) -> str:
+  if self.recode is None:
+   return value
+  return value.encode('latin-1').decode(self.recode, errors = 'replace')
+
+ def _fillBuffer(self) -> bool:
+  if self.eof:
+   return False
+  chunk = self._read(self.chunkSize)
+  if len(chunk) == 0:
+   self.eof = True
+   return False
+  keep = min(self.keepPos, self.lexer.lexpos)
+  lexpos = self.lexer.lexpos - keep
+  self.data = self.data[keep:] + chunk
+  self.dataOffset += keep
+  self.keepPos -= keep
+  self.lexer.input(self.data)
+  self.lexer.lexpos = lexpos
+  return True
+
  def _loadBuffer(self):
-  if len(self.data) == self.bufsize and len(self.data) - self.lexer.lexpos < self.bufsize // 4:
-   self.data += self.f.read(self.bufsize)
-   self.data = self.data[self.lexer.lexpos:]
-   self.lexer.input(self.data)
+  if not self.eof and self.lexer.lexlen - self.lexer.lexpos < self.chunkSize // 4:
+   self._fillBuffer()
 
  def token(self) -> ply.lex.LexToken:
   self._loadBuffer()
-  return self.lexer.token()
+  tok = self.lexer.token()
+  while not self.eof and (tok is None or self.lexer.lexpos >= self.lexer.lexlen):
+   # the token may be truncated by the end of the buffer: refill and lex it again
+   lexpos = self.lexer.lexpos if tok is None else tok.lexpos
+   if tok is not None:
+    self.lexer.lineno = tok.lineno
+   self.keepPos = min(self.keepPos, lexpos)
+   self.lexer.lexpos = lexpos
+   self._fillBuffer()
+   tok = self.lexer.token()
+  return tok
   
  def dumps(self, tok : Optional[ply.lex.LexToken] = None, notify : Optional[Callable[[str], None]] = None) -> None:
   msgList = list()
@@ -149,8 +513,8 @@ tracking line number, gameID, position (in game)
  # ---------------------------------------------------------------------------------- 
  
  # Completely ignored characters
- t_ignore = ' \t\x0c'
- t_tag_ignore = ' \t\x0c'
+ t_ignore = ' \t\r\x0c'
+ t_tag_ignore = ' \t\r\x0c'
  t_comment_ignore = '\x0c'
  t_ENDOFGAME = r'(1\-0|0\-1|1/2\-1/2|\*)'
 
@@ -169,7 +533,7 @@ tracking line number, gameID, position (in game)
 
  def t_tag_TAGVALUE(self, t): 
   r'\"(\\\"|[^"])*\"'
-  t.value = t.value[1:-1]
+  t.value = self._recode(t.value[1:-1])
   return t
 
  def t_SANPLY(self, t):
@@ -210,6 +574,7 @@ tracking line number, gameID, position (in game)
  def t_comment_COMMENT(self, t):
   r'[^{}]+'
   t.lexer.lineno += t.value.count("\n")
+  t.value = self._recode(t.value)
   return t
 
  def t_LBRACE(self, t):
@@ -259,137 +624,395 @@ tracking line number, gameID, position (in game)
  def t_comment_error(self, t):
   self._raise_error("Illegal comment character", t)
 
+class PGNTokenizer(object):
+ '''A hand-written replacement of the ply lexer of *PGNLexer* (see *backend*)
+
+The tokens equal those of the ply rules of *PGNLexer* in type, value, line number and position.
+Every lexer state is described by a single combined regular expression, which is iterated by *re.finditer*,
+i.e. there is no function call per token. Only the attributes and methods of ply.lex.Lexer used by
+*PGNLexer* are provided.
+
+:param module: the *PGNLexer* using the tokenizer (delivers *nagDict*, *_recode* and *_raise_error*)
+ '''
+ sanPattern = (r'(?P<SANPLY>(?P<sanFrom>[NBKRQ]?[a-h]?[1-8]?)[\:x]?(?P<sanTo>[a-h][1-8](?:=[QRBN])?)[+#]?'
+                      r'|O-O(?:-O)?|0-0(?:-0)?|0{4}|--(?![+\-]))|(?P<NULLMOVE>@{4}|Z0)')
+ nagPattern = (r'(?P<NAG>(?P<nagNumber>\$[1-9][0-9]{0,2}(?![0-9]))|(?:--\+|\+--|-/\+|\+/-|-\+|\+-|\+=|=\+)(?![=+\-])'
+                      r'|(?:\?[?!]|![?!])(?![?!])|[?!=~DN](?![?!=~DN]))')
+ regexDict = {
+  'INITIAL' : re.compile(r'(?P<ignore>[ \t\r\x0c]+)|(?P<NEWLINE>\n+)|' + sanPattern + r'|(?P<LBRACK>\[)'
+                         r'|(?P<MOVENUMBER>(?:[1-9][0-9]*\.*|\.+)(?!-)(?!/))|' + nagPattern +
+                         r'|(?P<LBRACE>\{)|(?P<LINECOMMENT>;[^\n]*)|(?P<RBRACK>\])|(?P<RBRACE>\})'
+                         r'|(?P<ENDOFGAME>1\-0|0\-1|1/2\-1/2|\*)|(?P<LPAREN>\()|(?P<RPAREN>\))|(?P<error>.)', re.DOTALL),
+  'tag' : re.compile(r'(?P<ignore>[ \t\r\x0c]+)|(?P<NEWLINE>\n+)|(?P<TAGVALUE>"(?P<tagValue>(?:\\"|[^"])*)")|(?P<RBRACK>\])'
+                     r'|(?P<LINECOMMENT>;[^\n]*)|(?P<TAGNAME>[A-Z][A-Za-z0-9]*)|(?P<error>.)', re.DOTALL),
+  'comment' : re.compile(r'(?P<ignore>\x0c+)|(?P<COMMENT>[^{}]+)|(?P<RBRACE>\})|(?P<error>.)', re.DOTALL)
+ }
+ errorDict = { 'INITIAL' : 'Illegal character', 'tag' : 'Illegal tag character', 'comment' : 'Illegal comment character' }
+
+ def __init__(self, module : PGNLexer) -> None:
+  self.module = module
+  self.lexdata = ''
+  self.lexpos = 0
+  self.lexlen = 0
+  self.lineno = 1
+  self.state = 'INITIAL'
+  self.matchIterator = None
+  self.nextPos = 0
+
+ def input(self, data : str) -> None:
+  'Sets the data to be tokenized'
+  self.lexdata = data
+  self.lexpos = 0
+  self.lexlen = len(data)
+  self.matchIterator = None
+
+ def begin(self, state : str) -> None:
+  'Enters the lexer state *state*'
+  self.state = state
+  self.matchIterator = None
+
+ def _newToken(self, type : str, value : Union[str, int], lexpos : int) -> ply.lex.LexToken:
+  tok = ply.lex.LexToken()
+  tok.type = type
+  tok.value = value
+  tok.lineno = self.lineno
+  tok.lexpos = lexpos
+  return tok
+
+ def token(self) -> Optional[ply.lex.LexToken]:
+  '''Returns the next token
+
+:returns: the token or ``None`` at the end of the data
+  '''
+  while True:
+   if self.matchIterator is None or self.nextPos != self.lexpos:
+    self.matchIterator = self.regexDict[self.state].finditer(self.lexdata, self.lexpos)
+   match = next(self.matchIterator, None)
+   if match is None:
+    self.matchIterator = None
+    return None
+   kind = match.lastgroup
+   start = self.lexpos
+   self.lexpos = self.nextPos = match.end()
+   if kind == 'ignore' or kind == 'LINECOMMENT' or kind == 'MOVENUMBER':
+    continue
+   elif kind == 'SANPLY':
+    sanTo = match.group('sanTo')
+    if sanTo is None:
+     return self._newToken(kind, match.group(kind), start)
+    return self._newToken(kind, match.group('sanFrom') + sanTo, start)
+   elif kind == 'NAG':
+    tok = self._newToken(kind, match.group(kind), start)
+    if match.group('nagNumber') is None:
+     if tok.value not in self.module.nagDict:
+      self.module._raise_error("Illegal NAG symbol", tok, warn = True)
+      tok.value = 0
+     else:
+      tok.value = self.module.nagDict[tok.value]
+    else:
+     tok.value = int(tok.value[1:])
+     if tok.value >= 140:
+      self.module._raise_error("Illegal NAG string", tok, warn = True)
+      tok.value = 0
+    return tok
+   elif kind == 'NEWLINE':
+    self.lineno += self.lexpos - start
+   elif kind == 'COMMENT':
+    tok = self._newToken(kind, self.module._recode(match.group(kind)), start)
+    self.lineno += tok.value.count('\n')
+    return tok
+   elif kind == 'TAGVALUE':
+    return self._newToken(kind, self.module._recode(match.group('tagValue')), start)
+   elif kind == 'LBRACK':
+    self.begin('tag')
+   elif kind == 'LBRACE':
+    self.begin('comment')
+   elif kind == 'RBRACK' and self.state == 'INITIAL':
+    self.module._raise_error("Illegal tagname", self._newToken(kind, match.group(), start))
+   elif kind == 'RBRACE' and self.state == 'INITIAL':
+    self.module._raise_error("Unexpected }", self._newToken(kind, match.group(), start))
+   elif kind == 'RBRACK' or kind == 'RBRACE':
+    self.begin('INITIAL')
+   elif kind == 'NULLMOVE':
+    return self._newToken('SANPLY', '0000', start)
+   elif kind == 'error':
+    self.lexpos = start
+    self.module._raise_error(self.errorDict[self.state], self._newToken(kind, self.lexdata[start:start + 20], start))
+   else:
+    return self._newToken(kind, match.group(), start)
+
 # ==================================================================
 
-lexer : PGNLexer = PGNLexer()
-'''The global instance of the lexer'''
+class SANCache(object):
+ '''A bounded cache of the moves belonging to a position and a SAN string (see *chess.Board.parse_san*)
 
-def _checkToken(tok : ply.lex.LexToken, expectedType : str) -> None:
- global lexer
- if tok is None:
-  raise SyntaxError('Parser: {} marker missing'.format(expectedType))
- elif tok.type != expectedType:
-  raise SyntaxError('Parser: Unexpected token "{}" = {} ... (expected "{}") @ Line {}, Game {}, Pos {}'.format(
-                            tok.type, str(tok.value)[:10], expectedType, tok.lineno, lexer.gameID, tok.lexpos))
+Openings repeat across the games of a database, hence most SAN strings are resolved without
+generating the legal moves. The position is identified by the bitboards, side to move, castling rights,
+en passant square and chess960 flag of the board. If the cache is full, the least recently used move is evicted.
 
-def _skipGameBody() -> None:
- global lexer
- data = lexer.lexer.lexdata[lexer.lexer.lexpos:]
- actPos = 0
+:param maxSize: maximum number of cached moves
+ '''
+ def __init__(self, maxSize : int = 32768) -> None:
+  assert maxSize > 0
+  self.maxSize = maxSize
+  self.moveDict : collections.OrderedDict = collections.OrderedDict()
+  self.hits = 0
+  self.misses = 0
 
- if len(data) == 0:
-  return lexer.lexer.lexpos
- 
- endOfGameID = 0
- brackID = -1
-
- patternList = list()
- patternList.append(lexer.endOfGamePattern())
- patternList.append(re.compile(r'\{[^{}]*\}'))
- patternList.append(re.compile(r';[^\n]*\n'))
-
- matchDict = dict()
- for id in range(3):  
-  match = patternList[id].search(data)
-  if match is not None:
-   span = match.span()
-   # print('Setup: {}/{}: {}'.format(id, actPos + span[1], data[actPos + span[0]:actPos + span[1]]))
-   matchDict[actPos + span[0]] = (id, actPos + span[1])
-
- newBrackPos = data[actPos:].find('[')
- if newBrackPos >= 0:
-  brackPos = actPos + newBrackPos
- else:
-  brackPos = 2147483647
- while len(matchDict) > 0:
-  minPos = sorted(matchDict)[0]
-  id, endPos = matchDict[minPos]
-  if brackPos < minPos:
-   id = brackID
-   endPos = minPos +1
-   break
-  if id == endOfGameID:
-   break
-  del matchDict[minPos]
-  idList = [id]
-  keys = list(matchDict.keys())
-  for pos in keys:
-   if pos < endPos:
-    id, _ = matchDict[pos]
-    del matchDict[pos]
-    idList.append(id)
-  actPos = endPos
-  for id in idList:
-   match = patternList[id].search(data[actPos:])
-   if match is not None:
-    span = match.span()
-    # print('{}/{}: {}'.format(id, actPos + span[1], data[actPos + span[0]:actPos + span[1]]))
-    matchDict[actPos + span[0]] = (id, actPos + span[1])
-  newBrackPos = data[actPos:].find('[')
-  if newBrackPos >= 0:
-   brackPos = actPos + newBrackPos
-  else:
-   brackPos = 2147483647
-    
- lexer.lexer.lineno += data[:endPos].count('\n')
- lexer.lexer.lexpos += endPos - (id == brackID)
- if id == endOfGameID:
-  return None
- if len(matchDict) == 0:
-  raise SyntaxError("SkipBody: Parsing ended by EOF")
- elif id == brackID:
-  raise SyntaxError("SkipBody: Parsing ended by new header")
- else:
-  raise SyntaxError("SkipBody: Parsing ended inside a comment")
- return None
- 
-def _readComments(visitor : chess.pgn.BaseVisitor, tok : ply.lex.LexToken) -> ply.lex.LexToken:
- global lexer
- comment = ''
- while tok is not None and tok.type == 'COMMENT':
-  if len(comment) != 0:
-   comment += '\n'
-  comment += tok.value
-  tok = lexer.token()
-  visitor.visit_comment(comment.strip())
- return tok
-
-def _read_variants(visitor : chess.pgn.BaseVisitor[chess.pgn.ResultT], board_stack : List[chess.Board], tok : ply.lex.LexToken, semanticError : str) -> ply.lex.LexToken:
- global lexer
- while tok is not None and tok.type == 'LPAREN':
-  visitor.begin_variation()
-  board = board_stack[-1].copy()
-  board.pop()
-  board_stack.append(board)
-  tok = lexer.token()
-  tok = _readComments(visitor, tok)
-  tok, semanticError = _read_gameNodes(visitor, board_stack, tok, semanticError)
-  _checkToken(tok, 'RPAREN')
-  visitor.end_variation()
-  board_stack.pop()
-  tok = lexer.token()
- return tok, semanticError
-
-def _read_gameNodes(visitor : chess.pgn.BaseVisitor[chess.pgn.ResultT], board_stack : List[chess.Board],  tok : ply.lex.LexToken, semanticError : str) -> ply.lex.LexToken:
- global lexer
- while tok is not None and tok.type == 'SANPLY':
+ def __len__(self) -> int:
+  return len(self.moveDict)
+
+ @property
+ def hitRate(self) -> float:
+  '''Ratio of the cache hits and all requests'''
+  requests = self.hits + self.misses
+  return self.hits / requests if requests > 0 else 0.
+
+ def parse_san(self, board : chess.Board, san : str) -> chess.Move:
+  '''Returns the move of *san* in the position of *board*
+
+:param board: the position
+:param san: the move in standard algebraic notation
+:returns: the move
+:raises ValueError: if *san* is invalid, illegal or ambiguous (see *chess.Board.parse_san*)
+  '''
+  key = (board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings,
+            board.occupied_co[chess.WHITE], board.occupied_co[chess.BLACK],
+            board.turn, board.castling_rights, board.ep_square, board.chess960, san)
+  move = self.moveDict.get(key)
+  if move is not None:
+   self.hits += 1
+   self.moveDict.move_to_end(key)
+   return move
+  self.misses += 1
+  move = board.parse_san(san)
+  self.moveDict[key] = move
+  if len(self.moveDict) > self.maxSize:
+   self.moveDict.popitem(last = False)
+  return move
+
+ def statistics(self) -> str:
+  'Returns size, hits, misses and hit rate of the cache'
+  return 'SANCache: {} of {} moves, {} hits, {} misses, hit rate {:.1%}'.format(
+                  len(self), self.maxSize, self.hits, self.misses, self.hitRate)
+
+ def clear(self) -> None:
+  'Removes all moves and resets the statistics'
+  self.moveDict.clear()
+  self.hits = 0
+  self.misses = 0
+
+class PGNReader(object):
+ '''A reader of the games of a PGN-file opened in text mode (see *read_game*)
+
+Every reader owns its lexer, buffer and game counter. Hence, several files may be read 
+in interleaved order and readers may be used concurrently in different threads. 
+
+:param f: file handle opened in text mode or a *mmap.mmap* object (see *PGNLexer*)
+:param bufsize: size of the token buffer (see *PGNLexer*)
+:param encoding: encoding of mapped input
+:param backend: tokenizer of the lexer (see *PGNLexer*)
+:param sanCache: cache resolving the SAN strings, may be shared by readers of the same thread. If None, the reader creates its own.
+ '''
+ def __init__(self, f : Union[TextIO, mmap.mmap], bufsize : Optional[int] = None, encoding : Optional[str] = None, backend : str = 'ply', sanCache : Optional[SANCache] = None) -> None:
+  self.f = f
+  self.lexer = PGNLexer(bufsize = bufsize, encoding = encoding, backend = backend)
+  self.sanCache = SANCache() if sanCache is None else sanCache
+
+ @classmethod
+ def mapFile(cls, pgnFile : str, encoding : str = 'utf-8-sig', bufsize : Optional[int] = None, backend : str = 'ply') -> 'PGNReader':
+  '''Returns a reader of a memory-mapped PGN-file
+  
+:param pgnFile: path of the PGN-file (must not be empty)
+:param encoding: encoding of the PGN-file
+:param bufsize: size of the token buffer (see *PGNLexer*)
+:param backend: tokenizer of the lexer (see *PGNLexer*)
+:returns: the reader
+  '''
+  with open(pgnFile, mode = 'rb') as f:
+   mappedFile = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+  return cls(mappedFile, bufsize = bufsize, encoding = encoding, backend = backend)
+
+ @property
+ def gameID(self) -> int:
+  '''Number of games read so far'''
+  return self.lexer.gameID
+
+ def __iter__(self) -> Iterator[chess.pgn.Game]:
+  while True:
+   game = self.read_game()
+   if game is None:
+    return
+   yield game
+
+ def _readComments(self, visitor : chess.pgn.BaseVisitor, tok : ply.lex.LexToken) -> ply.lex.LexToken:
+  comment = ''
+  while tok is not None and tok.type == 'COMMENT':
+   if len(comment) != 0:
+    comment += '\n'
+   comment += tok.value
+   tok = self.lexer.token()
+   visitor.visit_comment(comment.strip())
+  return tok
+
+ def _skipVariation(self, tok : ply.lex.LexToken) -> ply.lex.LexToken:
+  depth = 1
+  while tok is not None and tok.type not in ('ENDOFGAME', 'TAGNAME'):
+   if tok.type == 'LPAREN':
+    depth += 1
+   elif tok.type == 'RPAREN':
+    depth -= 1
+    if depth == 0:
+     break
+   tok = self.lexer.token()
+  return tok
+
+ def _read_variants(self, visitor : chess.pgn.BaseVisitor[chess.pgn.ResultT], board : chess.Board, tok : ply.lex.LexToken, semanticError : str, variationDepth : int) -> ply.lex.LexToken:
+  # variations are read on the board of the game: its last move is taken back and replayed afterwards
+  while tok is not None and tok.type == 'LPAREN':
+   skipping = visitor.begin_variation() is chess.pgn.SKIP
+   move = board.pop()
+   stackDepth = len(board.move_stack)
+   tok = self.lexer.token()
+   if skipping:
+    tok = self._skipVariation(tok)
+   else:
+    tok = self._readComments(visitor, tok)
+    tok, semanticError = self._read_gameNodes(visitor, board, tok, semanticError, variationDepth + 1)
+   self.lexer.checkToken(tok, 'RPAREN')
+   visitor.end_variation()
+   while len(board.move_stack) > stackDepth:
+    board.pop()
+   board.push(move)
+   tok = self.lexer.token()
+  return tok, semanticError
+
+ def _read_gameNodes(self, visitor : chess.pgn.BaseVisitor[chess.pgn.ResultT], board : chess.Board,  tok : ply.lex.LexToken, semanticError : str, variationDepth : int = 0) -> ply.lex.LexToken:
+  visitBoard = self.visitsBoard(visitor)
+  while tok is not None and tok.type == 'SANPLY':
+   try:
+    move = self.sanCache.parse_san(board, tok.value)
+   except:
+    move = chess.Move.null()
+    if semanticError == '':
+     semanticError = 'Parser: Improper SAN {} @ Line {}, Game {}, Pos {}'.format(tok.value, tok.lineno, self.lexer.gameID, tok.lexpos)
+   visitor.visit_move(board, move)
+   board.push(move)
+   if visitBoard:
+    visitor.visit_board(board if variationDepth == 0 else board.copy(stack = False))
+   tok = self.lexer.token()
+   while tok is not None and tok.type == 'NAG':
+     visitor.visit_nag(tok.value)
+     tok = self.lexer.token()
+   tok = self._readComments(visitor, tok)
+   if tok is not None and tok.type == 'LPAREN':
+    tok, semanticError = self._read_variants(visitor, board, tok, semanticError, variationDepth)
+  return tok, semanticError
+
+ @staticmethod
+ def visitsBoard(visitor : chess.pgn.BaseVisitor) -> bool:
+  '''Returns True, if *visitor* overrides *visit_board*
+
+All variations of a game are read on a single board. Visitors not overriding *visit_board* 
+get no boards, the others the board of the game on the mainline and a snapshot without 
+move stack inside variations, since the board is taken back at the end of a variation.
+  '''
+  return type(visitor).visit_board is not chess.pgn.BaseVisitor.visit_board
+
+ def read_game(self, Visitor : Type[chess.pgn.BaseVisitor[chess.pgn.ResultT]] = chess.pgn.GameBuilder) -> Optional[chess.pgn.ResultT]:
+  '''Reads the next game (see *read_game*)
+
+:param Visitor: Visitor object, i.e. chess.pgn.BaseVisitor and one of the derived classes 
+:returns: the expected *ResultT* object or ``None`` if parsing failed.
+  '''
+  assert issubclass(Visitor, chess.pgn.BaseVisitor), 'Visitor ({}) must a subclass of chess.pgn.BaseVisitor'.format(type(Visitor)) 
   try:
-   move =  board_stack[-1].parse_san(tok.value)
-  except:
-   move = chess.Move.null()
-   if semanticError == '':
-    semanticError = 'Parser: Improper SAN {} @ Line {}, Game {}, Pos {}'.format(tok.value, tok.lineno, lexer.gameID, tok.lexpos)
-  visitor.visit_move(board_stack[-1], move)
-  board_stack[-1].push(move)
-  visitor.visit_board(board_stack[-1])
-  tok = lexer.token()
-  while tok is not None and tok.type == 'NAG':
-    visitor.visit_nag(tok.value)
-    tok = lexer.token()
-  tok = _readComments(visitor, tok)
-  if tok is not None and tok.type == 'LPAREN':
-   tok, semanticError = _read_variants(visitor, board_stack, tok, semanticError)
- return tok, semanticError
+   tok = self.lexer.newGame(self.f)
+  except Exception as error:
+   raise IOError('Lexer: {}'.format(error))
+  if tok is None:
+   return None
+  visitor = Visitor()
+  skipping_game = visitor.begin_game() is chess.pgn.SKIP
+  headers = visitor.begin_headers()
+  if headers is None:
+   headers = chess.pgn.Headers()
+  while tok.type == 'TAGNAME':
+   tagName = tok.value
+   tok = self.lexer.token()
+   self.lexer.checkToken(tok, 'TAGVALUE')
+   visitor.visit_header(tagName, tok.value)
+   tok = self.lexer.token()
+  skipping_game  |= visitor.end_headers() is chess.pgn.SKIP
+  tok = self._readComments(visitor, tok)
+  if skipping_game:
+   try:
+    if tok is not None and tok.type == 'TAGNAME':
+     self.lexer.rewindTag(tok)
+    elif tok is not None and tok.type != 'ENDOFGAME':
+     self.lexer.skipGameBody()
+   except Exception as error:
+    visitor.handle_error(error)
+   self.lexer.endGame()
+   visitor.end_game()
+   return visitor.result()
+  try:
+   board = headers.board()
+   if self.visitsBoard(visitor):
+    visitor.visit_board(board)
+   tok, semanticError = self._read_gameNodes(visitor, board, tok, '')
+   gameIsOver = board.is_game_over(claim_draw = False)
+   if gameIsOver:
+    if board.is_checkmate():
+     if board.turn:
+      tok.value = '0-1'
+     else:
+      tok.value = '1-0'
+    else:
+     tok.value = '1/2-1/2'
+   if tok is not None and tok.type == 'TAGNAME':
+    self.lexer.rewindTag(tok)
+   elif semanticError != '':
+    if tok.type == 'ENDOFGAME':
+     visitor.visit_result(tok.value)
+    raise SyntaxError(semanticError)
+   elif tok is not None:
+    self.lexer.checkToken(tok, 'ENDOFGAME')
+    visitor.visit_result(tok.value)
+    if (not gameIsOver) and headers['Result'] != tok.value:
+     raise SyntaxError("Parser: game.headers['Result'] ({}) != endOfGame ({})".format(headers['Result'], tok.value))
+  except Exception as error:
+   try:
+    visitor.handle_error(error)
+   except Exception as error:
+    chess.pgn.LOGGER.exception(error)
+   visitor.end_game()
+  self.lexer.endGame()
+  return visitor.result()
+
+ def read_headers(self) -> Optional[chess.pgn.Headers]:
+  '''Reads the headers of the next game (see *read_headers*)'''
+  headers = self.lexer.scanHeaders(self.f)
+  if self.lexer.scanError is not None:
+   chess.pgn.LOGGER.error(self.lexer.scanError)
+  return headers
+
+ def read_board(self) -> Optional[chess.Board]:
+  '''Reads the final position of the next game (see *read_board*)'''
+  return self.read_game(Visitor = chess.pgn.BoardBuilder)
+
+ def skip_game(self) -> bool:
+  '''Skips the next game (see *skip_game*)'''
+  return bool(self.read_game(Visitor = chess.pgn.SkipVisitor))
+
+_readerDict : weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+def _reader(f : TextIO) -> PGNReader:
+ reader = _readerDict.get(f)
+ if reader is None or f.tell() == 0:
+  reader = PGNReader(f)
+  _readerDict[f] = reader
+ return reader
 
 def read_game(f : TextIO, Visitor : Type[chess.pgn.BaseVisitor[chess.pgn.ResultT]] = chess.pgn.GameBuilder) -> Optional[chess.pgn.ResultT]:
  """Reads a game from an open handle PGN-file in text mode.
@@ -401,7 +1024,8 @@ The file must be opened using the correct encoding, usually
   * 'ascii': 7-bit ASCII,
   * 'iso-8859-1': ISO 8859/1 (Latin 1), rarely used but suggested by PGN standard.
   
-Please note: *read_game* uses a private buffer.
+Please note: *read_game* uses a private *PGNReader* per file handle, i.e. a private buffer.
+The reader is restarted, if the file is rewound to its beginning.
 
 As an extension of the PGN Standard, read_game accepts
 
@@ -431,75 +1055,18 @@ The last 2 alternatives are reported as an error, but parsing succeeds.
     
 :returns: the expected *ResultT* object or ``None`` if parsing failed.
  """
- global lexer
- assert issubclass(Visitor, chess.pgn.BaseVisitor), 'Visitor ({}) must a subclass of chess.pgn.BaseVisitor'.format(type(Visitor)) 
- try:
-  tok = lexer.newGame(f)
- except Exception as error:
-  raise IOError('Lexer: {}'.format(error))
- if tok is None:
-  return None
- visitor = Visitor()
- skipping_game = visitor.begin_game() is chess.pgn.SKIP
- headers = visitor.begin_headers()
- if headers is None:
-  headers = chess.pgn.Headers()
- while tok.type == 'TAGNAME':
-  tagName = tok.value
-  tok = lexer.token()
-  _checkToken(tok, 'TAGVALUE')
-  visitor.visit_header(tagName, tok.value)
-  tok = lexer.token()
- skipping_game  |= visitor.end_headers() is chess.pgn.SKIP
- tok = _readComments(visitor, tok)
- if skipping_game:
-  try:
-   _skipGameBody()
-   lexer.endGame()
-  except Exception as error:
-   visitor.handle_error(error)
-  visitor.end_game()
-  return visitor.result()
- try:
-  board_stack = [headers.board()]
-  visitor.visit_board(board_stack[-1])
-  tok, semanticError = _read_gameNodes(visitor,board_stack, tok, '')
-  gameIsOver = board_stack[-1].is_game_over(claim_draw = False)
-  if gameIsOver:
-   if board_stack[-1].is_checkmate():
-    if board_stack[-1].turn:
-     tok.value = '0-1'
-    else:
-     tok.value = '1-0'
-   else:
-    tok.value = '1/2-1/2'
-  if tok is not None and tok.type == 'TAGNAME':
-   lexer.lexer.lexpos -= 1
-  elif semanticError != '':
-   if tok.type == 'ENDOFGAME':
-    visitor.visit_result(tok.value)
-   raise SyntaxError(semanticError)
-  elif tok is not None:
-   _checkToken(tok, 'ENDOFGAME')
-   visitor.visit_result(tok.value)
-   if (not gameIsOver) and headers['Result'] != tok.value:
-    raise SyntaxError("Parser: game.headers['Result'] ({}) != endOfGame ({})".format(headers['Result'], tok.value))
- except Exception as error:
-  try:
-   visitor.handle_error(error)
-  except Exception as error:
-   chess.pgn.LOGGER.exception(error)
-  visitor.end_game()
- lexer.endGame()
- return visitor.result()
+ return _reader(f).read_game(Visitor = Visitor)
  
 def read_headers(handle : TextIO) -> Optional[chess.pgn.Headers]:
- '''Convenience function representing *read_game(handle, Visitor = chess.pgn.HeadersBuilder)*
+ '''Fast equivalent of *read_game(handle, Visitor = chess.pgn.HeadersBuilder)*
+
+The tag pairs are matched by a regular expression and the movetext is skipped without 
+tokenizing it (see *PGNLexer.scanHeaders*), i.e. moves are not checked.
 
  :param f: file handle opened in text mode 
  :returns: a *chess.pgn.Headers* object or ``None`` if parsing failed.
  '''
- return read_game(handle, Visitor = chess.pgn.HeadersBuilder)
+ return _reader(handle).read_headers()
  
 def read_board(handle : TextIO) -> Optional[chess.Board]:
  '''Convenience function representing *read_game(handle, Visitor = chess.pgn.BoardBuilder)*
@@ -517,6 +1084,915 @@ def skip_game(handle : TextIO) -> bool:
  '''
  return bool(read_game(handle, Visitor = chess.pgn.SkipVisitor))
 
+class HeaderIndex(object):
+ '''A columnar index of the tag pairs of games for sorting and filtering without reading the games
+
+For every game, the value of each tag of *keys* is stored as code of an interned string in an array 
+(missing tags as *?*, like the game list shows them). Dates and Elo ratings are additionally stored 
+as numbers, i.e. *Date* as YYYYMMDD with 0 for unknown parts. Sorting and filtering operate on these 
+arrays: string tags are ranked and filter predicates are evaluated once per distinct value, 
+so sorting or filtering a million games takes a fraction of a second.
+
+Rows are given as *entries*, i.e. numbers of games in the index or *chess.pgn.Headers* of games 
+not (or no longer correctly) represented by the index, e.g. new or modified games (see *IndexedGameList.headerEntries*).
+ '''
+ keys = ('Event', 'Site', 'Date', 'Round', 'White', 'Black', 'Result', 'ECO', 'WhiteElo', 'BlackElo')
+ numericKeys = ('Date', 'WhiteElo', 'BlackElo')
+
+ def __init__(self) -> None:
+  self.values = {key : list() for key in self.keys}
+  self.codeArrays = {key : array.array('i') for key in self.keys}
+  self.numberArrays = {key : array.array('i') for key in self.numericKeys}
+  self.codeDicts = {key : dict() for key in self.keys}
+  self.rankCache = dict()
+
+ def __getstate__(self) -> dict:
+  return {'values' : self.values, 'codeArrays' : self.codeArrays, 'numberArrays' : self.numberArrays}
+
+ def __setstate__(self, state : dict) -> None:
+  self.values = state['values']
+  self.codeArrays = state['codeArrays']
+  self.numberArrays = state['numberArrays']
+  self.codeDicts = {key : {value : code for code, value in enumerate(values)} for key, values in self.values.items()}
+  self.rankCache = dict()
+
+ @classmethod
+ def fromHeaders(cls, headersIterable : Iterator[chess.pgn.Headers]) -> 'HeaderIndex':
+  '''Returns the index of the tag pairs of games
+
+:param headersIterable: the headers of the games
+:returns: the index
+  '''
+  headerIndex = cls()
+  for headers in headersIterable:
+   headerIndex.append(headers)
+  return headerIndex
+
+ def __len__(self) -> int:
+  return len(self.codeArrays['Event'])
+
+ def truncated(self, count : int) -> 'HeaderIndex':
+  '''Returns a copy of the index of the first games
+
+:param count: number of games
+:returns: the new index
+  '''
+  headerIndex = HeaderIndex()
+  headerIndex.values = {key : values.copy() for key, values in self.values.items()}
+  headerIndex.codeArrays = {key : codes[:count] for key, codes in self.codeArrays.items()}
+  headerIndex.numberArrays = {key : numbers[:count] for key, numbers in self.numberArrays.items()}
+  headerIndex.codeDicts = {key : codeDict.copy() for key, codeDict in self.codeDicts.items()}
+  return headerIndex
+
+ @staticmethod
+ def number(key : str, value : str) -> int:
+  '''Returns the number of a date (YYYYMMDD, unknown parts as 0) or an Elo rating (0 if unknown)'''
+  if key == 'Date':
+   number = 0
+   for part in (value.split('.') + ['', '', ''])[:3]:
+    number = 100*number + (int(part) if part.isdigit() else 0)
+   return number if number < 2**31 else 0
+  return int(value) if value.isdigit() and len(value) < 10 else 0
+
+ def _code(self, key : str, value : str) -> int:
+  codeDict = self.codeDicts[key]
+  code = codeDict.get(value)
+  if code is None:
+   code = len(codeDict)
+   self.values[key].append(value)
+   codeDict[value] = code
+  return code
+
+ def append(self, headers : chess.pgn.Headers) -> None:
+  '''Appends the tag pairs of a game
+
+:param headers: the headers of the game
+  '''
+  for key in self.numericKeys:
+   self.numberArrays[key].append(self.number(key, headers.get(key, '?')))
+  for key in self.keys:
+   self.codeArrays[key].append(self._code(key, headers.get(key, '?')))
+
+ def appendFrom(self, headerIndex : 'HeaderIndex', gameID : int) -> None:
+  '''Appends the tag pairs of a game of another index
+
+:param headerIndex: the other index
+:param gameID: number of the game in the other index
+  '''
+  for key in self.numericKeys:
+   self.numberArrays[key].append(headerIndex.numberArrays[key][gameID])
+  for key in self.keys:
+   self.codeArrays[key].append(self._code(key, headerIndex.value(key, gameID)))
+
+ def value(self, key : str, gameID : int) -> str:
+  '''Returns the value of a tag of a game
+
+:param key: name of the tag (see *keys*)
+:param gameID: number of the game
+:returns: the value
+  '''
+  return self.values[key][self.codeArrays[key][gameID]]
+
+ def _ranks(self, key : str) -> Tuple[List[str], array.array]:
+  values = self.values[key]
+  nValues = len(values)
+  if key in self.rankCache and self.rankCache[key][0] == nValues:
+   return self.rankCache[key][1:]
+  foldedValues = [value.casefold() for value in values[:nValues]]
+  sortedValues = sorted(set(foldedValues))
+  rankDict = {value : rank for rank, value in enumerate(sortedValues)}
+  ranks = array.array('i', [rankDict[value] for value in foldedValues])
+  self.rankCache[key] = (nValues, sortedValues, ranks)
+  return sortedValues, ranks
+
+ def sortRows(self, key : str, entries : List[Union[int, chess.pgn.Headers]], reverse : bool = False) -> List[int]:
+  '''Returns the rows sorted by the value of a tag, rows with equal values keep their order
+
+Strings are compared case-insensitively, dates and Elo ratings numerically (see *number*).
+
+:param key: name of the tag (see *keys*)
+:param entries: numbers of games in the index or headers of other games
+:param reverse: if True, sort in descending order
+:returns: the sorted rows, i.e. positions in *entries*
+  '''
+  if key in self.numericKeys:
+   numbers = self.numberArrays[key]
+   keyList = [numbers[entry] if entry.__class__ is int else self.number(key, entry.get(key, '?')) for entry in entries]
+  else:
+   sortedValues, ranks = self._ranks(key)
+   extraValues = {entry.get(key, '?').casefold() for entry in entries if entry.__class__ is not int}
+   rankDict = {value : rank for rank, value in enumerate(sorted(extraValues.union(sortedValues)))}
+   if len(rankDict) > len(sortedValues):
+    newRanks = [rankDict[value] for value in sortedValues]
+    ranks = [newRanks[rank] for rank in ranks]
+   codes = self.codeArrays[key]
+   keyList = [ranks[codes[entry]] if entry.__class__ is int else rankDict[entry.get(key, '?').casefold()] for entry in entries]
+  return sorted(range(len(keyList)), key = keyList.__getitem__, reverse = reverse)
+
+ def filterRows(self, key : str, accept : Callable[[str], bool], entries : List[Union[int, chess.pgn.Headers]], rows : Optional[Iterator[int]] = None) -> List[int]:
+  '''Returns the rows with an accepted value of a tag
+
+:param key: name of the tag (see *keys*)
+:param accept: predicate called with the value of the tag, once per distinct value
+:param entries: numbers of games in the index or headers of other games
+:param rows: rows to be filtered, defaults to all rows
+:returns: the accepted rows
+  '''
+  values = self.values[key]
+  acceptList = [accept(value) for value in values]
+  codes = self.codeArrays[key]
+  if rows is None:
+   rows = range(len(entries))
+  acceptedRows = list()
+  for row in rows:
+   entry = entries[row]
+   if acceptList[codes[entry]] if entry.__class__ is int else accept(entry.get(key, '?')):
+    acceptedRows.append(row)
+  return acceptedRows
+
+class PGNIndex(object):
+ '''A byte-offset index of the games of a PGN-file.
+
+The index stores, for every game, the offset of its first byte, the line number of its 
+first token and the size of its tag pair section. It allows to access a single game of 
+a large file by seeking to its offset instead of parsing all preceding games.
+The tag pairs read while scanning are collected in *headerIndex* (see *HeaderIndex*).
+The index is stored as a sidecar file (*<pgnFile base>.pgni*), which is rebuilt, if 
+size or modification time of the PGN-file changed.
+
+:param pgnFile: path of the PGN-file 
+:param encoding: encoding of the PGN-file (see *read_game*)
+ '''
+ version = 2
+ indexSuffix = '.pgni'
+
+ def __init__(self, pgnFile : str, encoding : str = 'utf-8-sig') -> None:
+  self.pgnFile = os.path.abspath(pgnFile)
+  self.encoding = encoding
+  self.offsetArray = array.array('q')
+  self.lineArray = array.array('l')
+  self.headerSizeArray = array.array('l')
+  self.headerIndex = HeaderIndex()
+  self.fileSize = 0
+  self.mtime = 0.
+  self.errorList = list()
+  self.sanCache = SANCache()
+
+ @classmethod
+ def open(cls, pgnFile : str, encoding : str = 'utf-8-sig', useSidecar : bool = True) -> 'PGNIndex':
+  '''Returns the index of a PGN-file, loaded from its sidecar file or rebuilt if missing or outdated
+  
+:param pgnFile: path of the PGN-file 
+:param encoding: encoding of the PGN-file
+:param useSidecar: if True, the sidecar file is read and (re-)written
+:returns: the index
+  '''
+  index = cls(pgnFile, encoding)
+  if useSidecar and index.load():
+   return index
+  index.build()
+  if useSidecar:
+   try:
+    index.save()
+   except OSError:
+    pass
+  return index
+
+ def indexFile(self) -> str:
+  '''Returns the path of the sidecar file'''
+  return os.path.splitext(self.pgnFile)[0] + self.indexSuffix
+
+ def isValid(self) -> bool:
+  '''Returns True, if size and modification time of the PGN-file match the index'''
+  try:
+   stat = os.stat(self.pgnFile)
+  except OSError:
+   return False
+  return stat.st_size == self.fileSize and stat.st_mtime == self.mtime
+
+ def build(self, notify : Optional[Callable[[int], Optional[bool]]] = None) -> bool:
+  '''Builds the index by scanning the PGN-file
+
+The file is memory-mapped and scanned without tokenizing (see *PGNLexer.scanHeaders*).
+The games indexed so far may be accessed by *notify*, e.g. from another thread.
+
+:param notify: called with the number of games indexed every 1000 games, returning True cancels the build
+:returns: True, if the whole file is indexed
+  '''
+  stat = os.stat(self.pgnFile)
+  self.fileSize = stat.st_size
+  self.mtime = stat.st_mtime
+  self.offsetArray = array.array('q')
+  self.lineArray = array.array('l')
+  self.headerSizeArray = array.array('l')
+  self.headerIndex = HeaderIndex()
+  self.errorList = list()
+  if self.fileSize == 0:
+   return True
+  pgnLexer = PGNLexer(encoding = self.encoding)
+  with open(self.pgnFile, mode = 'rb') as f, mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as mappedFile:
+   while True:
+    headers = pgnLexer.scanHeaders(mappedFile)
+    if headers is None:
+     break
+    self.headerIndex.append(headers)
+    self.offsetArray.append(pgnLexer.gameStart)
+    self.lineArray.append(pgnLexer.gameLine)
+    self.headerSizeArray.append(pgnLexer.headerEnd - pgnLexer.gameStart)
+    if pgnLexer.scanError is not None:
+     self.errorList.append((len(self) - 1, pgnLexer.scanError))
+    if notify is not None and len(self) % 1000 == 0 and notify(len(self)):
+     return False
+  return True
+
+ def save(self) -> None:
+  '''Writes the index to its sidecar file'''
+  indexDict = {'version' : self.version, 'encoding' : self.encoding, 
+                     'fileSize' : self.fileSize, 'mtime' : self.mtime, 
+                     'offsetArray' : self.offsetArray, 'lineArray' : self.lineArray, 
+                     'headerSizeArray' : self.headerSizeArray, 'headerIndex' : self.headerIndex}
+  with open(self.indexFile(), mode = 'wb') as f:
+   pickle.dump(indexDict, f)
+
+ def load(self) -> bool:
+  '''Reads the index from its sidecar file
+
+:returns: True, if the sidecar file exists and matches the PGN-file
+  '''
+  try:
+   with open(self.indexFile(), mode = 'rb') as f:
+    indexDict = pickle.load(f)
+  except Exception:
+   return False
+  if not isinstance(indexDict, dict) or indexDict.get('version') != self.version:
+   return False
+  self.fileSize = indexDict['fileSize']
+  self.mtime = indexDict['mtime']
+  if indexDict['encoding'] != self.encoding or not self.isValid():
+   return False
+  self.offsetArray = indexDict['offsetArray']
+  self.lineArray = indexDict['lineArray']
+  self.headerSizeArray = indexDict['headerSizeArray']
+  self.headerIndex = indexDict['headerIndex']
+  self.errorList = list()
+  return True
+
+ def __len__(self) -> int:
+  return len(self.offsetArray)
+
+ def span(self, gameID : int) -> Tuple[int, int]:
+  '''Returns the byte range of a game
+
+:param gameID: number of the game (starting with 0)
+:returns: (start, end) offsets in bytes
+  '''
+  start = self.offsetArray[gameID]
+  if gameID + 1 < len(self.offsetArray):
+   end = self.offsetArray[gameID + 1]
+  else:
+   end = self.fileSize
+  return start, end
+
+ def lineNumber(self, gameID : int) -> int:
+  '''Returns the line number of the first token of a game'''
+  return self.lineArray[gameID]
+
+ def readBytes(self, gameID : int, headersOnly : bool = False) -> bytes:
+  '''Returns the raw bytes of a game
+
+:param gameID: number of the game (starting with 0)
+:param headersOnly: if True, only the tag pair section is returned
+:returns: the bytes of the game
+  '''
+  start, end = self.span(gameID)
+  if headersOnly:
+   end = start + self.headerSizeArray[gameID]
+  with open(self.pgnFile, mode = 'rb') as f:
+   f.seek(start)
+   return f.read(end - start)
+
+ def readText(self, gameID : int, headersOnly : bool = False) -> str:
+  '''Returns the text of a game decoded with the encoding of the index
+
+:param gameID: number of the game (starting with 0)
+:param headersOnly: if True, only the tag pair section is returned
+:returns: the text of the game
+  '''
+  return self.readBytes(gameID, headersOnly).decode(self.encoding, errors = 'replace').replace('\r\n', '\n')
+
+ def readHeaders(self, gameID : int) -> chess.pgn.Headers:
+  '''Returns the tag pairs of a game without parsing its moves
+
+:param gameID: number of the game (starting with 0)
+:returns: a *chess.pgn.Headers* object
+  '''
+  headers = chess.pgn.Headers()
+  headers.update(PGNLexer.tagPairs(self.readText(gameID, headersOnly = True)))
+  return headers
+
+ def readGame(self, gameID : int, Visitor : Type[chess.pgn.BaseVisitor[chess.pgn.ResultT]] = chess.pgn.GameBuilder) -> Optional[chess.pgn.ResultT]:
+  '''Reads a single game (see *read_game_at*)'''
+  return read_game_at(self, gameID, Visitor = Visitor)
+
+def read_game_at(index : PGNIndex, gameID : int, Visitor : Type[chess.pgn.BaseVisitor[chess.pgn.ResultT]] = chess.pgn.GameBuilder, sanCache : Optional[SANCache] = None) -> Optional[chess.pgn.ResultT]:
+ '''Reads a single game of an indexed PGN-file (see *read_game*)
+
+:param index: the index of the PGN-file
+:param gameID: number of the game (starting with 0)
+:param Visitor: Visitor object, i.e. chess.pgn.BaseVisitor and one of the derived classes 
+:param sanCache: cache of parsed moves, defaults to the cache of *index* (a cache must not be shared between threads)
+:returns: the expected *ResultT* object or ``None`` if parsing failed.
+ '''
+ if sanCache is None:
+  sanCache = index.sanCache
+ return PGNReader(io.StringIO(index.readText(gameID)), sanCache = sanCache).read_game(Visitor = Visitor)
+
+_eventLineBytesRegex = re.compile(rb'\n[ \t]*\[\s*Event\b')
+
+def _chunkOffsets(pgnFile : str, chunkSize : int) -> List[int]:
+ '''Returns the offsets of game-aligned chunks of a PGN-file, i.e. of lines starting with an *Event* tag'''
+ fileSize = os.path.getsize(pgnFile)
+ offsetList = [0]
+ with open(pgnFile, mode = 'rb') as f:
+  pos = chunkSize
+  while pos < fileSize:
+   f.seek(pos - 1)
+   tail = b''
+   while True:
+    block = f.read(65536)
+    if len(block) == 0:
+     return offsetList
+    data = tail + block
+    match = _eventLineBytesRegex.search(data)
+    if match is not None:
+     pos += match.start() - len(tail)
+     break
+    tail = data[-64:]
+    pos += len(block)
+   offsetList.append(pos)
+   pos += chunkSize
+ return offsetList
+
+def _readChunk(pgnFile : str, encoding : str, start : int, end : int, Visitor : Type[chess.pgn.BaseVisitor[chess.pgn.ResultT]]) -> List[chess.pgn.ResultT]:
+ with open(pgnFile, mode = 'rb') as f:
+  f.seek(start)
+  data = f.read(end - start)
+ pgn = io.StringIO(data.decode(encoding, errors = 'replace').replace('\r\n', '\n'))
+ resultList = list()
+ while True:
+  result = read_game(pgn, Visitor = Visitor)
+  if result is None:
+   break
+  resultList.append(result)
+ return resultList
+
+def read_games_parallel(pgnFile : str, encoding : str = 'utf-8-sig', 
+                                   Visitor : Type[chess.pgn.BaseVisitor[chess.pgn.ResultT]] = chess.pgn.GameBuilder, 
+                                   processes : Optional[int] = None, chunkSize : int = 4194304) -> Iterator[chess.pgn.ResultT]:
+ '''Reads all games of a PGN-file using a pool of processes.
+ 
+The file is split into chunks of about *chunkSize* bytes, which start at a line beginning with an *Event* tag. 
+The chunks are parsed by *read_game* in separate processes, the results are delivered in file order. 
+Consequently, *Visitor* and its results must be picklable, i.e. *Visitor* must be defined at module level.
+As usual for *multiprocessing*, the calling script must be protected by ``if __name__ == "__main__":``.
+
+:param pgnFile: path of the PGN-file 
+:param encoding: encoding of the PGN-file (see *read_game*)
+:param Visitor: Visitor object, i.e. chess.pgn.BaseVisitor and one of the derived classes 
+:param processes: number of processes, defaults to the number of CPUs
+:param chunkSize: minimum size of a chunk in bytes
+:returns: an iterator of the expected *ResultT* objects
+ '''
+ assert issubclass(Visitor, chess.pgn.BaseVisitor), 'Visitor ({}) must a subclass of chess.pgn.BaseVisitor'.format(type(Visitor)) 
+ if processes is None:
+  processes = os.cpu_count() or 1
+ offsetList = _chunkOffsets(pgnFile, chunkSize)
+ offsetList.append(os.path.getsize(pgnFile))
+ with concurrent.futures.ProcessPoolExecutor(max_workers = processes) as executor:
+  pending = collections.deque()
+  for start, end in zip(offsetList[:-1], offsetList[1:]):
+   pending.append(executor.submit(_readChunk, pgnFile, encoding, start, end, Visitor))
+   if len(pending) >= 2*processes:
+    yield from pending.popleft().result()
+  while len(pending) > 0:
+   yield from pending.popleft().result()
+
+class HeaderFilter(object):
+ '''A header predicate for *write_games_parallel* matching the values of tags by regular expressions
+
+:param patternDict: dictionary of tag names and regular expressions, which must all be found in the values (missing tags as *?*)
+ '''
+ def __init__(self, patternDict : dict) -> None:
+  self.patternDict = dict(patternDict)
+  self.regexDict = {key : re.compile(pattern) for key, pattern in self.patternDict.items()}
+
+ def __getstate__(self) -> dict:
+  return {'patternDict' : self.patternDict}
+
+ def __setstate__(self, state : dict) -> None:
+  self.__init__(state['patternDict'])
+
+ def __call__(self, headers : chess.pgn.Headers) -> bool:
+  return all(regex.search(headers.get(key, '?')) is not None for key, regex in self.regexDict.items())
+
+class PositionFilter(object):
+ '''A position predicate for *write_games_parallel* accepting a position given by FEN
+
+:param fen: the position in Forsyth-Edwards notation
+ '''
+ def __init__(self, fen : str) -> None:
+  self.positionHash = chess.polyglot.zobrist_hash(chess.Board(fen))
+
+ def __call__(self, board : chess.Board) -> bool:
+  return chess.polyglot.zobrist_hash(board) == self.positionHash
+
+def _exportChunk(pgnFile : str, encoding : str, start : int, end : int, targetEncoding : str, 
+                              headerFilter : Optional[Callable[[chess.pgn.Headers], bool]], 
+                              positionFilter : Optional[Callable[[chess.Board], bool]]) -> Tuple[bytes, int]:
+ exportedList = list()
+ for game in _readChunk(pgnFile, encoding, start, end, chess.pgn.GameBuilder):
+  if headerFilter is not None and not headerFilter(game.headers):
+   continue
+  if positionFilter is not None:
+   board = game.board()
+   found = positionFilter(board)
+   for move in game.mainline_moves():
+    if found:
+     break
+    board.push(move)
+    found = positionFilter(board)
+   if not found:
+    continue
+  exportedList.append(game.accept(chess.pgn.StringExporter(headers = True, variations = True, comments = True)) + '\n\n')
+ return ''.join(exportedList).encode(targetEncoding, errors = 'replace'), len(exportedList)
+
+def write_games_parallel(pgnFile : str, targetFile : str, encoding : str = 'utf-8-sig', targetEncoding : Optional[str] = None, 
+                                   headerFilter : Optional[Callable[[chess.pgn.Headers], bool]] = None, 
+                                   positionFilter : Optional[Callable[[chess.Board], bool]] = None, 
+                                   processes : Optional[int] = None, chunkSize : int = 4194304, bufferSize : int = 1048576) -> int:
+ '''Exports the games of a PGN-file to another PGN-file using a pool of processes, e.g. to change the encoding.
+
+The file is split into chunks like by *read_games_parallel*. The games of a chunk are parsed, filtered and 
+exported by *chess.pgn.StringExporter* in a separate process. The exported chunks are written in file order
+through a buffered writer into a temporary file, which replaces *targetFile* at the end, i.e. *targetFile* may be *pgnFile*.
+The filters must be picklable (e.g. *HeaderFilter* and *PositionFilter*).
+As usual for *multiprocessing*, the calling script must be protected by ``if __name__ == "__main__":``.
+
+:param pgnFile: path of the PGN-file 
+:param targetFile: path of the exported PGN-file 
+:param encoding: encoding of the PGN-file (see *read_game*)
+:param targetEncoding: encoding of the exported PGN-file, defaults to *encoding*, characters not encodable are replaced by *?*
+:param headerFilter: if not ``None``, only games, whose headers are accepted, are exported
+:param positionFilter: if not ``None``, only games, which reach an accepted position on their mainline, are exported
+:param processes: number of processes, defaults to the number of CPUs
+:param chunkSize: minimum size of a chunk in bytes
+:param bufferSize: size of the buffer of the writer in bytes
+:returns: the number of exported games
+ '''
+ if targetEncoding is None:
+  targetEncoding = encoding
+ bom = codecs.lookup(targetEncoding).name == 'utf-8-sig'
+ textEncoding = 'utf-8' if bom else targetEncoding
+ if processes is None:
+  processes = os.cpu_count() or 1
+ offsetList = _chunkOffsets(pgnFile, chunkSize)
+ offsetList.append(os.path.getsize(pgnFile))
+ targetFile = os.path.abspath(targetFile)
+ count = 0
+ fd, tmpFile = tempfile.mkstemp(suffix = '.pgn', dir = os.path.dirname(targetFile))
+ try:
+  with open(fd, mode = 'wb', buffering = bufferSize) as f, \
+   concurrent.futures.ProcessPoolExecutor(max_workers = processes) as executor:
+   if bom:
+    f.write(codecs.BOM_UTF8)
+   def writeChunk() -> int:
+    data, chunkCount = pending.popleft().result()
+    f.write(data)
+    return chunkCount
+
+   pending = collections.deque()
+   for start, end in zip(offsetList[:-1], offsetList[1:]):
+    pending.append(executor.submit(_exportChunk, pgnFile, encoding, start, end, textEncoding, headerFilter, positionFilter))
+    if len(pending) >= 2*processes:
+     count += writeChunk()
+   while len(pending) > 0:
+    count += writeChunk()
+  os.replace(tmpFile, targetFile)
+ except BaseException:
+  os.remove(tmpFile)
+  raise
+ return count
+
+def runPGNExport() -> None:
+ '''Console entry point *pgnExport* of *write_games_parallel*, see ``pgnExport --help``'''
+ import argparse
+
+ encodingDict = {'u' : 'utf-8-sig', 'i' : 'iso-8859-1', 'a' : 'ascii'}
+ parser = argparse.ArgumentParser(description = 'PGN Export: exports, filters and re-encodes the games of a PGN-file in parallel')
+ parser.add_argument("pgnFile", help = "PGN-File (required)")
+ parser.add_argument("targetFile", help = "exported PGN-File (required)")
+ parser.add_argument("--encoding",  metavar = 'encoding',  default = 'u', 
+   choices=['u', 'utf-8-sig', 'i', 'iso-8859-1', 'a', 'ascii'], 
+   help="encoding of the PGN-File (u - utf-8-sig, i - iso-8859-1, a - ascii)")
+ parser.add_argument("--targetEncoding",  metavar = 'targetEncoding',  default = None, 
+   choices=['u', 'utf-8-sig', 'i', 'iso-8859-1', 'a', 'ascii'], 
+   help="encoding of the exported PGN-File, defaults to the encoding of the PGN-File")
+ parser.add_argument("--header", metavar = 'tag=regex', action = 'append', default = list(), 
+   help="export only games, whose tag value matches the regular expression (may be repeated)")
+ parser.add_argument("--fen", metavar = 'fen', default = None, help="export only games reaching the position")
+ parser.add_argument("--processes", metavar = 'processes', type = int, default = None, help="number of processes")
+ parser.add_argument("--chunkSize", metavar = 'chunkSize', type = int, default = 4194304, help="minimum size of a chunk in bytes")
+
+ args = parser.parse_args()
+ encoding = encodingDict[args.encoding[0]]
+ targetEncoding = encodingDict[args.targetEncoding[0]] if args.targetEncoding is not None else None
+ patternDict = dict()
+ for header in args.header:
+  key, separator, pattern = header.partition('=')
+  if len(separator) == 0:
+   parser.error('header filter "{}" must have the form tag=regex'.format(header))
+  patternDict[key] = pattern
+ headerFilter = HeaderFilter(patternDict) if len(patternDict) > 0 else None
+ positionFilter = PositionFilter(args.fen) if args.fen is not None else None
+ count = write_games_parallel(args.pgnFile, args.targetFile, encoding = encoding, targetEncoding = targetEncoding, 
+                                              headerFilter = headerFilter, positionFilter = positionFilter, 
+                                              processes = args.processes, chunkSize = args.chunkSize)
+ print('{} games written to {}'.format(count, args.targetFile))
+
+class IndexedGameList(object):
+ '''A lazy list of the games of an indexed PGN-file or a *GameStore*
+
+Entries are either numbers of games in the index or *chess.pgn.Game* objects (e.g. new games).
+Games are parsed only when accessed by ``gameList[n]``, the most recently used ones are kept
+in a bounded cache. Headers are read without parsing the moves (see *PGNIndex.readHeaders*).
+Pinned games, e.g. the selected or modified ones, are never evicted from the cache.
+
+The list supports *len*, *in*, *index*, *append*, *insert*, iteration and item assignment. 
+The attribute *entries* may be rearranged directly to move or remove games without parsing them.
+*index* looks up the row in a map of the entries, which is rebuilt only if the entries were rearranged.
+Modified games are marked by *setDirty*, so *savePGN* copies the unchanged games verbatim.
+Sorting and filtering use the *HeaderIndex* of the games (see *headerIndex* and *headerEntries*).
+
+:param pgnIndex: index of the PGN-file or a *GameStore*
+:param cacheSize: maximum number of parsed games kept in the cache
+:param headerCacheSize: maximum number of headers kept in the cache
+ '''
+ def __init__(self, pgnIndex : PGNIndex, cacheSize : int = 64, headerCacheSize : int = 4096) -> None:
+  self.pgnIndex = pgnIndex
+  self.cacheSize = cacheSize
+  self.headerCacheSize = headerCacheSize
+  self.entries = list(range(len(pgnIndex)))
+  self.pinnedGames = dict()
+  self.dirtyEntries = set()
+  self.gameCache = collections.OrderedDict()
+  self.headerCache = collections.OrderedDict()
+  self.storeHeaderIndex = None
+  self.parsedEntries = weakref.WeakKeyDictionary()
+  self.rowDict = dict()
+
+ def __getstate__(self) -> dict:
+  return {'pgnFile' : self.pgnIndex.pgnFile, 'encoding' : self.pgnIndex.encoding, 
+              'cacheSize' : self.cacheSize, 'headerCacheSize' : self.headerCacheSize,
+              'entries' : self.entries, 'pinnedGames' : self.pinnedGames, 'dirtyEntries' : self.dirtyEntries}
+
+ def __setstate__(self, state : dict) -> None:
+  self.pgnIndex = PGNIndex.open(state['pgnFile'], encoding = state['encoding'])
+  self.cacheSize = state['cacheSize']
+  self.headerCacheSize = state['headerCacheSize']
+  self.entries = state['entries']
+  self.pinnedGames = state['pinnedGames']
+  self.dirtyEntries = state.get('dirtyEntries', set())
+  self.gameCache = collections.OrderedDict()
+  self.headerCache = collections.OrderedDict()
+  self.storeHeaderIndex = None
+  self.parsedEntries = weakref.WeakKeyDictionary((game, entry) for entry, game in self.pinnedGames.items())
+  self.rowDict = dict()
+
+ def __len__(self) -> int:
+  return len(self.entries)
+
+ def _parse(self, entry : int) -> chess.pgn.Game:
+  if entry in self.pinnedGames:
+   return self.pinnedGames[entry]
+  if entry in self.gameCache:
+   self.gameCache.move_to_end(entry)
+   return self.gameCache[entry]
+  game = self.pgnIndex.readGame(entry)
+  if game is None:
+   raise IOError('IndexedGameList: game #{} (line {}) not readable'.format(entry + 1, self.pgnIndex.lineNumber(entry)))
+  self.gameCache[entry] = game
+  self.parsedEntries[game] = entry
+  if len(self.gameCache) > self.cacheSize:
+   self.gameCache.popitem(last = False)
+  return game
+
+ def __getitem__(self, row : int) -> chess.pgn.Game:
+  entry = self.entries[row]
+  if isinstance(entry, chess.pgn.Game):
+   return entry
+  return self._parse(entry)
+
+ def __setitem__(self, row : int, game : chess.pgn.Game) -> None:
+  self.entries[row] = game
+
+ def __delitem__(self, row : int) -> None:
+  del self.entries[row]
+
+ def __iter__(self) -> Iterator[chess.pgn.Game]:
+  for row in range(len(self.entries)):
+   yield self[row]
+
+ def __contains__(self, game : chess.pgn.Game) -> bool:
+  try:
+   self.index(game)
+  except ValueError:
+   return False
+  return True
+
+ def _entry(self, game : chess.pgn.Game) -> Union[int, chess.pgn.Game]:
+  return self.parsedEntries.get(game, game)
+
+ def index(self, game : chess.pgn.Game) -> int:
+  '''Returns the row of a game already accessed or added
+
+:param game: the game 
+:returns: the row of the game
+  '''
+  entry = self._entry(game)
+  row = self.rowDict.get(entry)
+  if row is None or row >= len(self.entries) or self.entries[row] != entry:
+   self.rowDict = {actEntry : row for row, actEntry in enumerate(self.entries)}
+   row = self.rowDict.get(entry)
+   if row is None:
+    raise ValueError('IndexedGameList: game not in list')
+  return row
+
+ def append(self, game : chess.pgn.Game) -> None:
+  self.entries.append(game)
+
+ def insert(self, row : int, game : chess.pgn.Game) -> None:
+  self.entries.insert(row, game)
+
+ def headers(self, row : int) -> chess.pgn.Headers:
+  '''Returns the headers of a game, parsing only its tag pairs if the game is not cached
+
+:param row: row of the game
+:returns: the headers of the game
+  '''
+  entry = self.entries[row]
+  if isinstance(entry, chess.pgn.Game):
+   return entry.headers
+  if entry in self.pinnedGames:
+   return self.pinnedGames[entry].headers
+  if entry in self.gameCache:
+   return self.gameCache[entry].headers
+  if entry in self.headerCache:
+   self.headerCache.move_to_end(entry)
+   return self.headerCache[entry]
+  headers = self.pgnIndex.readHeaders(entry)
+  self.headerCache[entry] = headers
+  if len(self.headerCache) > self.headerCacheSize:
+   self.headerCache.popitem(last = False)
+  return headers
+
+ def isParsed(self, row : int) -> bool:
+  '''Returns True, if the game of a row is held as parsed game'''
+  entry = self.entries[row]
+  return isinstance(entry, chess.pgn.Game) or entry in self.pinnedGames or entry in self.gameCache
+
+ def pin(self, row : int) -> chess.pgn.Game:
+  '''Parses a game (if required) and protects it from eviction
+
+:param row: row of the game
+:returns: the game
+  '''
+  entry = self.entries[row]
+  if isinstance(entry, chess.pgn.Game):
+   return entry
+  game = self._parse(entry)
+  self.gameCache.pop(entry, None)
+  self.pinnedGames[entry] = game
+  return game
+
+ def release(self, row : int) -> None:
+  '''Allows a pinned game to be evicted from the cache, unless it is modified (see *setDirty*)
+
+:param row: row of the game
+  '''
+  entry = self.entries[row]
+  if not isinstance(entry, chess.pgn.Game) and entry in self.pinnedGames and entry not in self.dirtyEntries:
+   self.gameCache[entry] = self.pinnedGames.pop(entry)
+   if len(self.gameCache) > self.cacheSize:
+    self.gameCache.popitem(last = False)
+
+ def setDirty(self, row : int) -> None:
+  '''Marks the game of a row as modified, the game is pinned (see *pin*)
+
+:param row: row of the game
+  '''
+  entry = self.entries[row]
+  if not isinstance(entry, chess.pgn.Game):
+   self.pin(row)
+   self.dirtyEntries.add(entry)
+
+ def isDirty(self, row : int) -> bool:
+  '''Returns True, if the game of a row is modified or new'''
+  entry = self.entries[row]
+  return isinstance(entry, chess.pgn.Game) or entry in self.dirtyEntries
+
+ def headerIndex(self) -> HeaderIndex:
+  '''Returns the header index of the indexed games
+
+The index of a PGN-file is built while scanning the file (see *PGNIndex.build*), 
+the index of a *GameStore* is built from the stored headers when first requested.
+  '''
+  if isinstance(self.pgnIndex, PGNIndex):
+   return self.pgnIndex.headerIndex
+  if self.storeHeaderIndex is None or len(self.storeHeaderIndex) != len(self.pgnIndex):
+   self.storeHeaderIndex = HeaderIndex.fromHeaders(self.pgnIndex.readHeaders(gameID) for gameID in range(len(self.pgnIndex)))
+  return self.storeHeaderIndex
+
+ def headerEntries(self, rows : Optional[List[int]] = None) -> List[Union[int, chess.pgn.Headers]]:
+  '''Returns the entries for sorting and filtering by the header index (see *HeaderIndex.sortRows*), 
+i.e. the headers of new or modified games replace their entries
+
+:param rows: rows of the entries, defaults to all rows
+:returns: the entries
+  '''
+  if rows is None:
+   rows = range(len(self.entries))
+  entries, dirtyEntries = self.entries, self.dirtyEntries
+  return [entries[row] if entries[row].__class__ is int and entries[row] not in dirtyEntries else self.headers(row) for row in rows]
+
+ @staticmethod
+ def _separator(tail : bytes) -> bytes:
+  if len(tail) == 0 or tail.endswith(b'\n\n') or tail.endswith(b'\n\r\n'):
+   return b''
+  if tail.endswith(b'\n'):
+   return b'\n'
+  return b'\n\n'
+
+ def savePGN(self, pgnFile : str, encoding : str = 'utf-8-sig') -> PGNIndex:
+  '''Writes the games to a PGN-file and returns its index without scanning the file
+
+Games neither modified nor new are copied verbatim from the indexed PGN-file, if both encodings match. 
+If *pgnFile* is the indexed file, the games up to the first moved, removed or modified game are copied 
+as a block. New games behind the unchanged ones are appended to *pgnFile* in place, i.e. appending games 
+takes milliseconds independent of the size of the file. Otherwise the file is written to a temporary file, 
+which replaces *pgnFile* after it is synced to disk, so *pgnFile* is never left partially written. 
+The list has to be reopened with the returned index.
+
+:param pgnFile: path of the PGN-file
+:param encoding: encoding of the PGN-file
+:returns: the index of the PGN-file
+  '''
+  pgnFile = os.path.abspath(pgnFile)
+  bom = codecs.lookup(encoding).name == 'utf-8-sig'
+  textEncoding = 'utf-8' if bom else encoding
+  source = self.pgnIndex if isinstance(self.pgnIndex, PGNIndex) and self.pgnIndex.isValid() else None
+  if source is not None and codecs.lookup(source.encoding).name.replace('utf-8-sig', 'utf-8') != codecs.lookup(textEncoding).name:
+   source = None
+  index = PGNIndex(pgnFile, encoding)
+  keptRows = 0
+  if source is not None and source.pgnFile == pgnFile:
+   while keptRows < min(len(self.entries), len(source)) and self.entries[keptRows] == keptRows \
+    and not self.isDirty(keptRows):
+    keptRows += 1
+   index.offsetArray = source.offsetArray[:keptRows]
+   index.lineArray = source.lineArray[:keptRows]
+   index.headerSizeArray = source.headerSizeArray[:keptRows]
+   index.headerIndex = source.headerIndex.truncated(keptRows)
+   index.errorList = [(gameID, error) for gameID, error in source.errorList if gameID < keptRows]
+   if keptRows == len(self.entries) and keptRows == len(source):
+    return source
+   if keptRows < len(source):
+    offset, _ = source.span(keptRows)
+    line = source.lineArray[keptRows]
+    tail = b''
+   else:
+    offset = source.fileSize
+    line = 1
+    if keptRows > 0:
+     tail = source.readBytes(keptRows - 1)
+     line = source.lineArray[keptRows - 1] + tail.count(b'\n')
+     tail = tail[-2:]
+  else:
+   offset = 0
+   line = 1
+   tail = b''
+  errorDict = dict(source.errorList) if source is not None else dict()
+  appending = source is not None and source.pgnFile == pgnFile and offset == source.fileSize
+  if appending:
+   tmpFile = None
+   f = open(pgnFile, mode = 'r+b')
+   f.seek(offset)
+  else:
+   fd, tmpFile = tempfile.mkstemp(suffix = '.pgn', dir = os.path.dirname(pgnFile))
+   f = open(fd, mode = 'wb')
+  try:
+   with f, open(source.pgnFile if source is not None else os.devnull, mode = 'rb') as sourceFile:
+    position = offset
+    if offset == 0 and bom:
+     f.write(codecs.BOM_UTF8)
+     position += len(codecs.BOM_UTF8)
+    elif not appending:
+     remaining = offset
+     while remaining > 0:
+      data = sourceFile.read(min(remaining, 1048576))
+      if len(data) == 0:
+       raise IOError('IndexedGameList: {} is truncated'.format(source.pgnFile))
+      f.write(data)
+      remaining -= len(data)
+    for row in range(keptRows, len(self.entries)):
+     entry = self.entries[row]
+     separator = self._separator(tail)
+     f.write(separator)
+     position += len(separator)
+     line += separator.count(b'\n')
+     if source is not None and not self.isDirty(row):
+      start, end = source.span(entry)
+      sourceFile.seek(start)
+      data = sourceFile.read(end - start)
+      headerSize = source.headerSizeArray[entry]
+      index.headerIndex.appendFrom(source.headerIndex, entry)
+      if entry in errorDict:
+       index.errorList.append((row, errorDict[entry]))
+     else:
+      exporter = chess.pgn.StringExporter(headers = True, variations = True, comments = True)
+      game = self[row]
+      data = game.accept(exporter).encode(textEncoding, errors = 'replace')
+      index.headerIndex.append(game.headers)
+      headerEnd = data.find(b'\n\n')
+      headerSize = headerEnd + 2 if data.startswith(b'[') and headerEnd >= 0 else 0
+     index.offsetArray.append(position)
+     index.lineArray.append(line)
+     index.headerSizeArray.append(headerSize)
+     f.write(data)
+     position += len(data)
+     line += data.count(b'\n')
+     tail = data[-2:]
+    f.flush()
+    os.fsync(f.fileno())
+   if tmpFile is not None:
+    if os.path.exists(pgnFile):
+     shutil.copymode(pgnFile, tmpFile)
+    os.replace(tmpFile, pgnFile)
+  except BaseException:
+   if tmpFile is not None:
+    os.remove(tmpFile)
+   else:
+    with open(pgnFile, mode = 'r+b') as f:
+     f.truncate(offset)
+   raise
+  stat = os.stat(pgnFile)
+  index.fileSize = stat.st_size
+  index.mtime = stat.st_mtime
+  try:
+   index.save()
+  except OSError:
+   pass
+  return index
+
 # ==================================================================
  
 if __name__ == "__main__":
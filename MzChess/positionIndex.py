@@ -0,0 +1,499 @@
+'''An index of the positions reached in the games of a database (see `chess.polyglot`_) and the opening tree built from it
+
+.. _chess.polyglot: https://python-chess.readthedocs.io/en/latest/polyglot.html
+'''
+
+from typing import Union, Optional, Callable, Iterable, Iterator, List, Tuple
+import os, os.path
+import array
+import bisect
+import pickle
+
+import chess, chess.pgn, chess.polyglot
+
+if __package__:
+ from .pgnParse import SANCache, PGNIndex, HeaderIndex, IndexedGameList, read_game_at
+ from .gameStore import GameStore
+else:
+ from pgnParse import SANCache, PGNIndex, HeaderIndex, IndexedGameList, read_game_at
+ from gameStore import GameStore
+
+class PositionIndex(object):
+ '''An index of the positions of the mainlines of the games of a *PGNIndex* or a *GameStore*
+
+For every game and every position of its mainline, the index stores the *chess.polyglot.zobrist_hash* 
+of the position together with the number of the game, the ply, at which the position occurred first, 
+and the code of the move played in the position (see *moveCode*). 
+The entries are sorted by hash, i.e. the games having reached a position are found by a binary search.
+The index is stored as a sidecar file (*<source file base>.pgnz*), which is rebuilt, if 
+size or modification time of the source file changed.
+
+:param sourceFile: path of the PGN-file or the *GameStore*, ``None`` for an empty index
+ '''
+ version = 2
+ indexSuffix = '.pgnz'
+
+ def __init__(self, sourceFile : Optional[str] = None) -> None:
+  self.sourceFile = os.path.abspath(sourceFile) if sourceFile is not None else None
+  self.hashArray = array.array('Q')
+  self.gameArray = array.array('l')
+  self.plyArray = array.array('H')
+  self.moveArray = array.array('H')
+  self.fileSize = 0
+  self.mtime = 0.
+
+ @staticmethod
+ def _sourceFile(source : Union[PGNIndex, GameStore]) -> str:
+  if isinstance(source, PGNIndex):
+   return source.pgnFile
+  return source.storeFile
+
+ @classmethod
+ def open(cls, source : Union[PGNIndex, GameStore], useSidecar : bool = True, 
+              notify : Optional[Callable[[int], Optional[bool]]] = None) -> Optional['PositionIndex']:
+  '''Returns the position index of a database, loaded from its sidecar file or rebuilt if missing or outdated
+  
+:param source: index of the PGN-file or the *GameStore*
+:param useSidecar: if True, the sidecar file is read and (re-)written
+:param notify: see *build*
+:returns: the index or ``None``, if the build was cancelled
+  '''
+  index = cls(cls._sourceFile(source))
+  if useSidecar and index.load():
+   return index
+  if not index.build(source, notify = notify):
+   return None
+  if useSidecar:
+   try:
+    index.save()
+   except OSError:
+    pass
+  return index
+
+ def indexFile(self) -> str:
+  '''Returns the path of the sidecar file'''
+  return os.path.splitext(self.sourceFile)[0] + self.indexSuffix
+
+ def isValid(self) -> bool:
+  '''Returns True, if size and modification time of the source file match the index'''
+  if self.sourceFile is None:
+   return False
+  try:
+   stat = os.stat(self.sourceFile)
+  except OSError:
+   return False
+  return stat.st_size == self.fileSize and stat.st_mtime == self.mtime
+
+ @staticmethod
+ def moveCode(board : chess.Board, move : Optional[chess.Move]) -> int:
+  '''Returns the 16 bit code of a move played in a position
+
+The code of the move (see *GameStore.encodeMove*) is marked by bit 15, if black is to move.
+
+:param board: the position
+:param move: the move, ``None`` or a null move at the end of a mainline
+:returns: the code, 0 for no move
+  '''
+  if not move:
+   return 0
+  return GameStore.encodeMove(move) | (0 if board.turn == chess.WHITE else 1 << 15)
+
+ @staticmethod
+ def positions(board : chess.Board) -> Iterator[Tuple[int, int, int]]:
+  '''Yields the hashes of the positions of a move stack
+
+:param board: the board after the last move
+:returns: an iterator of (hash, ply, move code) tuples, starting with the root position (ply 0)
+  '''
+  rootBoard = board.root()
+  for ply, move in enumerate(board.move_stack):
+   yield chess.polyglot.zobrist_hash(rootBoard), ply, PositionIndex.moveCode(rootBoard, move)
+   rootBoard.push(move)
+  yield chess.polyglot.zobrist_hash(rootBoard), len(board.move_stack), 0
+
+ @classmethod
+ def gamePly(cls, game : chess.pgn.Game, board : chess.Board) -> Optional[int]:
+  '''Returns the ply, at which a position occurred first on the mainline of a game
+
+:param game: the game
+:param board: the position
+:returns: the ply or ``None``, if the position did not occur
+  '''
+  positionHash = chess.polyglot.zobrist_hash(board)
+  for actHash, ply, _ in cls.positions(game.end().board()):
+   if actHash == positionHash:
+    return ply
+  return None
+
+ def build(self, source : Union[PGNIndex, GameStore], notify : Optional[Callable[[int], Optional[bool]]] = None) -> bool:
+  '''Builds the index by replaying the mainlines of all games
+
+Games of a PGN-file are read without building the game tree (see *chess.pgn.BoardBuilder*) and 
+with a cache of moves of their own, i.e. the index may be built in another thread.
+
+:param source: index of the PGN-file or the *GameStore*
+:param notify: called with the number of games indexed every 1000 games, returning True cancels the build
+:returns: True, if all games are indexed
+  '''
+  stat = os.stat(self.sourceFile)
+  self.fileSize = stat.st_size
+  self.mtime = stat.st_mtime
+  sanCache = SANCache()
+  entryList = list()
+  for gameID in range(len(source)):
+   if isinstance(source, PGNIndex):
+    board = read_game_at(source, gameID, Visitor = chess.pgn.BoardBuilder, sanCache = sanCache)
+   else:
+    board = source.readGame(gameID).end().board()
+   if board is not None:
+    hashSet = set()
+    for positionHash, ply, code in self.positions(board):
+     if positionHash not in hashSet and ply <= 0xffff:
+      hashSet.add(positionHash)
+      entryList.append(positionHash << 80 | gameID << 32 | ply << 16 | code)
+   if notify is not None and (gameID + 1) % 1000 == 0 and notify(gameID + 1):
+    return False
+  entryList.sort()
+  self.hashArray = array.array('Q', [entry >> 80 for entry in entryList])
+  self.gameArray = array.array('l', [(entry >> 32) & 0xffffffffffff for entry in entryList])
+  self.plyArray = array.array('H', [(entry >> 16) & 0xffff for entry in entryList])
+  self.moveArray = array.array('H', [entry & 0xffff for entry in entryList])
+  return True
+
+ def save(self) -> None:
+  '''Writes the index to its sidecar file'''
+  indexDict = {'version' : self.version, 'sourceFile' : self.sourceFile, 
+                     'fileSize' : self.fileSize, 'mtime' : self.mtime, 
+                     'hashArray' : self.hashArray, 'gameArray' : self.gameArray, 'plyArray' : self.plyArray, 
+                     'moveArray' : self.moveArray}
+  with open(self.indexFile(), mode = 'wb') as f:
+   pickle.dump(indexDict, f)
+
+ def load(self) -> bool:
+  '''Reads the index from its sidecar file
+
+:returns: True, if the sidecar file exists and matches the source file
+  '''
+  try:
+   with open(self.indexFile(), mode = 'rb') as f:
+    indexDict = pickle.load(f)
+  except Exception:
+   return False
+  if not isinstance(indexDict, dict) or indexDict.get('version') != self.version or indexDict.get('sourceFile') != self.sourceFile:
+   return False
+  self.fileSize = indexDict['fileSize']
+  self.mtime = indexDict['mtime']
+  if not self.isValid():
+   return False
+  self.hashArray = indexDict['hashArray']
+  self.gameArray = indexDict['gameArray']
+  self.plyArray = indexDict['plyArray']
+  self.moveArray = indexDict['moveArray']
+  return True
+
+ def __len__(self) -> int:
+  return len(self.hashArray)
+
+ def find(self, board : chess.Board) -> List[Tuple[int, int]]:
+  '''Returns the games, which reached a position
+
+:param board: the position
+:returns: a list of (gameID, ply) tuples in the order of the games
+  '''
+  positionHash = chess.polyglot.zobrist_hash(board)
+  start = bisect.bisect_left(self.hashArray, positionHash)
+  end = bisect.bisect_right(self.hashArray, positionHash, start)
+  return [(self.gameArray[n], self.plyArray[n]) for n in range(start, end)]
+
+ def findRows(self, gameList : Union[list, IndexedGameList], board : chess.Board) -> List[Tuple[int, int]]:
+  '''Returns the rows of a game list, whose games reached a position
+
+Unchanged games of an *IndexedGameList* of the indexed database are looked up in the index, 
+all other games (e.g. new or modified ones) are replayed (see *gamePly*).
+
+:param gameList: list of games or *IndexedGameList*
+:param board: the position
+:returns: a list of (row, ply) tuples in the order of the rows
+  '''
+  if isinstance(gameList, IndexedGameList) and self.isValid() and self._sourceFile(gameList.pgnIndex) == self.sourceFile:
+   plyDict = dict(self.find(board))
+   entries, dirtyEntries = gameList.entries, gameList.dirtyEntries
+  else:
+   plyDict, entries, dirtyEntries = dict(), range(len(gameList)), None
+  rowList = list()
+  for row, entry in enumerate(entries):
+   if dirtyEntries is not None and entry.__class__ is int and entry not in dirtyEntries:
+    ply = plyDict.get(entry)
+   else:
+    ply = self.gamePly(gameList[row], board)
+   if ply is not None:
+    rowList.append((row, ply))
+  return rowList
+
+class OpeningTree(object):
+ '''Move statistics of the positions of the mainlines of a database
+
+For every position up to *maxPly* and every move played in it, the tree stores the number of games, 
+the number of finished games, the points scored by the side to move (in half points) and the sum and number of 
+the Elo ratings of the side to move. The table is aggregated from a *PositionIndex* and a *HeaderIndex* and sorted 
+by hash, i.e. the moves of a position are found by a binary search. Like the position index, a position is counted
+once per game. The table is stored as a sidecar file (*<source file base>.pgnt*).
+
+New, modified and removed games are recorded by *updateGame* or *synchronize*, their contributions are kept 
+in a table of differences, so the aggregated table is never rewritten.
+
+:param sourceFile: path of the PGN-file or the *GameStore*, ``None`` for an empty tree
+:param maxPly: maximum number of plies of the positions
+ '''
+ version = 1
+ treeSuffix = '.pgnt'
+ resultPoints = {'1-0' : 2, '1/2-1/2' : 1, '0-1' : 0}
+
+ def __init__(self, sourceFile : Optional[str] = None, maxPly : int = 40) -> None:
+  self.sourceFile = sourceFile
+  self.maxPly = maxPly
+  self.gameCount = 0
+  self.fileSize = 0
+  self.mtime = 0.
+  self.hashArray = array.array('Q')
+  self.moveArray = array.array('H')
+  self.countArray = array.array('l')
+  self.finishedArray = array.array('l')
+  self.pointArray = array.array('q')
+  self.eloSumArray = array.array('q')
+  self.eloCountArray = array.array('l')
+  self.deltaDict = dict()
+  self.gameContributions = dict()
+  self.entryCount = None
+
+ @classmethod
+ def open(cls, positionIndex : PositionIndex, headerIndex : HeaderIndex, maxPly : int = 40, useSidecar : bool = True, 
+              notify : Optional[Callable[[int], Optional[bool]]] = None) -> Optional['OpeningTree']:
+  '''Returns the opening tree of a database, loaded from its sidecar file or rebuilt if missing or outdated
+  
+:param positionIndex: the position index of the database
+:param headerIndex: the header index of the database
+:param maxPly: maximum number of plies of the positions
+:param useSidecar: if True, the sidecar file is read and (re-)written
+:param notify: see *build*
+:returns: the tree or ``None``, if the build was cancelled
+  '''
+  tree = cls(positionIndex.sourceFile, maxPly = maxPly)
+  if useSidecar and tree.load(positionIndex):
+   return tree
+  if not tree.build(positionIndex, headerIndex, notify = notify):
+   return None
+  if useSidecar:
+   try:
+    tree.save()
+   except OSError:
+    pass
+  return tree
+
+ def treeFile(self) -> str:
+  '''Returns the path of the sidecar file'''
+  return os.path.splitext(self.sourceFile)[0] + self.treeSuffix
+
+ def _appendStatistics(self, positionHash : int, statDict : dict) -> None:
+  for code in sorted(statDict):
+   count, finished, points, eloSum, eloCount = statDict[code]
+   self.hashArray.append(positionHash)
+   self.moveArray.append(code)
+   self.countArray.append(count)
+   self.finishedArray.append(finished)
+   self.pointArray.append(points)
+   self.eloSumArray.append(eloSum)
+   self.eloCountArray.append(eloCount)
+
+ def build(self, positionIndex : PositionIndex, headerIndex : HeaderIndex, notify : Optional[Callable[[int], Optional[bool]]] = None) -> bool:
+  '''Builds the tree from the entries of a position index
+
+:param positionIndex: the position index of the database
+:param headerIndex: the header index of the database, providing results and Elo ratings
+:param notify: called with the number of index entries processed every 2\\ :sup:`20` entries, returning True cancels the build
+:returns: True, if all entries are processed
+  '''
+  self.__init__(positionIndex.sourceFile, maxPly = self.maxPly)
+  self.gameCount = len(headerIndex)
+  self.fileSize = positionIndex.fileSize
+  self.mtime = positionIndex.mtime
+  pointsList = [self.resultPoints.get(value, -1) for value in headerIndex.values['Result']]
+  gamePoints = array.array('b', [pointsList[code] for code in headerIndex.codeArrays['Result']])
+  whiteElos, blackElos = headerIndex.numberArrays['WhiteElo'], headerIndex.numberArrays['BlackElo']
+  hashArray, gameArray, plyArray, moveArray = positionIndex.hashArray, positionIndex.gameArray, positionIndex.plyArray, positionIndex.moveArray
+  lastHash, statDict = None, dict()
+  for n in range(len(hashArray)):
+   if notify is not None and (n + 1) % (1 << 20) == 0 and notify(n + 1):
+    return False
+   code = moveArray[n]
+   if code == 0 or plyArray[n] >= self.maxPly:
+    continue
+   if hashArray[n] != lastHash:
+    self._appendStatistics(lastHash, statDict)
+    lastHash, statDict = hashArray[n], dict()
+   stat = statDict.get(code)
+   if stat is None:
+    stat = statDict[code] = [0, 0, 0, 0, 0]
+   gameID = gameArray[n]
+   stat[0] += 1
+   points = gamePoints[gameID]
+   if points >= 0:
+    stat[1] += 1
+    stat[2] += 2 - points if code & 1 << 15 else points
+   elo = blackElos[gameID] if code & 1 << 15 else whiteElos[gameID]
+   if elo > 0:
+    stat[3] += elo
+    stat[4] += 1
+  self._appendStatistics(lastHash, statDict)
+  return True
+
+ def save(self) -> None:
+  '''Writes the aggregated table to its sidecar file'''
+  treeDict = {'version' : self.version, 'sourceFile' : self.sourceFile, 'maxPly' : self.maxPly, 'gameCount' : self.gameCount,
+                    'fileSize' : self.fileSize, 'mtime' : self.mtime, 
+                    'hashArray' : self.hashArray, 'moveArray' : self.moveArray, 'countArray' : self.countArray, 
+                    'finishedArray' : self.finishedArray, 'pointArray' : self.pointArray, 
+                    'eloSumArray' : self.eloSumArray, 'eloCountArray' : self.eloCountArray}
+  with open(self.treeFile(), mode = 'wb') as f:
+   pickle.dump(treeDict, f)
+
+ def load(self, positionIndex : PositionIndex) -> bool:
+  '''Reads the aggregated table from its sidecar file
+
+:param positionIndex: the position index of the database
+:returns: True, if the sidecar file exists and matches the position index and *maxPly*
+  '''
+  try:
+   with open(self.treeFile(), mode = 'rb') as f:
+    treeDict = pickle.load(f)
+  except Exception:
+   return False
+  if not isinstance(treeDict, dict) or treeDict.get('version') != self.version or treeDict.get('sourceFile') != positionIndex.sourceFile \
+     or treeDict.get('maxPly') != self.maxPly or treeDict.get('fileSize') != positionIndex.fileSize or treeDict.get('mtime') != positionIndex.mtime:
+   return False
+  for key in ('gameCount', 'fileSize', 'mtime', 'hashArray', 'moveArray', 'countArray', 'finishedArray', 'pointArray', 'eloSumArray', 'eloCountArray'):
+   setattr(self, key, treeDict[key])
+  return True
+
+ def __len__(self) -> int:
+  return len(self.hashArray)
+
+ def contribution(self, game : Optional[chess.pgn.Game]) -> list:
+  '''Returns the statistics a game contributes to the tree
+
+:param game: the game or ``None``
+:returns: a list of (hash, move code, count, finished, points, Elo sum, Elo count) tuples
+  '''
+  if game is None:
+   return list()
+  points = self.resultPoints.get(game.headers.get('Result', '*'), -1)
+  whiteElo = HeaderIndex.number('WhiteElo', game.headers.get('WhiteElo', '?'))
+  blackElo = HeaderIndex.number('BlackElo', game.headers.get('BlackElo', '?'))
+  hashSet = set()
+  contributionList = list()
+  for positionHash, ply, code in PositionIndex.positions(game.end().board()):
+   if ply >= self.maxPly:
+    break
+   if positionHash in hashSet:
+    continue
+   hashSet.add(positionHash)
+   if code == 0:
+    continue
+   isBlack = code & 1 << 15
+   elo = blackElo if isBlack else whiteElo
+   contributionList.append((positionHash, code, 1, 1 if points >= 0 else 0, 
+                            (2 - points if isBlack else points) if points >= 0 else 0, elo, 1 if elo > 0 else 0))
+  return contributionList
+
+ def _addContribution(self, contributionList : list, sign : int) -> None:
+  for positionHash, code, *stat in contributionList:
+   moveDict = self.deltaDict.setdefault(positionHash, dict())
+   delta = moveDict.setdefault(code, [0, 0, 0, 0, 0])
+   for n, value in enumerate(stat):
+    delta[n] += sign*value
+
+ def hasGame(self, key : Union[int, chess.pgn.Game]) -> bool:
+  '''Returns True, if the contribution of a game is recorded by *updateGame*'''
+  return key in self.gameContributions
+
+ def updateGame(self, key : Union[int, chess.pgn.Game], game : Optional[chess.pgn.Game], originalGame : Optional[chess.pgn.Game] = None) -> None:
+  '''Records a new, modified or removed game
+
+:param key: number of an indexed game or the game object of a new game
+:param game: the actual game, ``None`` if removed
+:param originalGame: the indexed game as counted in the aggregated table, used on the first update of an indexed game
+  '''
+  if key in self.gameContributions:
+   self._addContribution(self.gameContributions[key] or list(), -1)
+  elif originalGame is not None:
+   self._addContribution(self.contribution(originalGame), -1)
+  contributionList = self.contribution(game)
+  self._addContribution(contributionList, 1)
+  if game is None and key.__class__ is not int:
+   self.gameContributions.pop(key, None)
+  else:
+   self.gameContributions[key] = contributionList if game is not None else None
+
+ def synchronize(self, gameList : Union[list, IndexedGameList], changedRows : Iterable[int] = ()) -> None:
+  '''Records the changes of a game list
+
+Modified games are passed by their rows. The list is searched for new and removed games, 
+if its length changed since the last call (or on the first call).
+
+:param gameList: list of games or *IndexedGameList* of the database
+:param changedRows: rows of the modified games
+  '''
+  isIndexed = isinstance(gameList, IndexedGameList)
+  entries = gameList.entries if isIndexed else gameList
+  if self.entryCount is None and isIndexed:
+   changedRows = [row for row, entry in enumerate(entries) if entry.__class__ is int and entry in gameList.dirtyEntries]
+  for row in changedRows:
+   entry = entries[row]
+   if entry.__class__ is int:
+    self.updateGame(entry, gameList[row], None if entry in self.gameContributions else gameList.pgnIndex.readGame(entry))
+   else:
+    self.updateGame(entry, entry)
+  if len(entries) == self.entryCount:
+   return
+  self.entryCount = len(entries)
+  presentIDs, presentGames = set(), set()
+  for row, entry in enumerate(entries):
+   if entry.__class__ is int:
+    presentIDs.add(entry)
+    if entry in self.gameContributions and self.gameContributions[entry] is None:
+     self.updateGame(entry, gameList[row])
+   else:
+    presentGames.add(entry)
+    if entry not in self.gameContributions:
+     self.updateGame(entry, entry)
+  for key in [key for key in self.gameContributions if key.__class__ is not int and key not in presentGames]:
+   self.updateGame(key, None)
+  removedCount = sum(1 for contributionList in self.gameContributions.values() if contributionList is None)
+  if isIndexed and len(presentIDs) + removedCount < self.gameCount:
+   for gameID in range(self.gameCount):
+    if gameID not in presentIDs and self.gameContributions.get(gameID, True) is not None:
+     self.updateGame(gameID, None, None if gameID in self.gameContributions else gameList.pgnIndex.readGame(gameID))
+
+ def statistics(self, board : chess.Board) -> List[Tuple[chess.Move, int, Optional[float], Optional[int]]]:
+  '''Returns the moves played in a position
+
+:param board: the position
+:returns: a list of (move, number of games, score of the side to move, average Elo of the side to move) tuples, 
+   sorted by the number of games (descending) and move, score and average Elo are ``None`` if unknown
+  '''
+  positionHash = chess.polyglot.zobrist_hash(board)
+  start = bisect.bisect_left(self.hashArray, positionHash)
+  end = bisect.bisect_right(self.hashArray, positionHash, start)
+  statDict = {self.moveArray[n] : [self.countArray[n], self.finishedArray[n], self.pointArray[n], self.eloSumArray[n], self.eloCountArray[n]] 
+                   for n in range(start, end)}
+  for code, delta in self.deltaDict.get(positionHash, dict()).items():
+   stat = statDict.setdefault(code, [0, 0, 0, 0, 0])
+   for n, value in enumerate(delta):
+    stat[n] += value
+  statList = list()
+  for code, (count, finished, points, eloSum, eloCount) in statDict.items():
+   if count > 0:
+    statList.append((GameStore.decodeMove(code), count, 
+                     points/(2*finished) if finished > 0 else None, round(eloSum/eloCount) if eloCount > 0 else None))
+  statList.sort(key = lambda stat: (-stat[1], stat[0].uci()))
+  return statList
@@ -155,7 +155,12 @@ class QBoardViewClass(QtWidgets.QGraphicsView):
 :param gameNode : game node to be displayed
   '''
   self.game.setGameNode(gameNode)
-  
+
+ def board(self) -> chess.Board:
+  '''Returns the position of the game node displayed by the *chessBoard*
+  '''
+  return self.game.gameNode.board()
+
  def nextMove(self) -> None:
   '''Go 1 move forward, if possible
   '''
@@ -250,6 +255,7 @@ class Game(QtWidgets.QGraphicsScene):
   self.engine = None
   self.hint = False
   self.score = False
+  self.hintDepth = None
   self.drawOptions = False
   self.warnOfDanger = False
   self.materialLabel = None
@@ -526,6 +532,7 @@ class Game(QtWidgets.QGraphicsScene):
   if self.needHint() or self.score:
    self.hintFen = None
    self.engine.bestMoveScoreSignal.connect(self.bestMoveScoreAvailable)
+   self.engine.infoSignal.connect(self.infoAvailable)
    self.requestHint.emit(self.fen())
   else:
    self.hintLabel.setText('-/-')
@@ -543,9 +550,17 @@ class Game(QtWidgets.QGraphicsScene):
  def flushHint(self) -> None:
   fen = self.fen()
   if self.hintFen != fen and self.engine is not None and self.engine.uciNewGame(fen):
+   self.hintDepth = None
    self.engine.startPlay()
    self.hintFen = fen
 
+ @QtCore.pyqtSlot(dict)
+ def infoAvailable(self, info):
+  if self.hintLabel is None or not self.score or info.get('multipv', 1) != 1 or info.get('depth') == self.hintDepth:
+   return
+  self.hintDepth = info.get('depth')
+  self.hintLabel.setText('.../{} (depth {})'.format(self.engine.infoScore(info), self.hintDepth))
+
  @QtCore.pyqtSlot(chess.Move, str)
  def bestMoveScoreAvailable(self, move, score):
   if self.hintLabel is not None:
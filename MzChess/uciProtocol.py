@@ -0,0 +1,519 @@
+'''The transport independent part of the Universal Chess Interface (`UCI`_)
+
+*UCIProtocol* parses the output of an engine and builds its commands. 
+It is shared by the Qt based *ChessEngine* and the asyncio based *AsyncChessEngine*.
+
+.. _UCI: http://wbec-ridderkerk.nl/html/UCIProtocol.html
+'''
+
+from typing import Any, Dict, Callable, Iterable, List, Optional, Tuple, Union
+
+import chess
+import chess.engine
+
+class UCIProtocol(object):
+ '''Mixin implementing the UCI commands and the parser of the engine's responses
+
+The derived class provides the transport, i.e. the method *_toStdin* sending a command 
+and a call of *_processLine* for each line received from the engine. It may override 
+*_infoAvailable* to report the progress of a search. It initializes the attributes *board*, 
+*limit*, *playResult*, *readyok*, *isrunning*, *stdoutLines*, *infoDict*, *optionValues* and *notify* (see *setLog*).
+With an *AnalysisCache* (see *setAnalysisCache*) a cached result is delivered by *_scheduleCachedResult* 
+instead of a search, synchronously unless the derived class defers it to its event loop.
+ '''
+ analysisCache = None
+ cacheKey = None
+
+ def setLog(self, log : Optional[Callable[[str], None]] = None) -> None:
+  '''Sets the log for engine's commands
+
+:param log: log for the engine's commands, default = None  
+  '''
+  if isinstance(log, bool):
+   if log:
+    self.notify = print
+   else:
+    self.notify = None
+  else:
+   self.notify = log
+
+ def getScore(self, hintID : int = 0) -> Optional[int]:
+  '''Delivers the score for a hint, if available
+
+:param hintID: hint, i.e. alternative to be used (0 for best move)
+:returns: score in centipawns or ``None``
+  '''
+  infoList = self.getInfoList()
+  if hintID >= len(infoList):
+   return None
+  return self.infoScore(infoList[hintID])
+
+ def getInfoList(self) -> List[Dict[str, Any]]:
+  '''Delivers the *info* of every hint of the last search
+
+*playResult.info* is a single *info* for one hint (like ``chess.engine``) and a list otherwise.
+
+:returns: list of *info*, best move first
+  '''
+  if self.playResult is None or 'info' not in vars(self.playResult):
+   return list()
+  if isinstance(self.playResult.info, dict):
+   return [self.playResult.info]
+  return list(self.playResult.info)
+
+ @staticmethod
+ def infoScore(info : Dict[str, Any]) -> Optional[str]:
+  '''Delivers the score of an *info* from White's point of view
+
+:param info: *info* of a search (see *playResult* and *_infoAvailable*)
+:returns: score in centipawns, a mate score like *#3* or ``None``
+  '''
+  if 'score' not in info:
+   return None
+  score = info['score'].white()
+  if isinstance(score, chess.engine.Cp):
+   score = '{}'.format(score.score())
+  elif score is not None:
+   score = str(score)
+  return score
+  
+ def _log(self, txt : str) -> None:
+  if self.notify is not None:
+   self.notify(txt)
+
+ def _processLine(self, line : str) -> bool:
+  '''Evaluates a single line received from the engine
+
+*info* lines are parsed immediately and only the latest *info* of each *multipv* slot is kept in *infoDict*, 
+i.e. the memory does not grow with the length of a search. Sets *bestMoveScore* to the pair of best move 
+and score of a finished search, otherwise to ``None``.
+
+:param line: line without line end
+:returns: True, if the engine became ready, i.e. after *uciok*, *readyok* or *bestmove*
+  '''
+  self.bestMoveScore = None
+  tokens = line.split(" ")
+  report = tokens.pop(0)
+  if report == 'info':
+   self._parseInfo(tokens)
+   return False
+  elif report == 'bestmove':
+   self._parseResult(tokens)
+   if self.cacheKey is not None:
+    self.analysisCache.put(self.cacheKey, self.playResult)
+    self.cacheKey = None
+   self._setBestMoveScore()
+  elif report == 'uciok':
+   self._parseHeader()
+  elif report != 'readyok':
+   if len(line.strip(' ')) > 0:
+    self.stdoutLines.append(line)
+   return False
+  self.readyok = True
+  self.stdoutLines = list()
+  return True
+
+ def _setBestMoveScore(self) -> None:
+  score = self.getScore(hintID = 0)
+  if len(self.playResult.info) == 1: 
+   self.playResult.info = self.playResult.info[0]
+  if self.playResult.move is not None:
+   self.bestMoveScore = (self.playResult.move, score)
+  elif score is not None:
+   self.bestMoveScore = (chess.Move.null(), score)
+
+ def _processCachedResult(self) -> bool:
+  '''Completes a search answered by the *AnalysisCache*, the counterpart of *_processLine* for *bestmove*
+
+:returns: True, if the engine became ready
+  '''
+  self.bestMoveScore = None
+  if self.readyok or self.playResult is None:
+   return False
+  self._setBestMoveScore()
+  self.readyok = True
+  return True
+
+ def _scheduleCachedResult(self) -> None:
+  '''Called by *uciGo* for a cached result, which is completed immediately, i.e. *uciGo* returns 
+with the result available. Derived classes may call *_processCachedResult* from their event loop instead 
+and report the result like a finished search
+  '''
+  self._processCachedResult()
+
+ def setAnalysisCache(self, analysisCache : Optional[Any] = None) -> None:
+  '''Sets the cache looked up before each search and filled with each result (see *AnalysisCache*)
+
+:param analysisCache: cache shared with other engines, ``None`` disables caching
+  '''
+  self.analysisCache = analysisCache
+  self.cacheKey = None
+
+ def _infoAvailable(self, info : Dict[str, Any]) -> None:
+  '''Called for each *info* with a score stored in *infoDict*, derived classes report the progress of a search
+
+:param info: parsed *info* line
+  '''
+  pass
+
+ #  Parser --------------------------------------------------------------------------------------
+
+ def _parseHeader(self) -> None:
+  self.idDict = dict()
+  self.optionsDict = dict()
+  for line in self.stdoutLines:
+   tokens = line.split(" ")
+   report = tokens.pop(0)
+   if report == 'id':
+    key = tokens.pop(0)
+    if key != 'name' and key != 'author':
+     raise ValueError("UIE: Unknown {} in header (expected name or author)".format(key))
+    self.idDict[key] = ' '.join(tokens)
+   elif report == 'option':
+    self._parseOption(tokens)
+   elif len(report.strip(' ')) > 0 and report != 'uciok':
+    self._log("Extra line '{}'".format(line))
+
+ def _parseOption(self, tokens) -> None:
+  optDict = dict()
+  minValue = None 
+  maxValue = None
+  name = None
+  vtype = None
+  while tokens:
+   key = tokens.pop(0)
+   if key == 'name':
+    nameList = list()
+    while tokens:
+     part = tokens[0]
+     if part in  ['type', 'default', 'min', 'max', 'var']:
+      break
+     tokens.pop(0)
+     nameList.append(part)
+    name = ' '.join(nameList)
+   elif key == 'type':
+    vtype = tokens.pop(0)
+    if vtype not in ['check', 'spin', 'combo', 'button', 'string']:
+     raise ValueError("UIE: Unexpected option type '{}'".format(vtype))
+    if vtype == 'combo':
+     optDict['varList'] = list()
+    optDict[key] = vtype
+   elif key == 'default':
+    value = tokens.pop(0)
+    if vtype == 'spin':
+     optDict[key] = int(value)
+    elif value == 'check':
+     optDict[key] = value == 'true'
+    else:
+     optDict[key] = value
+   elif key == 'min':
+    minValue =  int(tokens.pop(0)) 
+   elif key == 'max':
+    maxValue =  int(tokens.pop(0)) 
+   elif key == 'var':
+    if 'varList' not in optDict:
+     raise ValueError("UIE: var found, not type 'combo' ?!?")
+    optDict['varList'].append(tokens.pop(0))
+   elif key == 'string':
+    if len(tokens) > 0:
+     value = tokens.pop(0)
+    else:
+     value = ''
+    if value == '<empty>':
+     value = ''
+    optDict[key] = value
+  if name is None or vtype is None:
+   raise ValueError("UIE: name and/or type record missing")
+  if vtype == 'spin' and minValue is not None and maxValue is not None:
+   optDict['range'] = range(minValue, maxValue+1)
+  self.optionsDict[name] = optDict
+
+ def _parseInfo(self, tokens : List[str]) -> None:
+  info, depth = self._parseInfoline(tokens, 0)
+  if depth is None or len(info) == 0 or 'score' not in info:
+   return
+  slot = info.get('multipv', 1)
+  actInfo = self.infoDict.get(slot)
+  if ('lowerbound' in info or 'upperbound' in info) and actInfo is not None and actInfo.get('depth') == depth \
+     and not ('lowerbound' in actInfo or 'upperbound' in actInfo):
+   return
+  self.infoDict[slot] = info
+  self._infoAvailable(info)
+
+ def _parseResult(self, tokens : List[str]) -> None:
+  self.playResult = chess.engine.PlayResult(None, None, draw_offered = None, resigned = None)
+  self.playResult.info = [self.infoDict[slot] for slot in sorted(self.infoDict)]
+  self.infoDict = dict()
+  try:
+   self.playResult.move = chess.Move.from_uci(tokens.pop(0))
+  except:
+   self.playResult.move = None
+  if len(tokens) > 0 and tokens.pop(0) == 'ponder':
+   try:
+    self.playResult.ponder = chess.Move.from_uci(tokens.pop(0))
+   except:
+    self.playResult.ponder = None 
+
+ def _parseInfoline(self, tokens, depth) -> Tuple[Dict[str, Any], int]:
+   info = dict()
+   actDepth = None
+   while tokens:
+    parameter = tokens.pop(0)
+    if parameter == "string":
+     info["string"] = " ".join(tokens)
+     return dict(), depth
+    elif parameter == "depth":
+     actDepth = int(tokens.pop(0))
+     info[parameter] = actDepth
+    elif parameter in ["seldepth", "nodes", "multipv", "currmovenumber", "hashfull", "nps", "tbhits", "cpuload"]:
+     info[parameter] = int(tokens.pop(0))  # type: ignore
+    elif parameter == "time":
+     info["time"] = int(tokens.pop(0)) // 1000.0
+    elif parameter == "ebf":
+     info["ebf"] = float(tokens.pop(0))
+    elif parameter == "score":
+     kind = tokens.pop(0)
+     value = tokens.pop(0)
+     if tokens and tokens[0] in ["lowerbound", "upperbound"]:
+      info[tokens.pop(0)] = True  # type: ignore
+     if kind == "cp":
+      info["score"] = chess.engine.PovScore(chess.engine.Cp(int(value)), self.board.turn)
+     elif kind == "mate":
+      info["score"] = chess.engine.PovScore(chess.engine.Mate(int(value)), self.board.turn)
+     else:
+      raise ValueError("UIE: Unknown score kind {} in info (expected cp or mate)".format(kind))
+    elif parameter == "currmove":
+     info["currmove"] = chess.Move.from_uci(tokens.pop(0))
+    elif parameter == "currline":
+     cpunr = int(tokens.pop(0))
+     currline = list()
+     for n in range(cpunr):
+      currline.append(tokens.pop(0))
+     info["currline"] = currline
+    elif parameter == "refutation":
+     info["refutation"] = []
+     while tokens:
+      try:
+       move = chess.Move.from_uci(tokens[0])
+       tokens.pop(0)
+       info["refutation"].append(move)
+      except:
+       break
+    elif parameter == "pv":
+     info["pv"] = list()
+     while tokens:
+      try:
+       move = chess.Move.from_uci(tokens[0])
+       tokens.pop(0)
+       info["pv"].append(move)
+      except:
+       break
+    elif parameter == "wdl":
+     info["wdl"] = chess.engine.PovWdl(chess.engine.Wdl(int(tokens.pop(0)), int(tokens.pop(0)), int(tokens.pop(0))), self.board.turn)
+   return info, actDepth
+
+ #  Methods for use  --------------------------------------------------------------------------------------
+
+ def uciNewGame(self, fen : Optional[str] = None, moves : List[chess.Move] = []) -> bool:
+  '''Wrapper for the UCI *ucinewgame* command
+
+:param fen: starting position in Forsyth-Edwards-Notation (FEN)
+:param moves: list of moves to be applied
+:returns: boolean indicating the success
+  '''
+  self.playResult = None
+  if not self._toStdin('ucinewgame'):
+   return False
+  builder = ["position"]
+  if fen is not None:
+   self.board.set_fen(fen)
+   builder.append("fen")
+   builder.append(fen)
+  else:
+   self.board.set_fen(chess.STARTING_FEN)
+   builder.append("startpos")
+  if len(moves) > 0:
+   builder.append("moves")
+  for move in moves:
+   self.board.push(move)
+   builder.append(move.uci())
+  self.readyok = True
+  self._toStdin(' '.join(builder))
+  self.readyok = True
+  return True
+
+ def uciSetOption(self, name : str, value : Union[bool, int,  str, None]) -> bool:
+  '''Wrapper for the UCI *setoption* command
+
+:param name: name of the option
+:param value: value, type depends on name
+:returns: boolean indicating the success
+  '''
+  if name not in self.optionsDict:
+   raise ValueError('ChessEngine/setOption: {} is not a valid option name'.format(name))
+  optDict = self.optionsDict[name]
+  optType = optDict['type']
+  builder = ['setoption']
+  builder.append('name')
+  builder.append(name)
+  builder.append('value')
+  if optType == 'button' and value is not None:
+    raise ValueError('ChessEngine/setOption: option name {} expects no value'.format(name))
+  elif optType == 'check':
+   if not isinstance(value, bool):
+    raise ValueError('ChessEngine/setOption: option name {} expects an boolean value'.format(name))
+   builder.append(['false', 'true'][value])
+  elif optType == 'spin':
+   if isinstance(value, str):
+    value = int(value)
+   if 'range' in optDict and value not in optDict['range']:
+    raise ValueError('ChessEngine/setOption: option name {}: value {} not in range {}'.format(name, value, optDict['range']))
+   builder.append(str(value))
+  elif optType == 'combo':
+   if not isinstance(value, str):
+    raise ValueError('ChessEngine/setOption: option name {} expects an string value'.format(name))
+   if 'varList' in optDict and value not in optDict['varList']:
+    raise ValueError('ChessEngine/setOption: option name {}: value {} not in list {}'.format(name, value, optDict['varList']))
+   builder.append(value)
+  elif optType == 'string':
+   if not isinstance(value, str):
+    raise ValueError('ChessEngine/setOption: option name {} expects an string value'.format(name))
+   if len(value) == 0:
+    value = '<empty>'
+   builder.append(value)
+  if self._toStdin(' '.join(builder)):
+   self.readyok = True
+   self.optionValues[name] = value
+  return self.readyok
+
+ def uciGo(self, search_moves : Optional[Iterable[chess.Move]] = None, ponder : bool = False, infinite : bool = False) -> bool:
+  '''Wrapper for the UCI *go* command
+
+:param search_moves: list of moves to be searched
+:param ponder: suggest a response to the *best-move*
+:param infinite: improve the *best-move* continuously
+:returns: boolean indicating the success
+  '''
+  builder = ["go"]
+  if ponder:
+   builder.append("ponder")
+  if self.limit.white_clock is not None:
+   builder.append("wtime")
+   builder.append(str(max(1, int(self.limit.white_clock * 1000))))
+  if self.limit.black_clock is not None:
+   builder.append("btime")
+   builder.append(str(max(1, int(self.limit.black_clock * 1000))))
+  if self.limit.white_inc is not None:
+   builder.append("winc")
+   builder.append(str(int(self.limit.white_inc * 1000)))
+  if self.limit.black_inc is not None:
+   builder.append("binc")
+   builder.append(str(int(self.limit.black_inc * 1000)))
+  if self.limit.remaining_moves is not None and int(self.limit.remaining_moves) > 0:
+   builder.append("movestogo")
+   builder.append(str(int(self.limit.remaining_moves)))
+  if self.limit.depth is not None:
+   builder.append("depth")
+   builder.append(str(max(1, int(self.limit.depth))))
+  if self.limit.nodes is not None:
+   builder.append("nodes")
+   builder.append(str(max(1, int(self.limit.nodes))))
+  if self.limit.mate is not None:
+   builder.append("mate")
+   builder.append(str(max(1, int(self.limit.mate))))
+  if self.limit.time is not None:
+   builder.append("movetime")
+   builder.append(str(max(1, int(self.limit.time * 1000))))
+  if infinite:
+   builder.append("infinite")
+  if search_moves is not None:
+   builder.append("searchmoves")
+   builder.extend(move.uci() for move in search_moves)
+  self.infoDict = dict()
+  self.cacheKey = None
+  if self.analysisCache is not None and search_moves is None and not (ponder or infinite):
+   engineName = self.idDict.get('name', '') if 'idDict' in vars(self) else ''
+   cacheKey = self.analysisCache.key(self.board, engineName, self.optionValues, self.limit)
+   playResult = self.analysisCache.get(cacheKey)
+   if playResult is not None:
+    if not self.readyok:
+     return False
+    self._log('UCIProtocol/uciGo: cached {}'.format(' '.join(builder)))
+    self.readyok = False
+    self.playResult = playResult
+    self._scheduleCachedResult()
+    return True
+   self.cacheKey = cacheKey
+  if not self._toStdin(' '.join(builder)):
+   self.cacheKey = None
+   return False
+
+  if infinite:
+   self.isrunning = True
+   self.readyok = True
+  return True
+
+ def uciStop(self) -> bool:
+  '''Wrapper for the UCI *stop* command to stop an infinite *go*
+
+:returns: boolean indicating the success
+  '''
+  if not self.isrunning:
+   return False
+  return self._toStdin('stop')
+
+ def uciQuit(self) -> None:
+  'Terminate the engine'
+  self._toStdin('quit')
+
+ #  chess.engine like calls  --------------------------------------------------------------------------------------
+
+ def startPlay(self) -> bool:
+  '''Emits *uciGO* in *play* mode, i.e.g
+  
+  * *UCI_AnalyseMode = off*
+  * *MultiPV = 1*, i.e. no alternative move suggestions
+
+:returns: boolean indicating the success
+  '''
+  if 'MultiPV' in self.optionsDict:
+   if not self.uciSetOption('MultiPV', 1):
+    return False
+  if 'UCI_AnalyseMode' in self.optionsDict:
+   if not self.uciSetOption('UCI_AnalyseMode', False):
+    return False
+  return self.uciGo()
+
+ def startAnalysis(self, multiPV : int = 1) -> bool:
+  '''Emits *uciGO* in *analyse* mode, i.e.
+  
+  * *UCI_AnalyseMode = off*
+  * *MultiPV =* ``multiPV``
+
+:param multiPV: number of alternative move suggestions
+:returns: boolean indicating the success
+  '''
+  if 'MultiPV' in self.optionsDict:
+   if not self.uciSetOption('MultiPV', max(1, multiPV)):
+    return False
+  if 'UCI_AnalyseMode' in self.optionsDict:
+   if not self.uciSetOption('UCI_AnalyseMode', True):
+    return False
+  return self.uciGo()
+
+ def setELO(self, elo : Union[int, str]) -> bool:
+  if not ('UCI_Elo' in self.optionsDict and 'UCI_LimitStrength' in self.optionsDict):
+   return False
+  eloDict = self.optionsDict['UCI_Elo']
+  if elo == 'max':
+   elo =eloDict['range'].stop - 1
+  elif elo == 'min':
+   elo = eloDict['range'].start
+  if elo not in eloDict['range']:
+   raise ValueError('ChessEngine: elo {} not in {}'.format(elo, eloDict['range']))
+  if not self.uciSetOption('UCI_Elo', elo):
+   return False
+  if not self.uciSetOption('UCI_LimitStrength', True):
+   return False
+  self.readyok = True
+  return True
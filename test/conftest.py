@@ -21,7 +21,7 @@ def pytest_addoption(parser):
  parser.addoption("--uciEngine", action="store", help = "Executable")
  parser.addoption("--FEN", action="store", help = "FEN")
  parser.addoption("--target",  action="store",  default = 'g', 
-   help="target(s) of parsing (g - games, h - headers, s - skip every second game, b - board, l - lexical analysis only)")
+   help="target(s) of parsing (g - games, h - headers, s - skip every second game, b - board, l - lexical analysis only, i - game index, d - game store, p - parallel parsing, r - interleaved readers)")
  parser.addoption("--encoding",  metavar = 'encoding',  default = 'u', 
    choices=['u', 'utf-8-sig', 'i', 'iso-8859-1', 'a', 'ascii'], 
    help="encoding of pgnFile (u - utf-8-sig, i - iso-8859-1, a - ascii")
@@ -2,6 +2,9 @@ from typing import Callable, TextIO, List
 
 import pytest
 import os, os.path
+import shutil
+import copy
+import re
 
 import MzChess
 import chess
@@ -20,7 +23,327 @@ def test_pgnLexer(pytestconfig):
  pgn = pytest.helpers.findPGNTextIO(pytestconfig)
  lexer = MzChess.PGNLexer(bufsize = 4096, debug =  pytestconfig.getoption('debug'), optimize = False)
  tok = lexer.newGame(pgn)
- lexer.dumps(tok = tok, notify = print)
+ plyDump = lexer.dumps(tok = tok, notify = print)
+ pgn = pytest.helpers.findPGNTextIO(pytestconfig)
+ optimizedLexer = MzChess.PGNLexer(bufsize = 4096)
+ assert optimizedLexer.dumps(tok = optimizedLexer.newGame(pgn)) == plyDump, 'optimized lexer: token streams differ'
+ assert os.path.isfile(os.path.join(MzChess.PGNLexer.lextabDir(), MzChess.PGNLexer.lextabName + '.py')), 'lextab not cached'
+ pgn = pytest.helpers.findPGNTextIO(pytestconfig)
+ regexLexer = MzChess.PGNLexer(bufsize = 4096, backend = 'regex')
+ assert regexLexer.dumps(tok = regexLexer.newGame(pgn)) == plyDump, 'regex lexer: token streams differ'
+
+def test_pgnIndex(pytestconfig, tmp_path, monkeypatch):
+ if 'i' not in pytestconfig.getoption('target'):
+  pytest.skip('Index test not activated')
+  return
+ pgnFile = pytest.helpers.findPGNFile(pytestconfig)
+ encoding = pytest.helpers.findEncoding(pytestconfig)
+ pgnList = pytest.helpers.loadPGN(pgnFile, encoding = encoding)
+ pgnIndex = MzChess.PGNIndex.open(pgnFile, encoding = encoding, useSidecar = False)
+ assert len(pgnIndex) == len(pgnList), 'len(pgnIndex) = {} != len(pgnList) = {}'.format(len(pgnIndex), len(pgnList))
+ for gameID, game in enumerate(pgnList):
+  indexedGame = MzChess.read_game_at(pgnIndex, gameID)
+  assert str(indexedGame) == str(game), 'game #{} differs'.format(gameID + 1)
+  assert pgnIndex.readHeaders(gameID)['Event'] == game.headers['Event'], 'headers of game #{} differ'.format(gameID + 1)
+ gameList = MzChess.IndexedGameList(pgnIndex, cacheSize = 2)
+ for gameID, game in enumerate(pgnList):
+  assert gameList.headers(gameID)['White'] == game.headers['White'], 'headers of game #{} differ'.format(gameID + 1)
+ selectedGame = gameList.pin(0)
+ for gameID in range(len(gameList)):
+  gameList[gameID]
+ assert gameList.index(selectedGame) == 0, 'pinned game evicted'
+ savedFile = os.path.join(str(tmp_path), 'saved.pgn')
+ shutil.copyfile(pgnFile, savedFile)
+ gameList = MzChess.IndexedGameList(MzChess.PGNIndex.open(savedFile, encoding = encoding, useSidecar = False))
+ gameList[len(gameList) - 1].headers['Event'] = 'Modified'
+ gameList.setDirty(len(gameList) - 1)
+ gameList.append(chess.pgn.Game())
+ savedIndex = gameList.savePGN(savedFile, encoding = encoding)
+ scannedIndex = MzChess.PGNIndex.open(savedFile, encoding = encoding, useSidecar = False)
+ assert list(savedIndex.offsetArray) == list(scannedIndex.offsetArray), 'offsets of saved file differ'
+ assert list(savedIndex.headerSizeArray) == list(scannedIndex.headerSizeArray), 'header sizes of saved file differ'
+ for key in MzChess.HeaderIndex.keys:
+  assert [savedIndex.headerIndex.value(key, n) for n in range(len(savedIndex))] == [scannedIndex.headerIndex.value(key, n) for n in range(len(scannedIndex))], 'header index of saved file differs'
+ savedList = pytest.helpers.loadPGN(savedFile, encoding = encoding)
+ assert [str(game) for game in savedList] == [str(game) for game in gameList], 'saved games differ'
+ def failingReplace(src, dst):
+  raise OSError('replace failed')
+ with open(savedFile, mode = 'rb') as f:
+  savedBytes = f.read()
+ fileList = sorted(os.listdir(str(tmp_path)))
+ gameList = MzChess.IndexedGameList(savedIndex)
+ gameList.entries.reverse()
+ monkeypatch.setattr(os, 'replace', failingReplace)
+ with pytest.raises(OSError):
+  gameList.savePGN(savedFile, encoding = encoding)
+ monkeypatch.undo()
+ with open(savedFile, mode = 'rb') as f:
+  assert f.read() == savedBytes, 'failed save modified the file'
+ assert sorted(os.listdir(str(tmp_path))) == fileList, 'failed save left a temporary file'
+ gameList = MzChess.IndexedGameList(savedIndex)
+ gameList.append(chess.pgn.Game())
+ savedIndex = gameList.savePGN(savedFile, encoding = encoding)
+ with open(savedFile, mode = 'rb') as f:
+  assert f.read().startswith(savedBytes), 'appending rewrote the file'
+ savedList = pytest.helpers.loadPGN(savedFile, encoding = encoding)
+ assert [str(game) for game in savedList] == [str(game) for game in gameList], 'appended games differ'
+
+def test_headerIndex(pytestconfig):
+ if 'i' not in pytestconfig.getoption('target'):
+  pytest.skip('Index test not activated')
+  return
+ pgnFile = pytest.helpers.findPGNFile(pytestconfig)
+ encoding = pytest.helpers.findEncoding(pytestconfig)
+ pgnList = pytest.helpers.loadPGN(pgnFile, encoding = encoding)
+ gameList = MzChess.IndexedGameList(MzChess.PGNIndex.open(pgnFile, encoding = encoding, useSidecar = False))
+ headerIndex = gameList.headerIndex()
+ assert len(headerIndex) == len(pgnList), 'len(headerIndex) = {} != len(pgnList) = {}'.format(len(headerIndex), len(pgnList))
+ newGame = chess.pgn.Game()
+ newGame.headers['White'] = 'aaa'
+ gameList.append(newGame)
+ gameList.headers(0)['White'] = 'zzz'
+ gameList.setDirty(0)
+ headersList = [gameList.headers(row) for row in range(len(gameList))]
+ entries = gameList.headerEntries()
+ for key in ('White', 'Result'):
+  sortedRows = sorted(range(len(headersList)), key = lambda row: headersList[row].get(key, '?').casefold())
+  assert headerIndex.sortRows(key, entries) == sortedRows, 'rows sorted by {} differ'.format(key)
+ sortedRows = sorted(range(len(headersList)), key = lambda row: MzChess.HeaderIndex.number('Date', headersList[row]['Date']), reverse = True)
+ assert headerIndex.sortRows('Date', entries, reverse = True) == sortedRows, 'rows sorted by Date differ'
+ white = headersList[1]['White']
+ filteredRows = [row for row, headers in enumerate(headersList) if headers['White'] == white]
+ assert headerIndex.filterRows('White', lambda value: value == white, entries) == filteredRows, 'filtered rows differ'
+
+def test_positionIndex(pytestconfig, tmp_path):
+ if 'i' not in pytestconfig.getoption('target'):
+  pytest.skip('Index test not activated')
+  return
+ pgnFile = pytest.helpers.findPGNFile(pytestconfig)
+ encoding = pytest.helpers.findEncoding(pytestconfig)
+ pgnList = pytest.helpers.loadPGN(pgnFile, encoding = encoding)
+ savedFile = os.path.join(str(tmp_path), 'saved.pgn')
+ shutil.copyfile(pgnFile, savedFile)
+ pgnIndex = MzChess.PGNIndex.open(savedFile, encoding = encoding, useSidecar = False)
+ positionIndex = MzChess.PositionIndex.open(pgnIndex)
+ assert MzChess.PositionIndex(savedFile).load(), 'sidecar file not loaded'
+ storeIndex = MzChess.PositionIndex.open(MzChess.GameStore.create(os.path.join(str(tmp_path), 'saved.ppgn'), pgnList))
+ board = pgnList[-1].board()
+ for move in list(pgnList[-1].mainline_moves())[:8]:
+  board.push(move)
+ foundGames = [(gameID, MzChess.PositionIndex.gamePly(game, board)) for gameID, game in enumerate(pgnList) if MzChess.PositionIndex.gamePly(game, board) is not None]
+ assert positionIndex.find(board) == foundGames, 'games with position differ'
+ assert storeIndex.find(board) == foundGames, 'games with position of store differ'
+ gameList = MzChess.IndexedGameList(pgnIndex)
+ gameList.entries.reverse()
+ gameList.append(pgnList[-1])
+ foundRows = [(len(pgnList) - 1 - gameID, ply) for gameID, ply in reversed(foundGames)] + [(len(pgnList), foundGames[-1][1])]
+ assert positionIndex.findRows(gameList, board) == foundRows, 'rows with position differ'
+ assert MzChess.PositionIndex().findRows(gameList, board) == foundRows, 'rows with position differ without index'
+
+def test_openingTree(pytestconfig, tmp_path):
+ if 'i' not in pytestconfig.getoption('target'):
+  pytest.skip('Index test not activated')
+  return
+ pgnFile = pytest.helpers.findPGNFile(pytestconfig)
+ encoding = pytest.helpers.findEncoding(pytestconfig)
+ pgnList = pytest.helpers.loadPGN(pgnFile, encoding = encoding)
+ savedFile = os.path.join(str(tmp_path), 'saved.pgn')
+ shutil.copyfile(pgnFile, savedFile)
+ pgnIndex = MzChess.PGNIndex.open(savedFile, encoding = encoding, useSidecar = False)
+ positionIndex = MzChess.PositionIndex.open(pgnIndex)
+ openingTree = MzChess.OpeningTree.open(positionIndex, pgnIndex.headerIndex, maxPly = 12)
+ assert MzChess.OpeningTree(savedFile, maxPly = 12).load(positionIndex), 'sidecar file not loaded'
+ boardList = [pgnList[-1].board()]
+ for move in list(pgnList[-1].mainline_moves())[:6]:
+  boardList.append(boardList[-1].copy())
+  boardList[-1].push(move)
+ # results are compared separately, as the Result tag may differ from the game termination
+ withoutScore = lambda statList: [(move, count, elo) for move, count, _, elo in statList]
+ listTree = MzChess.OpeningTree(maxPly = 12)
+ listTree.synchronize(pgnList)
+ for board in boardList:
+  assert withoutScore(openingTree.statistics(board)) == withoutScore(listTree.statistics(board)), 'statistics of {} differ'.format(board.fen())
+ for move, count, score, _ in openingTree.statistics(boardList[0]):
+  gameIDs = [gameID for gameID, game in enumerate(pgnList) if game.board() == boardList[0] and game.next() is not None and game.next().move == move]
+  results = [pgnIndex.headerIndex.value('Result', gameID) for gameID in gameIDs if pgnIndex.headerIndex.value('Result', gameID) != '*']
+  assert count == len(gameIDs), 'games of {} differ'.format(move.uci())
+  expectedScore = sum({'1-0' : 1, '1/2-1/2' : 0.5}.get(result, 0) for result in results)/len(results) if len(results) > 0 else None
+  assert score == expectedScore, 'score of {} differs'.format(move.uci())
+ gameList = MzChess.IndexedGameList(pgnIndex)
+ gameList.setDirty(0)
+ game = gameList[0]
+ game.headers['Result'] = '0-1'
+ mainline = list(game.mainline())
+ if len(mainline) > 1:
+  mainline[1].variations = list()
+ if len(gameList) > 1:
+  del gameList.entries[1]
+ gameList.append(pgnList[-1])
+ openingTree.synchronize(gameList, [0])
+ listTree = MzChess.OpeningTree(maxPly = 12)
+ listTree.synchronize(list(gameList))
+ for board in boardList:
+  assert withoutScore(openingTree.statistics(board)) == withoutScore(listTree.statistics(board)), 'statistics of {} differ after changes'.format(board.fen())
+
+def test_gameStore(pytestconfig, tmp_path):
+ if 'd' not in pytestconfig.getoption('target'):
+  pytest.skip('Game store test not activated')
+  return
+ pgnFile = pytest.helpers.findPGNFile(pytestconfig)
+ encoding = pytest.helpers.findEncoding(pytestconfig)
+ pgnList = pytest.helpers.loadPGN(pgnFile, encoding = encoding)
+ storeFile = os.path.join(str(tmp_path), 'store.ppgn')
+ gameStore = MzChess.GameStore.create(storeFile, pgnList)
+ assert MzChess.GameStore.isStore(storeFile), 'magic not written'
+ assert len(gameStore) == len(pgnList), 'len(gameStore) = {} != len(pgnList) = {}'.format(len(gameStore), len(pgnList))
+ for gameID, game in enumerate(pgnList):
+  assert str(gameStore.readGame(gameID)) == str(game), 'game #{} differs'.format(gameID + 1)
+  assert dict(gameStore.readHeaders(gameID)) == dict(game.headers), 'headers of game #{} differ'.format(gameID + 1)
+ gameStore.rewrite(0, pgnList[-1])
+ gameStore.append(pgnList[0])
+ gameStore = MzChess.GameStore(storeFile)
+ assert len(gameStore) == len(pgnList) + 1, 'game not appended'
+ assert str(gameStore.readGame(0)) == str(pgnList[-1]), 'game not rewritten'
+ assert str(gameStore.readGame(len(pgnList))) == str(pgnList[0]), 'appended game differs'
+ storedGames = [str(gameStore.readGame(gameID)) for gameID in range(len(gameStore))]
+ def failingWriteTable(f):
+  raise IOError('interrupted')
+ gameStore._writeTable = failingWriteTable
+ movedGame = copy.deepcopy(pgnList[0])
+ movedGame.comment = 'x' * (gameStore.capacityArray[0] + 1)
+ with pytest.raises(IOError):
+  gameStore.rewrite(0, movedGame)
+ with pytest.raises(IOError):
+  gameStore.append(pgnList)
+ assert len(gameStore) == len(storedGames), 'interrupted append changed the store'
+ gameStore = MzChess.GameStore(storeFile)
+ assert [str(gameStore.readGame(gameID)) for gameID in range(len(gameStore))] == storedGames, 'store changed by an interrupted write'
+ longGame = chess.pgn.Game()
+ longGame.headers['Annotator'] = 'x' * (1 << 16)
+ with pytest.raises(ValueError):
+  gameStore.append(longGame)
+ gameList = MzChess.IndexedGameList(gameStore, cacheSize = 2)
+ gameList.entries.reverse()
+ gameStore = MzChess.GameStore.create(storeFile, gameList)
+ assert str(gameStore.readGame(0)) == str(pgnList[0]), 'copied game differs'
+
+def test_recoveryJournal(pytestconfig, tmp_path):
+ if 'd' not in pytestconfig.getoption('target'):
+  pytest.skip('Game store test not activated')
+  return
+ pgnFile = pytest.helpers.findPGNFile(pytestconfig)
+ encoding = pytest.helpers.findEncoding(pytestconfig)
+ gameList = MzChess.IndexedGameList(MzChess.PGNIndex.open(pgnFile, encoding = encoding, useSidecar = False))
+ journalFile = os.path.join(str(tmp_path), 'recover.journal')
+ journal = MzChess.RecoveryJournal(journalFile, compactSize = 4096)
+ journal.start(gameList, pgnFile, encoding)
+ game = gameList.pin(0)
+ for n in range(8):
+  game.comment = 'edit #{}'.format(n)
+  journal.record(gameList, [0])
+ rowCount = len(gameList)
+ if rowCount > 1:
+  gameList.entries.insert(0, gameList.entries.pop())
+  journal.recordMove(gameList, range(rowCount - 1, rowCount), 0)
+ if rowCount > 2:
+  gameList.entries[1:3] = [gameList.entries[2], gameList.entries[1]]
+  journal.recordMove(gameList, range(1, 2), 3)
+ del gameList.entries[rowCount - 1]
+ journal.recordRemove(gameList, [rowCount - 1])
+ gameList.append(chess.pgn.Game())
+ journal.recordAppend(gameList)
+ game = gameList.pin(len(gameList) - 1)
+ game.comment = 'edit of an appended game'
+ journal.record(gameList, [len(gameList) - 1])
+ recoveredList = MzChess.RecoveryJournal(journalFile).replay()
+ assert len(recoveredList) == len(gameList), 'len(recoveredList) = {} != len(gameList) = {}'.format(len(recoveredList), len(gameList))
+ for gameID in range(len(gameList)):
+  assert str(recoveredList[gameID]) == str(gameList[gameID]), 'game #{} differs'.format(gameID + 1)
+
+def test_readGamesParallel(pytestconfig, tmp_path):
+ if 'p' not in pytestconfig.getoption('target'):
+  pytest.skip('Parallel parsing test not activated')
+  return
+ pgnFile = pytest.helpers.findPGNFile(pytestconfig)
+ encoding = pytest.helpers.findEncoding(pytestconfig)
+ pgnList = pytest.helpers.loadPGN(pgnFile, encoding = encoding)
+ gameList = list(MzChess.read_games_parallel(pgnFile, encoding = encoding, processes = 2, chunkSize = 65536))
+ assert len(gameList) == len(pgnList), 'len(gameList) = {} != len(pgnList) = {}'.format(len(gameList), len(pgnList))
+ for gameID, (game, pgnGame) in enumerate(zip(gameList, pgnList)):
+  assert str(game) == str(pgnGame), 'game #{} differs'.format(gameID + 1)
+ headersList = list(MzChess.read_games_parallel(pgnFile, encoding = encoding, Visitor = chess.pgn.HeadersBuilder, processes = 2, chunkSize = 65536))
+ assert [headers['Event'] for headers in headersList] == [game.headers['Event'] for game in pgnList]
+ unusualFile = os.path.join(str(tmp_path), 'unusual.pgn')
+ with open(unusualFile, mode = 'w', encoding = 'utf-8') as f:
+  for gameID in range(200):
+   f.write('{}[{}Event "Game {}"]\n[Result "*"]\n\n1. e4 e5 *\n\n'.format(' ' if gameID % 3 == 1 else '', '\t' if gameID % 2 == 1 else '', gameID))
+ eventList = [headers['Event'] for headers in MzChess.read_games_parallel(unusualFile, Visitor = chess.pgn.HeadersBuilder, processes = 2, chunkSize = 256)]
+ assert eventList == ['Game {}'.format(gameID) for gameID in range(200)]
+
+def test_writeGamesParallel(pytestconfig, tmp_path):
+ if 'p' not in pytestconfig.getoption('target'):
+  pytest.skip('Parallel parsing test not activated')
+  return
+ pgnFile = pytest.helpers.findPGNFile(pytestconfig)
+ encoding = pytest.helpers.findEncoding(pytestconfig)
+ pgnList = pytest.helpers.loadPGN(pgnFile, encoding = encoding)
+ targetFile = os.path.join(str(tmp_path), 'exported.pgn')
+ count = MzChess.write_games_parallel(pgnFile, targetFile, encoding = encoding, targetEncoding = 'utf-8-sig', processes = 2, chunkSize = 65536)
+ assert count == len(pgnList), 'count = {} != len(pgnList) = {}'.format(count, len(pgnList))
+ exportedList = pytest.helpers.loadPGN(targetFile, encoding = 'utf-8-sig')
+ assert [str(game) for game in exportedList] == [str(game) for game in pgnList], 'exported games differ'
+ white = pgnList[-1].headers['White']
+ board = pgnList[-1].board()
+ for move in list(pgnList[-1].mainline_moves())[:4]:
+  board.push(move)
+ count = MzChess.write_games_parallel(pgnFile, targetFile, encoding = encoding, 
+                      headerFilter = MzChess.HeaderFilter({'White' : '^{}$'.format(re.escape(white))}), 
+                      positionFilter = MzChess.PositionFilter(board.fen()), processes = 2, chunkSize = 65536)
+ filteredList = [game for game in pgnList if game.headers['White'] == white and MzChess.PositionIndex.gamePly(game, board) is not None]
+ exportedList = pytest.helpers.loadPGN(targetFile, encoding = encoding)
+ assert count == len(filteredList), 'count = {} != len(filteredList) = {}'.format(count, len(filteredList))
+ assert [str(game) for game in exportedList] == [str(game) for game in filteredList], 'filtered games differ'
+
+def test_pgnReader(pytestconfig):
+ if 'r' not in pytestconfig.getoption('target'):
+  pytest.skip('Reader test not activated')
+  return
+ pgnFile = pytest.helpers.findPGNFile(pytestconfig)
+ encoding = pytest.helpers.findEncoding(pytestconfig)
+ pgnList = pytest.helpers.loadPGN(pgnFile, encoding = encoding)
+ reader1 = MzChess.PGNReader(open(pgnFile, mode = 'r', encoding = encoding))
+ reader2 = MzChess.PGNReader(open(pgnFile, mode = 'r', encoding = encoding))
+ for gameID, game in enumerate(pgnList):
+  assert str(reader1.read_game()) == str(game), 'reader1: game #{} differs'.format(gameID + 1)
+  headers = reader2.read_headers()
+  # read_game replaces an unknown Result by the game termination marker, the headers are taken verbatim
+  if headers.get('Result') == '*':
+   headers['Result'] = game.headers['Result']
+  assert headers == game.headers, 'reader2: headers of game #{} differ'.format(gameID + 1)
+ assert reader1.read_game() is None
+ assert reader2.read_game() is None
+ mappedReader = MzChess.PGNReader.mapFile(pgnFile, encoding = encoding)
+ for gameID, game in enumerate(pgnList):
+  assert str(mappedReader.read_game()) == str(game), 'mappedReader: game #{} differs'.format(gameID + 1)
+ assert mappedReader.read_game() is None
+ plyReader = MzChess.PGNReader(open(pgnFile, mode = 'r', encoding = encoding))
+ scanReader = MzChess.PGNReader.mapFile(pgnFile, encoding = encoding)
+ for gameID in range(len(pgnList)):
+  assert scanReader.read_headers() == plyReader.read_game(Visitor = chess.pgn.HeadersBuilder), 'scanReader: headers of game #{} differ'.format(gameID + 1)
+ assert scanReader.read_headers() is None
+ regexReader = MzChess.PGNReader(open(pgnFile, mode = 'r', encoding = encoding), backend = 'regex')
+ for gameID, game in enumerate(pgnList):
+  assert str(regexReader.read_game()) == str(game), 'regexReader: game #{} differs'.format(gameID + 1)
+ assert regexReader.read_game() is None
+ sanCache = MzChess.SANCache(maxSize = 16)
+ cachedReader = MzChess.PGNReader(open(pgnFile, mode = 'r', encoding = encoding), sanCache = sanCache)
+ for gameID, game in enumerate(pgnList):
+  assert str(cachedReader.read_game()) == str(game), 'cachedReader: game #{} differs'.format(gameID + 1)
+ assert len(sanCache) <= 16, 'SANCache exceeds maxSize'
+ print(sanCache.statistics())
+ boardReader = MzChess.PGNReader(open(pgnFile, mode = 'r', encoding = encoding))
+ for gameID, game in enumerate(pgnList):
+  assert boardReader.read_board().fen() == game.end().board().fen(), 'boardReader: board of game #{} differs'.format(gameID + 1)
 
 def test_readGame(pytestconfig):
  def runNode(readFct : Callable, f : TextIO,  gameID : int):
@@ -3,6 +3,9 @@ from typing import Callable, TextIO, List
 import pytest
 
 import os, os.path
+import sys
+import platform
+import asyncio
 from PyQt6 import QtCore
 
 import MzChess
@@ -11,12 +14,7 @@ import chess
 def runUciEngine(executable : str, fenList : List[str]) -> None:
  print('runUciEngine: {}\n fenList = {}'.format(executable, fenList))
  def waitForData(engine):
-  for i in range(100):
-   QtCore.QThread.msleep(engine.timeout_msec)
-   QtCore.QCoreApplication.processEvents()
-   if engine.isReady():
-    return
-   print('----> waiting {} * {} ms'.format(i, engine.timeout_msec))
+  assert engine.waitForReady(100*engine.timeout_msec), 'no response within {} ms'.format(100*engine.timeout_msec)
 
  def printPlayResult(engine):
   playResult = engine.playResult
@@ -107,3 +105,228 @@ def test_uciEngine(qtbot, pytestconfig):
  runUciEngine(uciEngine, fenList)
  return
 
+
+def test_annotatePool(qtbot, pytestconfig):
+ uciEngine = pytestconfig.getoption("--uciEngine")
+ if uciEngine is None:
+  pytest.skip('uciEngine not specified')
+  return
+ if not os.path.isabs(uciEngine): 
+  home = pytestconfig.getoption("--home")
+  uciEngine = os.path.join(home, uciEngine) 
+ if not os.path.exists(uciEngine):
+  raise IOError('Engine {} not found'.format(uciEngine))
+  return
+ pgnFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ps210427.pgn')
+ gameList = list()
+ with open(pgnFile, mode = 'r', encoding = 'iso-8859-1') as pgn:
+  while len(gameList) < 4:
+   game = MzChess.read_game(pgn)
+   if game is None:
+    break
+   gameList.append(game)
+ pool = MzChess.AnnotatePool((uciEngine, dict()), numberOfEngines = 2, limit = chess.engine.Limit(depth = 6), notifyFunction = print)
+ pool.setup(MzChess.Annotator('test'))
+ annotatedList = list()
+ pool.gameAnnotatedSignal.connect(lambda gameID, game: annotatedList.append(gameID))
+ assert pool.run(gameList)
+ pool.quit()
+ assert sorted(annotatedList) == list(range(len(gameList)))
+ assert pool.positionsAnalysed == sum(len(list(game.mainline())) for game in gameList)
+ for game in gameList:
+  for gameNode in game.mainline():
+   assert '[%eval ' in gameNode.comment
+ positionsPerSecond, gamesPerSecond = pool.throughput()
+ assert positionsPerSecond > 0 and gamesPerSecond > 0
+
+def test_asyncEngine(pytestconfig):
+ uciEngine = pytestconfig.getoption("--uciEngine")
+ if uciEngine is None:
+  pytest.skip('uciEngine not specified')
+  return
+ if not os.path.isabs(uciEngine): 
+  home = pytestconfig.getoption("--home")
+  uciEngine = os.path.join(home, uciEngine) 
+ if not os.path.exists(uciEngine):
+  raise IOError('Engine {} not found'.format(uciEngine))
+  return
+ fenList = [
+  "3rr3/2p3p1/4N3/3b4/1p3P2/2PBB3/kPQ3PP/3R2K1 w - - 0 1", 
+  "rn3r1k/pp4pp/2p1Q2N/q2np3/4N2P/2PP4/PP3P2/R3K2R w KQ - 0 1", 
+  "r2rkn2/1R1N2p1/2p1B2p/4p1PP/p1P2b2/5P2/P3K3/1R6 w - - 0 1"
+  ]
+ resultList = asyncio.run(MzChess.analysePositions((uciEngine, dict()), fenList, numberOfEngines = 2, limit = chess.engine.Limit(depth = 8)))
+ assert len(resultList) == len(fenList)
+ for fen, playResult in zip(fenList, resultList):
+  assert playResult is not None and playResult.move in chess.Board(fen).legal_moves
+
+fakeEngineSource = """
+import os, sys
+import chess
+board = chess.Board()
+multiPV = 1
+failFile = ''
+failMode = 'exit'
+goCount = 0
+for line in sys.stdin:
+ tokens = line.split()
+ if len(tokens) == 0:
+  continue
+ if tokens[0] == 'uci':
+  print('id name FakeEngine')
+  print('id author MzChess')
+  print('option name MultiPV type spin default 1 min 1 max 8')
+  print('option name FailFile type string default <empty>')
+  print('option name FailMode type combo default exit var exit var stall')
+  print('uciok')
+ elif tokens[0] == 'isready':
+  print('readyok')
+ elif tokens[0] == 'setoption' and tokens[2] == 'MultiPV':
+  multiPV = int(tokens[4])
+ elif tokens[0] == 'setoption' and tokens[2] == 'FailFile':
+  failFile = ' '.join(tokens[4:])
+ elif tokens[0] == 'setoption' and tokens[2] == 'FailMode':
+  failMode = tokens[4]
+ elif tokens[0] == 'position':
+  board = chess.Board(' '.join(tokens[2:8])) if tokens[1] == 'fen' else chess.Board()
+  if 'moves' in tokens:
+   for move in tokens[tokens.index('moves') + 1:]:
+    board.push_uci(move)
+ elif tokens[0] == 'go':
+  goCount += 1
+  if failFile and goCount == 3:
+   try:
+    os.close(os.open(failFile, os.O_CREAT | os.O_EXCL))
+    if failMode == 'exit':
+     sys.exit(1)
+    continue
+   except FileExistsError:
+    pass
+  moveList = sorted(board.legal_moves, key = lambda move: move.uci())
+  if len(moveList) == 0:
+   print('info depth 0 score {}'.format('mate 0' if board.is_checkmate() else 'cp 0'))
+  for n, move in enumerate(moveList[:multiPV]):
+   print('info depth 1 multipv {} score cp {} pv {}'.format(n + 1, 20 - n, move.uci()))
+  print('bestmove {}'.format(moveList[0].uci() if len(moveList) > 0 else '(none)'))
+ elif tokens[0] == 'quit':
+  break
+ sys.stdout.flush()
+"""
+
+def fakeEngine(tmp_path) -> str:
+ if platform.system() == 'Windows':
+  pytest.skip('fake engine requires a script interpreter line')
+ executable = os.path.join(str(tmp_path), 'fakeEngine.py')
+ with open(executable, mode = 'w', encoding = 'utf-8') as f:
+  f.write('#!{}\n'.format(sys.executable))
+  f.write(fakeEngineSource)
+ os.chmod(executable, 0o755)
+ return executable
+
+def test_asyncEngineScores(tmp_path):
+ executable = fakeEngine(tmp_path)
+ notifications = list()
+ fenList = [chess.STARTING_FEN] * 3
+ for multiPV in (1, 3):
+  resultList = asyncio.run(MzChess.analysePositions((executable, dict()), fenList, 
+    numberOfEngines = 2, limit = chess.engine.Limit(depth = 1), multiPV = multiPV, notifyFunction = notifications.append))
+  assert all(playResult is not None and playResult.move in chess.Board().legal_moves for playResult in resultList)
+ assert notifications == ['{}: score = 20'.format(chess.STARTING_FEN)] * 6
+ async def playAndScore():
+  engine = await MzChess.AsyncChessEngine.create((executable, dict()), limit = chess.engine.Limit(depth = 1))
+  try:
+   playResult = await engine.play(moves = [chess.Move.from_uci('e2e4')])
+   return playResult, engine.getScore(0), engine.getScore(1), engine.getInfoList()
+  finally:
+   await engine.quit()
+ playResult, score, hintScore, infoList = asyncio.run(playAndScore())
+ assert playResult.move in chess.Board('rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1').legal_moves
+ assert isinstance(playResult.info, dict) and len(infoList) == 1
+ assert score == '-20' and hintScore is None
+
+def test_analysisCache(tmp_path):
+ cacheFile = os.path.join(str(tmp_path), 'analysis.sqlite')
+ cache = MzChess.AnalysisCache(cacheFile, maxEntries = 10)
+ limit = chess.engine.Limit(depth = 8)
+ board = chess.Board()
+ key = cache.key(board, 'engine', {'Threads' : 1}, limit)
+ assert cache.get(key) is None
+ playResult = chess.engine.PlayResult(chess.Move.from_uci('e2e4'), chess.Move.from_uci('e7e5'))
+ playResult.info = [{'score' : chess.engine.PovScore(chess.engine.Cp(30), chess.WHITE), 'pv' : [chess.Move.from_uci('e2e4')]}]
+ cache.put(key, playResult)
+ cachedResult = cache.get(key)
+ assert cachedResult.move == playResult.move and cachedResult.ponder == playResult.ponder
+ assert cachedResult.info == playResult.info
+ assert cache.get(cache.key(board, 'engine', {'Threads' : 2}, limit)) is None
+ assert cache.get(cache.key(board, 'engine', {'Threads' : 1}, chess.engine.Limit(depth = 9))) is None
+ assert (cache.hits, cache.misses) == (1, 3)
+ for move in list(board.legal_moves)[:12]:
+  board.push(move)
+  cache.put(cache.key(board, 'engine', {'Threads' : 1}, limit), playResult)
+  board.pop()
+ assert len(cache) <= 10
+ assert cache.get(key) is None
+ cache.close()
+ cache = MzChess.AnalysisCache(cacheFile, maxEntries = 10)
+ assert len(cache) > 0
+ cache.close()
+
+def test_uciProtocolCache():
+ class CommandLog(MzChess.UCIProtocol):
+  def __init__(self):
+   self.setLog(None)
+   self.board = chess.Board()
+   self.limit = chess.engine.Limit(depth = 8)
+   self.playResult = None
+   self.readyok = True
+   self.isrunning = False
+   self.stdoutLines = list()
+   self.infoDict = dict()
+   self.optionValues = dict()
+   self.commandList = list()
+
+  def _toStdin(self, txt):
+   self.commandList.append(txt)
+   return True
+
+ protocol = CommandLog()
+ protocol.setAnalysisCache(MzChess.AnalysisCache())
+ move = chess.Move.from_uci('e2e4')
+ for n in range(2):
+  protocol.uciNewGame()
+  assert protocol.uciGo()
+  if n == 0:
+   assert protocol.commandList[-1] == 'go depth 8'
+   for line in ('info depth 8 multipv 1 score cp 30 pv e2e4', 'bestmove e2e4'):
+    protocol._processLine(line)
+  else:
+   assert protocol.commandList[-1] != 'go depth 8', 'cached position searched again'
+  assert protocol.readyok and protocol.playResult.move == move and protocol.bestMoveScore == (move, '30')
+ assert (protocol.analysisCache.hits, protocol.analysisCache.misses) == (1, 1)
+
+@pytest.mark.parametrize('failMode', ['exit', 'stall'])
+def test_annotatePoolFailure(qtbot, tmp_path, failMode):
+ executable = fakeEngine(tmp_path)
+ failFile = os.path.join(str(tmp_path), 'failed')
+ pgnFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ps210427.pgn')
+ gameList = list()
+ with open(pgnFile, mode = 'r', encoding = 'iso-8859-1') as pgn:
+  while len(gameList) < 3:
+   gameList.append(MzChess.read_game(pgn))
+ pool = MzChess.AnnotatePool((executable, {'FailFile' : failFile, 'FailMode' : failMode}), numberOfEngines = 2, 
+                                                limit = chess.engine.Limit(depth = 1), notifyFunction = print, timeout_msec = 2000)
+ pool.setup(MzChess.Annotator('test'))
+ annotatedList = list()
+ pool.gameAnnotatedSignal.connect(lambda gameID, game: annotatedList.append(gameID))
+ assert pool.run(gameList), 'games lost by a failing engine'
+ assert os.path.exists(failFile), 'no engine failed'
+ assert len(pool) == 1, 'failing engine not removed'
+ assert sorted(annotatedList) == list(range(len(gameList)))
+ assert pool.positionsAnalysed == sum(len(list(game.mainline())) for game in gameList)
+ pool.quit()
+ pool = MzChess.AnnotatePool((executable, {'FailFile' : failFile + '1', 'FailMode' : failMode}), numberOfEngines = 1, 
+                                                limit = chess.engine.Limit(depth = 1), timeout_msec = 2000)
+ pool.setup(MzChess.Annotator('test'))
+ assert not pool.run(gameList), 'lost games not reported'
+ assert pool.gamesLost > 0 and [gameID for gameID, _ in pool.lostGames] == [0]
+ pool.quit()